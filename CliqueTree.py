@@ -5,15 +5,19 @@ import networkx as nx
 import pdb
 
 class CliqueTree(object):
-    'represent a Clique tree'
+    """ represent a Clique tree
+
+        The edges of the tree are kept as a list with the set of neighbors of each node, so a tree over thousands of
+        cliques doesn't need a dense N x N matrix. getEdges() still returns the adjacency matrix for code that wants
+        one; it is built on demand and cached until the edges change. setEdges() accepts an adjacency matrix too """
 
     def __init__(self, nodeList=[], edges=[], factorList=[],evidence=[]):
         self.nodeList=nodeList
-        self.edges=edges
         self.factorList=factorList
         self.evidence=evidence
         self.card= []
-        self.factorInds= []
+        self.schedule=None
+        self.setEdges(edges)
 
 
     def toString(self):
@@ -21,15 +25,40 @@ class CliqueTree(object):
         print 'nodes: ', self.nodeList
         print 'card: ', self.card
         print 'factorList: ', len( self.factorList)
-        print 'factorInds:', self.factorInds
-        print 'edges:\n',self.edges
+        print 'neighbors:', self.neighbors
         
         
     def setNodeList(self,nodeList):
         self.nodeList=nodeList
 
     def setEdges(self,edges):
-        self.edges=edges
+        """ set the edges from an adjacency matrix """
+        edges=np.asarray(edges)
+        if edges.size == 0:
+            self.setNeighbors( [] )
+        else:
+            self.setNeighbors( [ set( np.nonzero( edges[i,:] )[0].tolist() ) for i in range( edges.shape[0] ) ] )
+
+    def setNeighbors(self, neighbors):
+        """ set the edges from a list with the set of neighbors of each node """
+        self.neighbors=neighbors
+        self.edges=None
+        self.schedule=None
+
+    def addEdge(self, i, j):
+        self.neighbors[i].add(j)
+        self.neighbors[j].add(i)
+        self.edges=None
+        self.schedule=None
+
+    def setSchedule(self, schedule):
+        """ store a message passing schedule, a list of (i,j) pairs (see CliqueTreeSchedule).
+            It stays valid until the edges of the tree change """
+        self.schedule=schedule
+
+    def getSchedule(self):
+        """ the stored message passing schedule, None if there isn't one or the edges have changed since """
+        return self.schedule
 
     def setFactorList(self,factorList):
         self.factorList=factorList
@@ -50,8 +79,21 @@ class CliqueTree(object):
 
 
     def getEdges(self):
+        """ the adjacency matrix of the tree, built from the neighbor sets. The matrix is cached,
+            so don't modify it, use setEdges or addEdge to change the edges of the tree """
+        if self.edges is None:
+            N=len(self.neighbors)
+            self.edges=np.zeros( (N,N) )
+            for i in range(N):
+                self.edges[ i, list( self.neighbors[i] ) ]=1
         return self.edges
 
+    def getNeighbors(self, i=None):
+        """ the set of neighbors of node i, or the list of neighbor sets of all the nodes if i is None """
+        if i is None:
+            return self.neighbors
+        return self.neighbors[i]
+
     def getFactorList(self):
         return self.factorList
 
@@ -62,105 +104,51 @@ class CliqueTree(object):
     def getEvidence(self):
         return self.evidence
 
-    def incorporateEvidence(self):
+    def incorporateEvidence(self, reduceScope=False):
+        """ condition the factors of the tree on its evidence. By default the entries of the factors that
+            disagree with the evidence are zeroed (ObserveEvidence). If reduceScope is True the observed variables
+            are sliced out of the factors instead, all evidence in one pass (see ObserveEvidenceReduce) """
+        if reduceScope:
+            observed=[ [ j+1, self.evidence[j] ] for j in range( len(self.evidence) ) if self.evidence[j] > 0 ]
+            if len(observed) > 0:
+                self.factorList=ObserveEvidenceReduce( self.factorList, np.array(observed) )
+            return
         for j in range ( len(self.evidence)):
             k=j+1
             if self.evidence[j] > 0:
                 self.factorList=ObserveEvidence(self.factorList, np.matrix([[k, self.evidence[j] ]] ) )
     
 
-    def eliminateVar(self,Z,E,factorList):
+    def eliminateVar(self, Z, adjacency, scopes, varFactors):
         """ a variable elimination function
             based on https://github.com/indapa/PGM/blob/master/Prog4/EliminateVar.m
 
             Z is the variable to be eliminated. We base this code on the matlab file
             linked to above as well as the Sum-product VE pseudo code in Koller and Friedman
-            page 298
-
-            E is a numpy 2d matrix representing adjacency matrix of variables
-            It represents the induced VE graph
-            Once a variable is eliminated, its edges are removed from E
-
-            """
-
-        useFactors = []#the index of the factor that contains the variable Z
-        scope = []
-
-        #print 'Z: ', Z
-
-        
-        #get a list containining the index in self.factorLlist of factors
-        #that contain the variable Z to be eliminated
-        # get the scope of variables from the factors that contain variable Z
-        for i in range (len(factorList)):
-            
-            if Z in factorList[i].getVar().tolist():
-                useFactors.append(i)#the ith factor is being currently involved in elimination
-                scope=list(set.union(set(scope), factorList[i].getVar().tolist() ))
+            page 298. Only the scopes of the factors matter for the structure of the clique tree,
+            so no factor is actually multiplied or marginalized here.
 
-        
-        # update edge map
-        """ These represent the induced edges for the VE graph.
-         once the variable Z is eliminated, its edges are removed from the graph
-         but in the process of elimination, we create a new factor. This
-         introduces fill edges (see pg. 307 Koller and Friedman)
-         Z is one based, but the indices in E are zero based, hence Z-1
-         also the variable names in scope are 1 based, so we subtract 1 when
-         updating the induced VE graph """
-
-        for i in range ( len(scope)):
-            for j in range ( len(scope)):
-                if i != j:
-                    E[  scope[i]-1, scope[j]-1   ]=1
-                    E[ scope[j]-1,  scope[i]-1   ]=1
-        E[Z-1,:]=0
-        E[:,Z-1]=0
-
-        #G=nx.from_numpy_matrix(E)
-        #print 'induced graph edges:\n', (G.edges())
-        #nx.draw_shell(G)
-        #plt.show()
+            adjacency is a dict with the set of neighbors of each variable in the induced VE graph.
+            Once a variable is eliminated, it is removed from the graph and its neighbors are connected
+            to each other (the fill edges, see pg. 307 Koller and Friedman)
 
-        
-        #these are the indices of factorList which are not involved in VE
-        unusedFactors= list( set.difference ( set(range(len(factorList))), set(useFactors)    )   )
-        
-        newF=None
-        #check first if there are any unused factors left!
-        if len(unusedFactors) > 0:
-            newF=len(unusedFactors)*[None]
-            newmap=np.zeros(max(unusedFactors)+1,dtype=int).tolist()
-            
-            #newF is a new factor list, we populate it first
-            #with the unused factors
-            #newmap is maps the new location of ith unusedFactor
-            for i in range( len(unusedFactors)):
-                newF[i]=factorList[ unusedFactors[i] ]
-                newmap[ unusedFactors[i] ]= i
-            
-        #print 'newmap ', newmap,"\n"
-        #print 'length of newmap: ', len(newmap), "\n"
-
-        newFactor = Factor( [], [], [], 'newFactor')
-
-        #we multiple in all the factors that contain the variable Z
-        for i in range( len (useFactors)):
-            newFactor = FactorProduct(newFactor,factorList[ useFactors[i] ])
-        
+            scopes is a dict from a factor id to the set of variables of the factor, and varFactors a dict
+            from each variable to the ids of the factors that mention it. The factors with Z in their scope
+            are replaced by the factor that eliminating Z creates (tau), whose id is ('clique', i) where i is
+            the clique that created it.
 
-        #then we marginalize Z out and obtain a new factor
-        #then append it the end of newF, the new factor list
-        newFactor = FactorMarginalization( newFactor,[Z] )
-        #print 'newFactor: ',newFactor
-        #newF(length(nonUseFactors)+1) = newFactor;
-        if newFactor != None:
-            newF.append ( newFactor )
+            All three are updated in place. Returns the set of Z's neighbors, the variables whose
+            elimination score changed """
 
-        
+        #the ids of the factors that contain the variable Z to be eliminated
+        useFactors = varFactors.pop( Z )
 
-        if newF != None:
-            factorList=newF
-        #return E
+        #update the induced VE graph
+        neighbors = adjacency.pop( Z )
+        for u in neighbors:
+            adjacency[u].discard( Z )
+            adjacency[u].update( neighbors )
+            adjacency[u].discard( u )
 
         ########################################################################
         """ the remaining code builds the edges of the clique tree """
@@ -169,52 +157,25 @@ class CliqueTree(object):
             adding a  new node represents new clique.
             The scope of every factor generated during the variable elimination process is a clique pg. 309 Koller & Friedman """
 
-        self.nodeList.append ( scope )
-        
-        #newC is the total number of nodes in the clique tree
-        newC=len( self.nodeList )
-        #print 'newC: ', newC
-
-        #factorInds are individual factors with one variable ... I think
-        self.factorInds.append ( len(unusedFactors) + 1  )
-        
-
-        #print 'range( newC -1) ', range( newC-1  )
-        #print 'factorInds: ', self.factorInds
-        #print 'useFactors: ', useFactors
-        #pdb.set_trace()
-        """ we update the edges of the clique tree """
-        for i in range( newC -1 ):
-            
-            #if self.factorInds [ i ] -1 in useFactors:
-            #there was the off by onoe erorr - the values in factorInds
-            #were one-based, need to subtract 1
-            if self.factorInds [ i ] -1  in useFactors:
-                
-                self.edges[ i, newC-1 ] = 1
-                self.edges [ newC-1, i ] = 1
-                self.factorInds[ i ]  = 0
-            else:
-                if self.factorInds [i] != 0:
-                    #print 'i: ', i
-                    #print 'factorInds: ', self.factorInds
-                    #print 'newmap: ', newmap
-                    #print 'newmap [ self.factorInds[i] -1: ', newmap [ self.factorInds[i] -1 ]
-                    #print 'self.factorInds[ i ]  = newmap [ self.factorInds[i] - 1  ] + 1 '
-                    if len(unusedFactors) > 0:
-                        #self.factorInds[ i ]  = newmap [ self.factorInds[i] -1  ] +1
-                        self.factorInds[ i ]  = newmap [ self.factorInds[i] -1  ] +1
-                        #self.factorInds[ i ]  = newmap [ self.factorInds[i]   ]
-                    
-        #print 'factorInds right before returning: ', self.factorInds
-        return E, factorList
-
-        
-        
-        
-        
-        
-        
-
-
-        
+        scope = set( [ Z ] ).union( *[ scopes[f] for f in useFactors ] )
+        self.nodeList.append ( sorted( scope ) )
+        self.neighbors.append( set() )
+        self.edges=None
+        newC=len( self.nodeList ) - 1
+
+        """ the clique is connected to every clique whose tau factor it uses """
+        for f in useFactors:
+            if isinstance( f, tuple ):
+                self.addEdge( f[1], newC )
+            for v in scopes.pop( f ):
+                if v != Z:
+                    varFactors[v].discard( f )
+
+        """ tau is over the scope minus Z, when Z was the only variable left there is no tau """
+        tau=frozenset( scope.difference( [ Z ] ) )
+        if len(tau) > 0:
+            scopes[ ( 'clique', newC ) ]=tau
+            for v in tau:
+                varFactors[v].add( ( 'clique', newC ) )
+
+        return neighbors
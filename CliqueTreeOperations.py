@@ -1,62 +1,77 @@
+import sys
 import numpy as np
 from CliqueTree import *
 from FactorOperations import *
+from EliminationOrdering import *
+from MessageStore import *
+from Trace import *
 #import matplotlib.pyplot as plt
 import networkx as nx
+import heapq
 import pdb
 
-def createCliqueTree( factorList,E=[]):
+def createCliqueTree( factorList,E=[],order=None):
     """ return a Clique Tree object given a list of factors
         it peforms VE and returns the clique tree the VE
         ordering defines. See Chapter 9 of Friedman and Koller
-        Probabilistic Graphical Models"""
-
-    V=getUniqueVar(factorList)
-    
-    totalVars=len(V)
-    cardinality=np.zeros(len(V)).tolist()
-    for i in range(len(V)):
-        for j in range(len(factorList)):
-            try:
-                indx= factorList[j].getVar().tolist().index( V[i] )
-                cardinality[i]=factorList[j].getCard().tolist()[indx]
-                break
-            except:
-                continue
-
-    edges=np.zeros( (totalVars, totalVars))
+        Probabilistic Graphical Models
 
+        order is an optional elimination ordering (see EliminationOrdering.py).
+        Variables are eliminated in that order; those missing from it are eliminated
+        afterwards with the greedy min-neighbors choice
 
-    """ Set up adjacency matrix: for each factor, get the list of variables in its scope and create an edge between each variable in the factor """
-    for f in factorList:
-        variableList=f.getVar()
-        for j in range(len(variableList) ):
-            for k in range (len(variableList) ):
-                edges[ variableList[j]-1, variableList[k]-1 ]=1
+        Only scopes are involved: the induced graph is kept as sets of neighbors, the factors
+        mentioning each variable are indexed by variable and the min-neighbors choice comes off
+        a heap, so building the tree takes time and memory roughly linear in the size of the network"""
 
-    (nrows,nedges)=np.shape(edges)            
+    V=getUniqueVar(factorList)
+    
+    cards={}
+    scopes={} #factor id -> set of variables of the factor
+    varFactors=dict( [ (v, set()) for v in V ] ) #variable -> ids of the factors that mention it
+    adjacency=dict( [ (v, set()) for v in V ] ) #variable -> neighbors in the induced VE graph
+
+    """ Set up the adjacency sets: for each factor, get the list of variables in its scope and create an edge between each variable in the factor """
+    for j in range( len(factorList) ):
+        variableList=factorList[j].getVar().tolist()
+        for (v, c) in zip( variableList, factorList[j].getCard().tolist() ):
+            cards.setdefault( v, c )
+            varFactors[v].add( j )
+            adjacency[v].update( variableList )
+        scopes[j]=frozenset( variableList )
+    for v in V:
+        adjacency[v].discard( v )
+    cardinality=[ cards[v] for v in V ]
 
     C=CliqueTree()
     C.setCard( cardinality )
-    C.setEdges(np.zeros( (totalVars, totalVars)))
     C.setFactorList(factorList)
     C.setEvidence(E)
     C.setNodeList([])
-    #print 'length of factorList: ', len(factorList)
-    #print C.toString()
-    cliquesConsidered = 0
+
+    """ min-neighbors: the score of a variable is the number of its neighbors plus itself,
+        ties go to the smallest variable. Scores only change for the neighbors of an eliminated
+        variable, they get a fresh heap entry and stale entries are skipped when popped """
+    heap=[ ( len(adjacency[v]) + 1, v ) for v in V ]
+    heapq.heapify( heap )
+
+    if order is None:
+        order=[]
+    order=[ z for z in order if z in adjacency ]
     #pdb.set_trace()
-    while cliquesConsidered < len(V):
-        bestClique = 0
-        bestScore = sys.maxint
-        for i in range(nrows):
-            score=np.sum( edges[i,:] )
-            if score > 0 and score < bestScore:
-                bestScore = score
-                bestClique = i+1
-        cliquesConsidered+=1
+    while len(adjacency) > 0:
+        if len(order) > 0:
+            bestClique = order.pop(0)
+            if bestClique not in adjacency:
+                continue
+        else:
+            (bestScore, bestClique)=heapq.heappop( heap )
+            if bestClique not in adjacency or bestScore != len( adjacency[bestClique] ) + 1:
+                continue
     
-        (edges, factorList)=C.eliminateVar(bestClique, edges, factorList)
+        changed=C.eliminateVar(bestClique, adjacency, scopes, varFactors)
+        for u in changed:
+            heapq.heappush( heap, ( len(adjacency[u]) + 1, u ) )
 
     return C
 
@@ -66,56 +81,53 @@ def PruneTree ( C ):
         supersets of each other. E.g.: [A,B,E] -- [A,B] -- [A,D] 
         pruned: [A,B,E] -- [A,D] """
 
-    ctree_edges=C.getEdges()
-    (nrows,ncols)=np.shape( ctree_edges )
-    totalNodes=nrows
     Cnodes=C.getNodeList()
+    neighbors=[ set(nbs) for nbs in C.getNeighbors() ]
+    totalNodes=len(neighbors)
     
-    toRemove=[]
-    #print range( totalNodes )
+    toRemove=set()
 
     for i in range ( totalNodes ):
-        if i in toRemove: continue
-        #np.nonzero returns tuple, hence the [0]
+        cnodes_i=set( Cnodes[i] )
         #we collect the neighbors of the ith clique
-        neighborsI = np.nonzero ( ctree_edges[i,:] )[0].tolist()
-        for c in range ( len(neighborsI) ):
-            j= neighborsI[c]
+        for j in sorted( neighbors[i] ):
             assert ( i != j), 'i cannot equal j: PruneTree'
-            if j in toRemove: continue
             #here is where we look for superset neighboring nodes in the CTree
-            if sum (  [ x in Cnodes[j] for x in Cnodes[i] ]  ) == len( Cnodes[i] ):
-                for nk in neighborsI:
-                    cnodes_i = set ( Cnodes[i] )
-                    cnodes_nk= set ( Cnodes[nk] )
-                    if len( list ( set.intersection( cnodes_i, cnodes_nk) ) ) == len (Cnodes[i]):
-                        neighborsI_set=set( neighborsI )
-                        nk_set=set( [nk] )
-                        ctree_edges [ list( neighborsI_set - nk_set ), nk ] = 1
-                        ctree_edges [  nk, list( neighborsI_set - nk_set )] = 1
-                        break
-                ctree_edges[i,:]=0
-                ctree_edges[:,i]=0
-                toRemove.append(i)
-    toKeep =  list ( set ( range( totalNodes ) ) - set ( toRemove ) )
-    for indx in toRemove:
-        Cnodes[indx]=[]
-    Cnodes=[ item for item in Cnodes if len(item) > 0 ]
-    ctree_edges= ctree_edges[np.ix_(toKeep, toKeep)]
-
-    C.setNodeList( Cnodes )
-    C.setEdges( ctree_edges )
+            if cnodes_i.issubset( Cnodes[j] ):
+                #the other neighbors of i are connected to j, and i is dropped
+                for nk in neighbors[i]:
+                    neighbors[nk].discard( i )
+                    if nk != j:
+                        neighbors[nk].add( j )
+                        neighbors[j].add( nk )
+                neighbors[i]=set()
+                toRemove.add(i)
+                break
+    toKeep =  sorted ( set ( range( totalNodes ) ) - toRemove )
+    newIndex=dict( [ (old, new) for (new, old) in enumerate(toKeep) ] )
+
+    C.setNodeList( [ Cnodes[i] for i in toKeep ] )
+    C.setNeighbors( [ set( [ newIndex[k] for k in neighbors[i] ] ) for i in toKeep ] )
     #pdb.set_trace()
     #return the pruned tree with the updated nodes and edges
     return C
 
-def CliqueTreeObserveEvidence ( C, E ):
+def CliqueTreeObserveEvidence ( C, E, reduceScope=False ):
     """ given a CliqueTree object C and list of values E, which represent evidence, update
         the factors of the cliqueTree C to reflect the observed evidence.
         Note that ObserveEvidence in FactorOperations assumes E is a Nx2 matrix,
         here we build the Nx2 matrix by assuing the jth index of E is the evidence
-        for the variable j"""
+        for the variable j
+
+        If reduceScope is True the observed variables are sliced out of the factors
+        instead of zero-masked, see ObserveEvidenceReduce"""
     factorList= C.getFactorList()
+    if reduceScope:
+        observed=[ [ j+1, E[j] ] for j in range( len(E) ) if E[j] > 0 ]
+        if len(observed) > 0:
+            factorList=ObserveEvidenceReduce( factorList, np.array(observed) )
+        C.setFactorList(factorList)
+        return C
     for j in range ( len (E)):
         if E[j] > 0:
             factorList=ObserveEvidence( factorList, np.array(np.matrix( [ j+1, E[j]] ) ) )
@@ -124,44 +136,104 @@ def CliqueTreeObserveEvidence ( C, E ):
     return C
 
 
+def CliqueFactorAssignment( nodeList, factorList ):
+    """ assign the factors in factorList to the cliques in nodeList (lists of variables): each factor goes to
+        the first clique (lowest index) whose scope contains the factor's scope. Returns a list with the indices
+        of the factors assigned to each clique.
+
+        Only the cliques containing the factor's first variable can qualify, so look those up in an index
+        of the cliques by variable instead of testing every clique against every factor """
+    varCliques={}
+    for i in range( len(nodeList) ):
+        for v in nodeList[i]:
+            varCliques.setdefault( v, [] ).append( i )
+    assigned=[ [] for i in range( len(nodeList) ) ]
+    for j in range( len(factorList) ):
+        scope=factorList[j].getVar().tolist()
+        if len(scope) == 0:
+            continue
+        for i in varCliques.get( scope[0], [] ):
+            if set( scope ).issubset( nodeList[i] ):
+                assigned[i].append( j )
+                break
+    return assigned
+
+
+def CliquePotential( scope, cards, factors, name ):
+    """ the initial potential of the clique over the variables in scope: the product of the factors
+        assigned to it. cards is a dict with the cardinality of each variable.
+        The potential spans the whole scope of the clique, including variables none of the factors
+        assigned to it mention, otherwise the sepsets computed from the potentials come out too small """
+    scopeCard=[ cards[v] for v in scope ]
+    return ComputeJointDistribution ( [ Factor( scope, scopeCard, np.ones( np.prod(scopeCard) ), name ) ] + factors )
+
+
 def CliqueTreeInitialPotential( C ):
     """ given a clique tree object C, calculate the initial potentials for each of the cliques
         the factors in the updated clique list are FActor objects"""
 
     
     N= C.getNodeCount()
-    totalFactorCount=C.getFactorCount()
 
     nodeList=C.getNodeList()
     factorList=C.getFactorList()
 
-    cliqueList=[ Factor( [], [], [], str(i) )  for i in range(N)  ]
-    #edges=np.zeros( (N,N) )
-
     """ First assign the factors to appropriate cliques
     based on the skeleton cliqueTree cTree"""
 
-    factorsUsed=np.zeros( totalFactorCount, dtype=int).tolist()
+    cards={}
+    for f in factorList:
+        cards.update( zip( f.getVar().tolist(), f.getCard().tolist() ) )
+
+    assigned=CliqueFactorAssignment( nodeList, factorList )
+
     #pdb.set_trace()
-    for i in range(N):
-        cliqueList[i].setVar( nodeList[i] )
-        F=[]
-        """ we add factors to the clique if they are in the variable scope of the clique """
-        for j in range( len(factorList) ):
-            if len( factorList[j].getVar().tolist() ) == len ( list( set.intersection ( set(cliqueList[i].getVar().tolist() ), set( factorList[j].getVar().tolist() ) ) ) ):
-        
-                if factorsUsed[j] == 0:
-                    F.append( factorList[j] )
-                    factorsUsed[j] = 1
-    #print F
-        #pdb.set_trace()
-        #F= [ f.getFactor() for f in F ]
-        cliqueList[i]=ComputeJointDistribution ( F )
-        #pdb.set_trace()
+    cliqueList=[ CliquePotential( nodeList[i], cards, [ factorList[j] for j in assigned[i] ], str(i) ) for i in range(N) ]
     C.setNodeList(cliqueList)
     #pdb.set_trace()
     return C
 
+
+def TraceCliqueTree( P ):
+    """ hand the scopes of the cliques of P and the edges of the tree to the tracer, see Trace.py """
+    cliques=[ clique.getVar().tolist() if isinstance( clique, Factor ) else list( clique ) for clique in P.getNodeList() ]
+    edges=[ (i, j) for i in range( P.getNodeCount() ) for j in sorted( P.getNeighbors(i) ) if i < j ]
+    tracer.emit( 'cliqueTree', cliques=cliques, edges=edges )
+
+
+def CliqueTreeSchedule(P, root=None):
+    """ the order in which CliqueTreeCalibrate passes messages: a list of (i,j) pairs, the message from
+        clique i to clique j. The tree is traversed breadth first from root (the lowest numbered clique by
+        default); the upward pass sends the messages towards the root, deepest cliques first, and the
+        downward pass sends them back out from the root. Every clique sends to a neighbor only after
+        receiving from all its other neighbors, so this is the order getNextClique finds, computed once in
+        O(N). If the clique tree is a forest every tree is traversed from its lowest numbered clique """
+
+    N=P.getNodeCount()
+    neighbors=P.getNeighbors()
+    visited=[ False ] * N
+    upward=[]
+    downward=[]
+    starts=range(N) if root is None else [ root ] + range(N)
+    for start in starts:
+        if visited[start]:
+            continue
+        visited[start]=True
+        queue=[ start ]
+        k=0
+        while k < len(queue):
+            i=queue[k]
+            k+=1
+            for j in sorted( neighbors[i] ):
+                if not visited[j]:
+                    visited[j]=True
+                    queue.append(j)
+                    downward.append( (i, j) )
+                    upward.append( (j, i) )
+    upward.reverse()
+    return upward + downward
+
+
 def getNextClique(P, messages):
 
     """ we need to come up wih a proper message passing order. A clique is ready to pass
@@ -217,12 +289,49 @@ def getNextClique(P, messages):
     return (i,j)
 
 
-def CliqueTreeCalibrate( P, isMax=False):
+def CliqueMessage( clique, incoming, sepset, semiring ):
+    """ the message a clique sends to a neighbor: the clique potential combined with the incoming messages
+        from its other neighbors, with every variable not in the sepset eliminated in a single contraction
+        (see FactorCombineMarginalize), normalized if the semiring normalizes its messages """
+    message=FactorCombineMarginalize( incoming + [ clique ], sepset, semiring )
+    if semiring.normalizeMessages:
+        message=FactorNormalize( message, semiring )
+    return message
+
+
+def PrefixProducts( clique, incoming, semiring ):
+    """ the prefix products of a clique's incoming messages: prefix[k] is the clique potential combined with
+        incoming[:k], so prefix[-1] is the clique potential combined with all of them """
+    prefix=[ clique ]
+    for message in incoming:
+        prefix.append( FactorCombine( prefix[-1], message, semiring ) )
+    return prefix
+
+
+def SuffixProducts( incoming, semiring ):
+    """ the suffix products of a clique's incoming messages: suffix[k] is the combination of incoming[k:],
+        None for k == len(incoming). suffix[0] is never needed to pass messages, so it is left None too """
+    suffix=[ None ]
+    for message in reversed( incoming[1:] ):
+        suffix.append( message if suffix[-1] is None else FactorCombine( message, suffix[-1], semiring ) )
+    suffix.append( None )
+    suffix.reverse()
+    return suffix
+
+
+def CliqueTreeCalibrate( P, isMax=False, semiring=None, root=None, MESSAGES=None, beliefs=None):
     """ this function performs sum-product or max-product algorithm for clique tree calibration.
         P is the CliqueTree object. isMax is a boolean flag that when set to True performs Max-Product
         instead of the default Sum-Product. The function returns a calibrated clique tree in which the
         values of the factors is set to final calibrated potentials.
 
+        semiring (see Semiring.py) picks the algorithm explicitly and overrides isMax: sumProduct (the default),
+        maxSum (what isMax selects, max-product in log space), logSumProduct for sum-product in log space, or
+        maxProduct. With a log space semiring the calibrated potentials and messages are natural logs.
+
+        root is the clique the message schedule is built from when the tree doesn't have one yet,
+        see CliqueTreeSchedule.
+
         Once a tree is calibrated, in each clique (node) contains the marginal probability over the variables in
         its scope. We can compute the marginal probability of a variable X by choosing a clique that contains the
         variable of interest, and summing out non-query variables in the clique. See page 357 in Koller and Friedman
@@ -235,148 +344,119 @@ def CliqueTreeCalibrate( P, isMax=False):
 
         After calibration, each clique will contain the marginal (or max-mariginal, if isMax is set to True)
 
+        To recalibrate a tree after a change to some of its potentials, pass the MessageStore MESSAGES and the list of
+        calibrated beliefs of an earlier calibration (same tree and semiring) with the messages that depend on
+        the changed potentials removed and the beliefs of the changed cliques set to None (see
+        CompiledCliqueTree.query). Only the missing messages are passed, and only the beliefs of the cliques
+        that receive one of them (or whose belief is None) are recomputed; the rest are reused.
+        MESSAGES is updated in place.
+
         """
     
     np.set_printoptions(suppress=True)
-    ctree_edges=P.getEdges()
 
     ctree_cliqueList=P.getNodeList()
 
-    """ if max-sum, we work in log space """
-    if isMax == True:
-        ctree_cliqueList= [ LogFactor (factor) for factor in ctree_cliqueList ]
+    if semiring is None:
+        semiring=maxSum if isMax else sumProduct
 
-    
-    
     N=P.getNodeCount() #Ni is the total number of nodes (cliques) in cTree
 
-    #dummyFactor=Factor( [], [], [], 'factor')
     #set up messsages to be passed
     #MESSAGES[i,j] represents the message going from clique i to clique j
-    #MESSAGES will be a matrix of Factor objects
-    MESSAGES=np.tile( Factor( [], [], [], 'factor'), (N,N))
-    DUMMY=np.reshape( np.arange(N*N)+1, (N,N) )
+    #MESSAGES only stores the messages actually passed, see MessageStore
+    if MESSAGES is None:
+        MESSAGES=MessageStore()
     
 
-    """While there are ready cliques to pass messages between, keep passing
-    messages. Use GetNextCliques to find cliques to pass messages between.
-    Once you have clique i that is ready to send message to clique
-    j, compute the message and put it in MESSAGES(i,j).
-    Remember that you only need an upward pass and a downward pass."""
-
-    """ leaf nodes are ready to pass messages right away
-        so we initialize MESSAGES with leaf message factors
-        recall, a node is a leave if row sum is equal to 1"""
-    for row in range(N):
-        rowsum= np.sum( ctree_edges[row,:] )
-        if rowsum ==1 :
-            #Returns a tuple of arrays, one for each dimension, we want the first, hence the [0]
-            leafnode=np.nonzero( ctree_edges[row,:] )[0].tolist()[0]
-            #I discovered NumPy set operations http://docs.scipy.org/doc/numpy/reference/routines.set.html
-            marginalize=np.setdiff1d( ctree_cliqueList[row].getVar(),  ctree_cliqueList[leafnode].getVar() ).tolist()
-            sepset=np.intersect1d( ctree_cliqueList[row].getVar(), ctree_cliqueList[leafnode].getVar() ).tolist()
-
-            """ if isMax is false, this is sumproduct, so we do factor marginalization """
-            if isMax == 0:
-                #MESSAGES(row,leafnode)=FactorMarginalization(P.cliqueList(row),marginalize);
-                MESSAGES[row,leafnode]=FactorMarginalization(ctree_cliqueList[row], marginalize )
-                if np.sum( MESSAGES[row,leafnode].getVal() ) != 1:
-                    newVal=MESSAGES[row,leafnode].getVal() / np.sum( MESSAGES[row,leafnode].getVal() )
-                    MESSAGES[row,leafnode].setVal(newVal)
-            else:
-                """ if isMax is true, this is max-marginalization
-                    don't normalize the value just yet"""
-                MESSAGES[row,leafnode]=FactorMaxMarginalization( ctree_cliqueList[row], marginalize  )
 
+    """ pass the messages in the order of the tree's schedule: an upward pass towards the root and
+        a downward pass back out (see CliqueTreeSchedule). The schedule only depends on the edges,
+        so it is computed once and kept on the tree for later calibrations.
+        When clique i sends its message to clique j, every other neighbor of i has already sent its message to i"""
+    schedule=P.getSchedule()
+    if schedule is None:
+        schedule=CliqueTreeSchedule(P, root)
+        P.setSchedule(schedule)
 
-    
-    """ now that the leaf messages are initialized, we begin with the rest of the clique tree
-    now we do a single pass to arrive at the calibrated clique tree. We depend on
-    GetNextCliques to figure out which nodes i,j pass messages to each other"""
-    
-    while True:
-        (i,j)=getNextClique(P,MESSAGES)
-        if sum ( [ i, j] ) == -2:
-            break
+    """ the messages not already in MESSAGES are passed, and the cliques receiving them need new beliefs """
+    schedule=[ (i,j) for (i,j) in schedule if not MESSAGES.hasMessage(i,j) ]
+    if beliefs is None:
+        stale=set( range(N) )
+    else:
+        stale=set( [ j for (i,j) in schedule ] ).union( [ i for i in range(N) if beliefs[i] is None ] )
+
+    """ if max-sum (or log-sum-product), we work in log space. Only the potentials
+        that send a message or get a new belief are needed """
+    if semiring.isLog:
+        needed=stale.union( [ i for (i,j) in schedule ] )
+        ctree_cliqueList= [ LogFactor (ctree_cliqueList[i]) if i in needed else ctree_cliqueList[i] for i in range(N) ]
+
+    #the neighbor order and the prefix and suffix products of the cliques with more than two neighbors
+    products={}
+
+    for (i,j) in schedule:
         #print 'i: ', i, 'j: ', j
-        """ similiar to above, we figure out the sepset and what variables to marginalize out
-        between the two cliques"""
-        marginalize=np.setdiff1d( ctree_cliqueList[i].getVar(),  ctree_cliqueList[j].getVar() ).tolist()
+        """ we figure out the sepset between the two cliques"""
+        #I discovered NumPy set operations http://docs.scipy.org/doc/numpy/reference/routines.set.html
         sepset=np.intersect1d( ctree_cliqueList[i].getVar(), ctree_cliqueList[j].getVar() ).tolist()
 
         """ find all the incoming neighbors, except j """
-        Nbs=np.nonzero( ctree_edges[:,i])[0] #returns a tuple ...
+        Nbs=sorted( P.getNeighbors(i) )
+        if len(Nbs) > 2:
+            """ a clique with many neighbors (the hub of a large sibship) would multiply every incoming message again
+                for each message it sends. Instead its neighbors are put in an order that ends with j, the
+                first neighbor it sends to (its parent on the upward pass), and the message to the kth neighbor is
+                computed from prefix[k] and suffix[k+1], the cached products of the messages before and after it
+                (see PrefixProducts and SuffixProducts). The prefix is built on the upward pass from the messages of
+                the children, and extended with the parent's message and complemented by the suffix once the
+                downward pass starts, so every incoming message is combined a constant number of times """
+            if i not in products:
+                order=[ k for k in Nbs if k != j ] + [ j ]
+                products[i]=[ order, PrefixProducts( ctree_cliqueList[i], [ MESSAGES[k,i] for k in order[:-1] ], semiring ), None ]
+            ( order, prefix, suffix )=products[i]
+            k=order.index( j )
+            if suffix is None and k < len(order)-1:
+                prefix.append( FactorCombine( prefix[-1], MESSAGES[ order[-1], i ], semiring ) )
+                suffix=products[i][2]=SuffixProducts( [ MESSAGES[m,i] for m in order ], semiring )
+            after=[] if suffix is None or suffix[k+1] is None else [ suffix[k+1] ]
+            MESSAGES[i,j] = CliqueMessage( prefix[k], after, sepset, semiring )
+            continue
+
         Nbs_minusj=[ elem for elem in Nbs if elem !=  j ]
-        #print 'Nbs_minusj: ', Nbs_minusj, ' [i]: ', [i]
-        #see numpy for matlab users http://www.scipy.org/NumPy_for_Matlab_Users
         # these are incoming messages to the ith clique
-        Nbsfactors=MESSAGES[np.ix_(Nbs_minusj, [i] )].flatten().tolist()
-        #print DUMMY[np.ix_(Nbs_minusj, [i] )].flatten()
-        #for f in Nbsfactors:
-            #print f
-        """ this is sum/product """
-        if isMax == 0:
-            #print 'total number of Nbs factors: ', len(Nbsfactors)
-            if len(Nbsfactors) == 1:
-                Nbsproduct=FactorProduct( Nbsfactors[0], IdentityFactor(Nbsfactors[0]) )
-            else:
-                Nbsproduct=ComputeJointDistribution( Nbsfactors )
-            #pdb.set_trace()
-            #val=Nbsproduct.getVal()
-            #rowcount=len(val)/3
-            #print Nbsproduct.getVar()
-            #print Nbsproduct.getCard()
-            #print np.reshape( val, (rowcount,3))
-            #now mulitply wiht the clique factor
-            
-            CliqueNbsproduct=FactorProduct( Nbsproduct, ctree_cliqueList[i] )
-            
-            CliqueMarginal= FactorMarginalization ( CliqueNbsproduct, marginalize )
-            
-            #normalize the marginal
-            newVal=CliqueMarginal.getVal() / np.sum( CliqueMarginal.getVal() )
-
-            CliqueMarginal.setVal( newVal )
-            
-            MESSAGES[i,j] = CliqueMarginal
-        else:
-            if len(Nbsfactors) == 1:
-                Nbssum=Nbsfactors[0]
-            else:
-                Nbssum=reduce ( lambda x,y: FactorSum(x,y), Nbsfactors  )
-            CliqueNbsSum=FactorSum( Nbssum, ctree_cliqueList[i] )
-            CliqueMarginal=FactorMaxMarginalization( CliqueNbsSum, marginalize )
-            MESSAGES[i,j] = CliqueMarginal
-        #print
+        Nbsfactors=[ MESSAGES[k,i] for k in Nbs_minusj ]
+        """ multiply the incoming messages into the clique and sum (max) out the variables not in the sepset
+            in a single contraction, so the product over the whole clique is never built.
+            Leaf cliques have no incoming messages, their potential is just marginalized (max-marginalized)
+            onto the sepset. Max messages are not normalized """
+        MESSAGES[i,j] = CliqueMessage( ctree_cliqueList[i], Nbsfactors, sepset, semiring )
 
 
 
     #######################################################################
-    """ once out the while True loop, the clique tree has been calibrated
-    here is where we compute final belifs (potentials) for the cliques and place them in """
+    """ once all the messages are passed, the clique tree has been calibrated
+    here is where we compute final belifs (potentials) for the cliques and place them in.
+    A clique with more than two neighbors already has the product of its potential with all its
+    incoming messages as its last prefix product """
 
     for i in range ( len(ctree_cliqueList)):
-        Nbs=np.nonzero( ctree_edges[:,i])[0]#returns a tuple
-        Nbsfactors=MESSAGES[np.ix_(Nbs, [i])].flatten().tolist()
-
-        if isMax == 0:
-            if len(Nbsfactors) == 1:
-                Nbsproduct=FactorProduct( Nbsfactors[0], IdentityFactor(Nbsfactors[0]) )
-            else:
-                Nbsproduct=ComputeJointDistribution ( Nbsfactors)
-            
-            CliqueNbsProduct=FactorProduct(Nbsproduct, ctree_cliqueList[i])
-            #pdb.set_trace()
-            ctree_cliqueList[i]=CliqueNbsProduct
-        else:
-            if len(Nbsfactors) == 1:
-                Nbssum=Nbsfactors[0]
-            else:
-                Nbssum=reduce ( lambda x,y: FactorSum(x,y), Nbsfactors  )
-            CliqueNbsSum=FactorSum(Nbssum, ctree_cliqueList[i])
-            ctree_cliqueList[i]=CliqueNbsSum
+        if i not in stale:
+            ctree_cliqueList[i]=beliefs[i]
+            continue
+        if i in products:
+            ( order, prefix, suffix )=products.pop(i)
+            for k in order[ len(prefix)-1: ]:
+                prefix.append( FactorCombine( prefix[-1], MESSAGES[k,i], semiring ) )
+            ctree_cliqueList[i]=prefix[-1]
+            continue
+        Nbsfactors=[ MESSAGES[k,i] for k in sorted( P.getNeighbors(i) ) ]
+
+        ctree_cliqueList[i]=reduce( lambda x, y: FactorCombine(x, y, semiring), Nbsfactors + [ ctree_cliqueList[i] ] )
     
     P.setNodeList( ctree_cliqueList )
+    if tracer.enabled:
+        tracer.emit( 'calibrate', semiring=semiring.name, cliques=N, messages=len(schedule) )
     #np.savetxt( 'numpy.cTree.edges.calibrated.txt',ctree_edges,fmt='%d', delimiter='\t')
     
     #pdb.set_trace()
@@ -393,20 +473,30 @@ def CliqueTreeCalibrate( P, isMax=False):
     #return P
 
 
-def CreatePrunedInitCtree(F,E=[]):
+def CreatePrunedInitCtree(F,E=[],reduceScope=False,order=None):
     """ 1. create cTree from list of factors F and evidence E
         2. prune it
         3. compute initial potential of the tree
-        4. return it"""
+        4. return it
+
+        If reduceScope is True the observed variables are sliced out of the factors before the
+        tree is built, so neither the cliques nor the messages carry the observed variables.
+        order is passed on to createCliqueTree"""
 
-    cTree = createCliqueTree(F,E)
+    if reduceScope:
+        observed=[ [ j+1, E[j] ] for j in range( len(E) ) if E[j] > 0 ]
+        if len(observed) > 0:
+            F=ObserveEvidenceReduce( F, np.array(observed) )
+    cTree = createCliqueTree(F,E,order)
     prunedCTree=PruneTree( cTree )
-    prunedCTree.incorporateEvidence()
+    if not reduceScope:
+        #the reduced factors no longer mention an observed variable, so there is no evidence left to apply
+        prunedCTree.incorporateEvidence()
     return CliqueTreeInitialPotential( prunedCTree )
 
     
 
-def ComputeExactMarginalsBP( F, E=[], isMax=False, computeJoint=0):
+def ComputeExactMarginalsBP( F, E=[], isMax=False, computeJoint=0, semiring=None, reduceScope=False, order=None, ragged=False):
     """ We take a list of Factor objects, observed Evidence E
         and returns marignal proabilities for the variables in the
         Bayesian network. If isMax is 1 it runs MAP inference ( *still need to
@@ -414,73 +504,185 @@ def ComputeExactMarginalsBP( F, E=[], isMax=False, computeJoint=0):
         The ith element of the returned list represents the ith variable in the
         network and its marginal prob of the variable
 
+        semiring overrides isMax, see CliqueTreeCalibrate. With a log space semiring
+        the marginals are returned as natural logs
+
+        If reduceScope is True the evidence is applied by slicing the observed variables out of the
+        factors (see ObserveEvidenceReduce); observed variables then get point mass marginals on their observed
+        value and the joint distribution, if computed, is over the unobserved variables only
+
+        order is the elimination ordering the clique tree is built from (see createCliqueTree
+        and FindEliminationOrdering in EliminationOrdering.py)
+
+        E can also be a B x N array with one evidence vector per row. The factors are then conditioned on all
+        B cases at once (ObserveEvidenceBatch) and a single clique tree is calibrated for the whole batch:
+        the marginals (and the joint) are batched factors whose val is B x card, row b the marginal given
+        the bth evidence vector. Scope reducing evidence changes the tree with the evidence, so reduceScope
+        can't be used with a batch
+
+        The marginals are read from the smallest clique containing each variable (see ExtractMarginals).
+        If ragged is True they are returned packed in one array instead of a list of Factor objects,
+        see RaggedMarginals
+
+        The calibrated clique tree is reported to the tracer (see Trace.py) if tracing is enabled,
+        nothing is written to disk otherwise
+
         Note, we implicitly create, prune, initialize, and calibrate a clique tree
-        constructed from the factor list F  """
+        constructed from the factor list F. To query the same network with many evidence
+        vectors, compile it once with CompiledCliqueTree instead """
 
     MARGINALS=[]
+    if semiring is None:
+        semiring=maxSum if isMax else sumProduct
     #pdb.set_trace()
-    P = CreatePrunedInitCtree(F,E)
+    batchSize=None
+    if np.ndim(E) == 2:
+        batchSize=np.shape(E)[0]
+        if reduceScope:
+            sys.stderr.write("ComputeExactMarginalsBP: reduceScope can't be used with a batch of evidence vectors\n")
+            sys.exit(1)
+        F=ObserveEvidenceBatch( F, E )
+        E=[]
+    P = CreatePrunedInitCtree(F,E,reduceScope,order)
     #G=nx.from_numpy_matrix( P.getEdges() )
     #nx.draw_shell(G)
     #plt.show()
     
     #plt.savefig('cliqueTree.png', bbox_inches=0)
-    (P,MESSAGES) = CliqueTreeCalibrate(P,isMax)
+    (P,MESSAGES) = CliqueTreeCalibrate(P,isMax,semiring)
     #pdb.set_trace()
     if computeJoint==1:
-        jointDistribution=ComputeJointDistributionFromCalibratedCliqueTree(P, MESSAGES, isMax)
+        jointDistribution=ComputeJointDistributionFromCalibratedCliqueTree(P, MESSAGES, isMax, semiring)
     else:
         jointDistribution=None
     #pdb.set_trace()
     #P = CliqueTreeCalibrate(P,isMax)
     cliqueList=P.getNodeList()
     
-    fh=open('ExactMarginals.CliqueTree.log','a')
-    for i in range(len(cliqueList)):
-        out = ",".join( map(str, cliqueList[i].getVar().tolist() )) 
-        outstring= "node " + str(i) + ":\t" + out +'\n'
-        fh.write(outstring)
-    fh.write("\n")
-    #np.savetxt( 'numpy.cTree.edges.calibrated.txt',P.getEdges(),fmt='%d', delimiter='\t')
-    np.savetxt('ExactMarginals.CliqueTree.log',P.getEdges(),fmt='%d', delimiter='\t')
-    
-    
-                           
-                            
+    if tracer.enabled:
+        TraceCliqueTree( P )
+
     """ get the list of unique variables """
     V=getUniqueVar(F)
-    
 
-    for i in range ( len(V ) ):
-        for j in range ( len(cliqueList ) ):
-            if V[i] in cliqueList[j].getVar():
-                marginalize=np.setdiff1d ( cliqueList[j].getVar(), V[i]  ).tolist()
-                if not marginalize:
-                    MARGINALS.append( cliqueList[j]  )
-                else:
-                    if isMax == 0:
-                        #mfactor=FactorMarginalization(P.cliqueList(j), marginalize);
-                        mfactor=FactorMarginalization( cliqueList[j], marginalize )
-                        newVal=mfactor.getVal() / np.sum( mfactor.getVal() )
-                        mfactor.setVal( newVal )
-                        MARGINALS.append ( mfactor )
-                    else:
-                        mfactor=FactorMaxMarginalization( cliqueList[j], marginalize )
-                        MARGINALS.append( mfactor )
-                break
+    """ the observed variables of scope reduced evidence are in no clique, they get point masses.
+        The marginals of the others are read from the smallest clique containing each of them,
+        all the variables of a clique in one pass over its table (see ExtractMarginals) """
+    observed=[ v for v in V if reduceScope and v <= len(E) and E[ v-1 ] > 0 ]
+    unobserved=[ v for v in V if v not in observed ]
+    vals=dict( zip( unobserved, ExtractMarginals( cliqueList, unobserved, semiring ) ) )
+    for v in observed:
+        vals[v]=PointMassFactor( F, v, E[ v-1 ], semiring ).getVal()
+    if batchSize is not None:
+        vals=dict( zip( V, BroadcastMarginals( [ vals[v] for v in V ], batchSize ) ) )
 
+    if ragged:
+        return ( RaggedMarginals( V, [ vals[v] for v in V ] ), jointDistribution )
+
+    for v in V:
+        MARGINALS.append( Factor( [ v ], [ vals[v].shape[-1] ], vals[v], str(v) ) )
     
     return (MARGINALS,jointDistribution)
 
-def ComputeJointDistributionFromCalibratedCliqueTree( P, MESSAGES, isMax=0):
+
+def VariableCliqueIndex( cliqueList ):
+    """ a dict from each variable to the smallest clique of cliqueList (the one with the fewest table entries,
+        the lowest index on ties) containing it. A singleton marginal read from there touches the smallest table,
+        and the index is built once instead of scanning the cliques for every variable """
+    index={}
+    sizes={}
+    for i in range( len(cliqueList) ):
+        size=np.prod( cliqueList[i].getCard().astype(float) )
+        for v in cliqueList[i].getVar().tolist():
+            if v not in index or size < sizes[v]:
+                index[v]=i
+                sizes[v]=size
+    return index
+
+
+def CliqueMarginalVals( clique, variables, semiring ):
+    """ the singleton marginals of the variables (all in the scope of the calibrated clique), eliminating the
+        other variables the way the semiring does. The table is viewed as an N-d array once and reduced onto each
+        variable's axis. Returns a list of val arrays (B x card for a batched clique), normalized if the semiring
+        normalizes its messages """
+    Cvar=clique.getVar().tolist()
+    ndval=ValToArray( clique.getVal(), tuple( clique.getCard().tolist() ) )
+    offset=ndval.ndim - len(Cvar)
+    vals=[]
+    for v in variables:
+        k=Cvar.index(v)
+        eliminate=tuple( [ a+offset for a in range( len(Cvar) ) if a != k ] )
+        if len(eliminate) > 0:
+            val=semiring.reduce( ndval, axis=eliminate )
+        else:
+            #a view of the clique's table, copy it so the marginal doesn't alias the belief
+            val=np.array( ndval )
+        if semiring.normalizeMessages:
+            val=semiring.normalize( val )
+        vals.append( val )
+    return vals
+
+
+def ExtractMarginals( cliqueList, V, semiring, index=None ):
+    """ the singleton marginals of the variables in V from the calibrated cliques in cliqueList, as a list of
+        val arrays in the order of V. The variables are grouped by the clique they are read from, the smallest
+        containing each of them (index, see VariableCliqueIndex, is built if not given), and every clique's
+        table is reduced onto all its variables in one call to CliqueMarginalVals """
+    if index is None:
+        index=VariableCliqueIndex( cliqueList )
+    groups={}
+    for k in range( len(V) ):
+        groups.setdefault( index[ V[k] ], [] ).append( k )
+    vals=[ None ] * len(V)
+    for (i, ks) in groups.iteritems():
+        for (k, val) in zip( ks, CliqueMarginalVals( cliqueList[i], [ V[k] for k in ks ], semiring ) ):
+            vals[k]=val
+    return vals
+
+
+def BroadcastMarginals( vals, B ):
+    """ the marginal val arrays in vals as B x card arrays. In a batched calibration of a forest the trees no
+        evidence touches aren't batched, so the marginals of their variables come back 1-d, one row for all the
+        cases; they are repeated here so every marginal of a batch can be indexed by case """
+    return [ np.broadcast_to( val, ( B, val.shape[-1] ) ).copy() if np.ndim(val) == 1 else val for val in vals ]
+
+
+def RaggedMarginals( V, vals ):
+    """ pack the marginals of the variables V (val arrays, see ExtractMarginals) into one contiguous ragged array:
+        a tuple (var, offsets, values) where the marginal of var[k] is values[..., offsets[k]:offsets[k+1]].
+        values is 1-d, or B x total if any of the marginals is batched (the others are repeated for every case,
+        see BroadcastMarginals) """
+    batched=[ val.shape[0] for val in vals if np.ndim(val) == 2 ]
+    if len(batched) > 0:
+        vals=BroadcastMarginals( vals, batched[0] )
+    offsets=np.zeros( len(V)+1, dtype=np.int64 )
+    offsets[1:]=np.cumsum( [ val.shape[-1] for val in vals ] )
+    if len(vals) == 0:
+        return ( np.asarray( V, dtype=np.int64 ), offsets, np.zeros(0) )
+    return ( np.asarray( V, dtype=np.int64 ), offsets, np.concatenate( vals, axis=-1 ) )
+
+
+def PointMassFactor( F, v, value, semiring ):
+    """ the marginal of the observed variable v, taking the observed value with probability one,
+        in the values of the semiring. The cardinality of v is looked up in the factors F """
+    for f in F:
+        indx=np.where( f.getVar() == v )[0].tolist()
+        if indx:
+            card=f.getCard()[ indx[0] ]
+            break
+    val=np.zeros( card )
+    val[ value-1 ]=1
+    return Factor( [ v ], [ card ], semiring.fromProbability( val ), str(v) )
+
+
+def ComputeJointDistributionFromCalibratedCliqueTree( P, MESSAGES, isMax=0, semiring=None):
     
     """ this is a function to attempt to compute the joint distribution from
         a calibrated clique tree (cTree). The arguments are: 
         1. The calibrated cTree, P, which is a CliqueTree object
-        2. The sepset beliefs are is the matrix MESSAGES
-           The MESSAGES matrix is a matrix of Factor objects
-           We can get the indices of the sepset messages
-           from the edges of the clique tree. 
+        2. The messages MESSAGES passed during calibration, a MessageStore.
+           The sepset beliefs are the products of the messages passed
+           both ways over each edge of the clique tree. 
         
         This function attempts to implement equation 10.10 in Koller and Friedman
         in section 10.2.3: A Calibrated Clique Tree as a Distribution
@@ -491,53 +693,132 @@ def ComputeJointDistributionFromCalibratedCliqueTree( P, MESSAGES, isMax=0):
                   B) multiply the sepset beliefs
                   C) divide A/B 
         
-        
+        The result is a table over every variable of the network, exponential in their number.
+        For the joint over a few variables use ComputeSubsetJointFromCalibratedCliqueTree
          """
     cliqueFactors=P.getNodeList()
    
-    """ if this is a max-marginal calibrated clique tree the values are in log space
-        Just re-exponentiate them  """
-    if isMax==1:
-        cliqueFactors = [ ExpFactorNormalize(c) for c in cliqueFactors ]
-    
-    """ this is the numerator """
-    cliqueBeliefProducts=reduce(lambda x, y: FactorProduct(x,y), cliqueFactors)
-    
-    """ get the adjacency matrix of the clique tree """
-    adj_matrix=P.getEdges()
-    
-    """ get the nonzero indices, then compute the product of the sepset beliefs """
-    nonzero_rows=adj_matrix.nonzero()[0].tolist()
-    nonzero_cols=adj_matrix.nonzero()[1].tolist()
-    
-    
+    if semiring is None:
+        semiring=maxSum if isMax == 1 else sumProduct
+
+    if len(cliqueFactors) == 0:
+        #no variable is left unobserved (scope reducing evidence on every variable): the joint over no variables
+        return Factor( [], [], [ 1. ], 'joint' )
+
+    """ the sepset beliefs of the edges of the tree, see MessageStore.getSepsetBeliefs """
+    sepsetBeliefsFactors=MESSAGES.getSepsetBeliefs( semiring ).values()
+
+    """ this is the numerator and the denominator, in the semiring the tree was calibrated in.
+        If it was calibrated in log space the products are sums and the division is a subtraction
+        (see FactorDivide). Only the final joint is re-exponentiated """
+    cliqueBeliefProducts=reduce(lambda x, y: FactorCombine(x, y, semiring), cliqueFactors)
+    if len(sepsetBeliefsFactors) > 0:
+        sepsetBeliefProducts= reduce( lambda x,y: FactorCombine(x, y, semiring), sepsetBeliefsFactors)
+
+        """ the re-parameterization of the joint (clique tree invariant)
+            divide the clique beliefs by the sepset messages  """
+        jointDistrbution=FactorDivide(cliqueBeliefProducts, sepsetBeliefProducts, semiring)
+    else:
+        #a single clique, copy it so normalizing the joint leaves the clique belief alone
+        jointDistrbution=Factor( cliqueBeliefProducts.getVar(), cliqueBeliefProducts.getCard(), cliqueBeliefProducts.getVal().copy() )
+    if semiring.isLog:
+        jointDistrbution=ExpFactorNormalize( jointDistrbution )
 
-    
-    
-    sepsetBeliefsFactors= [   MESSAGES[x,y] for (x,y) in zip(nonzero_rows, nonzero_cols) ] 
-    
-    """ if this is a max-marginal calibrated clique tree the values are in log space
-        Just re-exponentiate them  """
-    if isMax == 1:
-        sepsetBeliefsFactors = [ ExpFactorNormalize(c) for c in sepsetBeliefsFactors ]
-    
-    
-    
-    sepsetBeliefProducts= reduce( lambda x,y: FactorProduct(x,y), sepsetBeliefsFactors)
-         
-    """ the re-parameterization of the joint (clique tree invariant)  
-        divide the clique beliefs by the sepset messages  """
-    jointDistrbution=FactorDiv(cliqueBeliefProducts, sepsetBeliefProducts)
-    
-    val=jointDistrbution.getVal()/np.sum( jointDistrbution.getVal() )
+    val=jointDistrbution.getVal()/np.sum( jointDistrbution.getVal(), axis=-1, keepdims=True )
     jointDistrbution.setVal( val )
     
     return jointDistrbution
-    
-         
-         
-         
-         
-         
-         
-        
+
+
+def ConnectingSubtrees( P, terminals ):
+    """ the smallest subtrees of the clique tree P connecting the cliques in terminals. Returns a list with one
+        dict per tree of P (P may be a forest) holding terminals: the cliques of the subtree, each mapped to its
+        parent in the subtree rooted at the first of its terminals (the root is mapped to None).
+
+        Each subtree is found with a breadth first search from its root that stops once every terminal in reach
+        has been seen, then the path from every terminal back to the root is added """
+    neighbors=P.getNeighbors()
+    remaining=set( terminals )
+    subtrees=[]
+    while len(remaining) > 0:
+        root=min( remaining )
+        parent={ root: None }
+        queue=[ root ]
+        found=set( [ root ] )
+        k=0
+        while k < len(queue) and len(found) < len(remaining):
+            i=queue[k]
+            k+=1
+            for j in sorted( neighbors[i] ):
+                if j not in parent:
+                    parent[j]=i
+                    queue.append(j)
+                    if j in remaining:
+                        found.add(j)
+        subtree={ root: None }
+        for t in found:
+            while t not in subtree:
+                subtree[t]=parent[t]
+                t=parent[t]
+        subtrees.append( subtree )
+        remaining.difference_update( found )
+    return subtrees
+
+
+def ComputeSubsetJointFromCalibratedCliqueTree( P, MESSAGES, V, isMax=0, semiring=None ):
+    """ the joint distribution over the variables in V from the calibrated clique tree P and the MessageStore
+        MESSAGES of its calibration, without building the joint over all the variables of the network
+        (see ComputeJointDistributionFromCalibratedCliqueTree).
+
+        If a clique contains all of V (e.g. a pair of variables sharing a clique) the smallest such clique is
+        simply marginalized. Otherwise only the subtree connecting the cliques the variables are read from (the
+        smallest clique containing each, see VariableCliqueIndex and ConnectingSubtrees) is used: rooted at one
+        of its cliques, the distribution over its variables is the root's belief times, for every other clique,
+        its belief divided by the sepset belief it shares with its parent (equation 10.10 of Koller and Friedman
+        restricted to the subtree). The variables not in V are eliminated from those factors with
+        FactorCombineMarginalize. Variables in different trees of a forest are independent, their joints are
+        multiplied.
+
+        The result is in probability space and sums to one (for max semirings it is the max-marginal over V,
+        normalized the same way), over the variables of V in sorted order. Returns None if a variable of V
+        isn't in the tree """
+
+    if semiring is None:
+        semiring=maxSum if isMax == 1 else sumProduct
+    cliqueList=P.getNodeList()
+    V=sorted( set(V) )
+
+    cliquesOf={}
+    for i in range( len(cliqueList) ):
+        for v in cliqueList[i].getVar().tolist():
+            cliquesOf.setdefault( v, set() ).add(i)
+    if len(V) == 0 or any( [ v not in cliquesOf for v in V ] ):
+        sys.stderr.write("ComputeSubsetJointFromCalibratedCliqueTree: the variables must all be in the clique tree\n")
+        return None
+
+    shared=set.intersection( *[ cliquesOf[v] for v in V ] )
+    if len(shared) > 0:
+        """ the fast path: one clique has all the variables """
+        i=min( shared, key=lambda c: ( cliqueList[c].getSize(), c ) )
+        clique=cliqueList[i]
+        joint=FactorReduce( clique, np.setdiff1d( clique.getVar(), V ).tolist(), semiring )
+        if joint is clique:
+            joint=Factor( clique.getVar(), clique.getCard(), clique.getVal().copy() )
+    else:
+        index=VariableCliqueIndex( cliqueList )
+        joints=[]
+        for subtree in ConnectingSubtrees( P, set( [ index[v] for v in V ] ) ):
+            factors=[]
+            for (i, parent) in subtree.iteritems():
+                if parent is None:
+                    factors.append( cliqueList[i] )
+                else:
+                    factors.append( FactorDivide( cliqueList[i], MESSAGES.getSepsetBelief( i, parent, semiring ), semiring ) )
+            scope=set().union( *[ f.getVar().tolist() for f in factors ] )
+            joints.append( FactorCombineMarginalize( factors, [ v for v in V if v in scope ], semiring ) )
+        joint=reduce( lambda x, y: FactorCombine(x, y, semiring), joints )
+
+    if semiring.isLog:
+        joint=ExpFactorNormalize( joint )
+    joint.setVal( joint.getVal()/np.sum( joint.getVal(), axis=-1, keepdims=True ) )
+    return joint
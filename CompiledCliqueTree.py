@@ -0,0 +1,203 @@
+from CliqueTreeOperations import *
+import sys
+import numpy as np
+
+
+class CompiledCliqueTree(object):
+    """ a clique tree compiled once from a list of factors and queried with many evidence vectors.
+
+        ComputeExactMarginalsBP builds, prunes, initializes and calibrates a new clique tree on every call.
+        When the same network is queried over and over only the evidence changes, and zeroing the entries that
+        disagree with the evidence (ObserveEvidence) doesn't change the structure of the tree. So the pruned tree,
+        the assignment of the factors to the cliques, the initial potential of every clique, the message schedule
+        and the clique each marginal is read from are computed here once, and query() only masks the potentials
+        with the evidence and calibrates.
+
+        The tree also keeps the messages and beliefs of its last calibration. When the next query changes the
+        evidence of a few variables, or setFactor changes the values of a few factors, only the messages sent
+        away from the cliques whose potentials changed are invalid (the messages towards them don't depend on
+        those potentials). Only those are passed again, the rest are reused.
+
+        The factors passed in are never modified, neither are the stored potentials: query() masks copies of the
+        potentials that mention an observed variable.
+
+        semiring and isMax pick the calibration algorithm as in CliqueTreeCalibrate, order the elimination
+        ordering the tree is built from as in createCliqueTree. Evidence is always applied by masking, the scope
+        reducing evidence of ComputeExactMarginalsBP (reduceScope) changes the structure of the tree """
+
+    def __init__(self, F, order=None, isMax=False, semiring=None):
+        if semiring is None:
+            semiring=maxSum if isMax else sumProduct
+        self.semiring=semiring
+
+        P=PruneTree( createCliqueTree( F, [], order ) )
+        if tracer.enabled:
+            TraceCliqueTree( P )
+        self.nodeList=P.getNodeList()
+        self.neighbors=P.getNeighbors()
+        self.schedule=CliqueTreeSchedule( P )
+
+        self.factorList=list( F )
+        self.cards={}
+        for f in self.factorList:
+            self.cards.update( zip( f.getVar().tolist(), f.getCard().tolist() ) )
+        self.assigned=CliqueFactorAssignment( self.nodeList, self.factorList )
+        self.factorClique={}
+        for i in range( len(self.nodeList) ):
+            for j in self.assigned[i]:
+                self.factorClique[j]=i
+
+        self.potentials=[ self.initialPotential(i) for i in range( len(self.nodeList) ) ]
+
+        """ the cliques each variable appears in, with the axis of the variable in the clique's table,
+            to mask the potentials with the evidence """
+        self.varCliques={}
+        for i in range( len(self.nodeList) ):
+            for (axis, v) in enumerate( self.potentials[i].getVar().tolist() ):
+                self.varCliques.setdefault( v, [] ).append( ( i, axis ) )
+
+        """ the marginal of each variable is read from the smallest clique that contains it,
+            as in ComputeExactMarginalsBP """
+        self.variables=getUniqueVar( F )
+        self.cliqueIndex=VariableCliqueIndex( self.potentials )
+
+        """ the state of the last calibration: the evidence it was done with (a dict variable -> value),
+            the masked potentials, its messages and its beliefs. dirty are the cliques whose potentials
+            changed since then """
+        self.evidence={}
+        self.observed=list( self.potentials )
+        self.MESSAGES=None
+        self.beliefs=None
+        self.dirty=set()
+
+    def initialPotential(self, i):
+        """ the product of the factors assigned to clique i, read-only so it can be shared between queries """
+        potential=CliquePotential( self.nodeList[i], self.cards, [ self.factorList[j] for j in self.assigned[i] ], str(i) )
+        potential.getVal().setflags(write=False)
+        return potential
+
+    def getVariables(self):
+        """ the variables of the network, in the order query() returns their marginals """
+        return self.variables
+
+    def getCliqueCount(self):
+        return len(self.nodeList)
+
+    def getFactorList(self):
+        return self.factorList
+
+    def setFactor(self, j, factor):
+        """ replace the jth factor of the network (in the order of the factor list the tree was compiled from)
+            with factor, over the same variables, e.g. to sweep the parameters of a CPD. The potential of the
+            clique it is assigned to is recomputed and the next query recalibrates from that clique """
+        if factor.getVar().tolist() != self.factorList[j].getVar().tolist():
+            sys.stderr.write("setFactor: the new factor must have the same scope as the factor it replaces\n")
+            sys.exit(1)
+        self.factorList[j]=factor
+        if j in self.factorClique:
+            i=self.factorClique[j]
+            self.potentials[i]=self.initialPotential(i)
+            self.dirty.add(i)
+
+    def observeClique(self, i, evidence):
+        """ the potential of clique i conditioned on evidence (a dict variable -> observed value): entries
+            that disagree with an observed value are zeroed, as ObserveEvidence does to the factors. The stored
+            potential is copied only if the clique mentions an observed variable """
+        clique=self.potentials[i]
+        ndval=None
+        for (axis, v) in enumerate( clique.getVar().tolist() ):
+            if v not in evidence:
+                continue
+            if ndval is None:
+                ndval=np.reshape( clique.getVal().copy(), tuple( clique.getCard().tolist() ), order='F')
+            index=[ slice(None) ] * ndval.ndim
+            index[axis]=np.arange( self.cards[v] ) != evidence[v]-1
+            ndval[ tuple(index) ]=0
+        if ndval is None:
+            return clique
+        return Factor( clique.getVar(), clique.getCard(), np.ravel( ndval, order='F'), clique.getName() )
+
+    def setEvidence(self, E):
+        """ set the evidence E, a list whose jth element is the observed value of variable j+1 (0 for
+            unobserved). Only the cliques mentioning a variable whose evidence changed are masked again,
+            they are marked dirty """
+        evidence={}
+        for j in range( len(E) ):
+            if E[j] > 0 and j+1 in self.varCliques:
+                if E[j] > self.cards[j+1]:
+                    sys.stderr.write("invalid evidene for variable X_'" + str(j+1) + " = " + str(E[j]) + "\n")
+                    sys.exit(1)
+                evidence[j+1]=E[j]
+        changed=[ v for v in set( evidence.keys() ).union( self.evidence.keys() ) if evidence.get(v) != self.evidence.get(v) ]
+        self.evidence=evidence
+        for v in changed:
+            self.dirty.update( [ i for (i, axis) in self.varCliques[v] ] )
+
+    def invalidate(self, cliques):
+        """ remove the messages that depend on the potentials of the given cliques from the last calibration:
+            every message on a path leading away from one of them. Their beliefs are dropped too, the beliefs of
+            the cliques downstream are recomputed as they receive new messages (see CliqueTreeCalibrate) """
+        stack=[ ( i, None ) for i in cliques ]
+        removed=set()
+        while len(stack) > 0:
+            (i, parent)=stack.pop()
+            for j in self.neighbors[i]:
+                if j != parent and (i,j) not in removed:
+                    removed.add( (i,j) )
+                    self.MESSAGES.removeMessage( i, j )
+                    stack.append( ( j, i ) )
+        for i in cliques:
+            self.beliefs[i]=None
+
+    def calibrate(self, E=[]):
+        """ calibrate the compiled tree with the evidence E (see setEvidence), passing only the messages the
+            changes since the last calibration invalidated.
+            Returns the calibrated CliqueTree and the MessageStore with its messages, as CliqueTreeCalibrate does
+
+            E can also be a B x N array of evidence vectors, as in ComputeExactMarginalsBP: the potentials are
+            masked for all the cases at once (ObserveEvidenceBatch) and the batch is calibrated in one pass from
+            scratch. The state kept for incremental recalibration isn't touched by a batch """
+        if np.ndim(E) == 2:
+            P=CliqueTree( ObserveEvidenceBatch( self.potentials, E ) )
+            P.setNeighbors( self.neighbors )
+            P.setSchedule( self.schedule )
+            return CliqueTreeCalibrate( P, semiring=self.semiring )
+
+        self.setEvidence(E)
+        for i in self.dirty:
+            self.observed[i]=self.observeClique( i, self.evidence )
+        if self.MESSAGES is not None:
+            self.invalidate( self.dirty )
+        self.dirty=set()
+
+        P=CliqueTree( list( self.observed ) )
+        P.setNeighbors( self.neighbors )
+        P.setSchedule( self.schedule )
+        (P, self.MESSAGES)=CliqueTreeCalibrate( P, semiring=self.semiring, MESSAGES=self.MESSAGES, beliefs=self.beliefs )
+        self.beliefs=list( P.getNodeList() )
+        return (P, self.MESSAGES)
+
+    def query(self, E=[], computeJoint=0, ragged=False):
+        """ the marginals of the variables (see getVariables) given the evidence E, and the joint
+            distribution if computeJoint is 1, as returned by ComputeExactMarginalsBP (ragged packs the
+            marginals into one array, see RaggedMarginals) """
+        (P, MESSAGES)=self.calibrate(E)
+        if computeJoint == 1:
+            jointDistribution=ComputeJointDistributionFromCalibratedCliqueTree( P, MESSAGES, semiring=self.semiring )
+        else:
+            jointDistribution=None
+
+        vals=ExtractMarginals( P.getNodeList(), self.variables, self.semiring, self.cliqueIndex )
+        if np.ndim(E) == 2:
+            vals=BroadcastMarginals( vals, np.shape(E)[0] )
+        if ragged:
+            return ( RaggedMarginals( self.variables, vals ), jointDistribution )
+        MARGINALS=[ Factor( [ v ], [ val.shape[-1] ], val, str(v) ) for (v, val) in zip( self.variables, vals ) ]
+        return (MARGINALS, jointDistribution)
+
+    def queryJoint(self, V, E=[]):
+        """ the joint distribution over the variables in V given the evidence E, from the subtree of the
+            calibrated tree connecting them (see ComputeSubsetJointFromCalibratedCliqueTree). The tree is
+            recalibrated incrementally, so joints over several subsets with the same evidence pass no new messages """
+        (P, MESSAGES)=self.calibrate(E)
+        return ComputeSubsetJointFromCalibratedCliqueTree( P, MESSAGES, V, semiring=self.semiring )
@@ -0,0 +1,166 @@
+""" greedy elimination ordering heuristics, see section 9.4.3.2 of Koller and Friedman.
+    An ordering is built by repeatedly eliminating the variable whose elimination is cheapest according to a cost
+    function on the interaction graph (the undirected graph with an edge between every two variables sharing a factor),
+    and connecting its neighbors (the fill edges). The orderings can be handed to SumProductVE / MaxProductVE as Z and to
+    createCliqueTree as order. """
+
+import sys
+import time
+import heapq
+import numpy as np
+
+
+def InteractionGraph( factorList ):
+    """ return a tuple (neighbors, cards) for the list of factors: neighbors is a dict with the set of neighbors of
+        each variable in the interaction graph and cards a dict with the cardinality of each variable """
+    neighbors={}
+    cards={}
+    for f in factorList:
+        variables=f.getVar().tolist()
+        for (v, c) in zip( variables, f.getCard().tolist() ):
+            cards[v]=c
+            neighbors.setdefault( v, set() ).update( variables )
+    for v in neighbors:
+        neighbors[v].discard(v)
+    return ( neighbors, cards )
+
+
+def MinNeighborsCost( v, neighbors, cards ):
+    """ the number of neighbors of v """
+    return len( neighbors[v] )
+
+
+def MinWeightCost( v, neighbors, cards ):
+    """ the product of the cardinalities of the neighbors of v """
+    return np.prod( [ float(cards[u]) for u in neighbors[v] ] )
+
+
+def MinFillCost( v, neighbors, cards ):
+    """ the number of fill edges eliminating v would add """
+    nbs=list( neighbors[v] )
+    fill=0
+    for a in range( len(nbs) ):
+        for b in range( a+1, len(nbs) ):
+            if nbs[b] not in neighbors[ nbs[a] ]:
+                fill+=1
+    return fill
+
+
+def WeightedMinFillCost( v, neighbors, cards ):
+    """ the sum of the weights of the fill edges eliminating v would add,
+        the weight of an edge being the product of the cardinalities of its endpoints """
+    nbs=list( neighbors[v] )
+    fill=0.
+    for a in range( len(nbs) ):
+        for b in range( a+1, len(nbs) ):
+            if nbs[b] not in neighbors[ nbs[a] ]:
+                fill+=float( cards[ nbs[a] ] ) * cards[ nbs[b] ]
+    return fill
+
+
+""" the heuristics by name. The fill heuristics depend on the neighbors of the neighbors of a variable,
+    so eliminating a variable changes their cost two steps away in the graph """
+ORDERING_HEURISTICS={ 'min-neighbors': ( MinNeighborsCost, 1 ),
+                      'min-weight': ( MinWeightCost, 1 ),
+                      'min-fill': ( MinFillCost, 2 ),
+                      'weighted-min-fill': ( WeightedMinFillCost, 2 ) }
+
+
+def EliminateFromGraph( v, neighbors ):
+    """ eliminate v from the interaction graph in place: connect its neighbors to each other and remove v.
+        Returns the set of v's neighbors """
+    nbs=neighbors.pop( v )
+    for u in nbs:
+        neighbors[u].discard( v )
+        neighbors[u].update( nbs )
+        neighbors[u].discard( u )
+    return nbs
+
+
+def GreedyOrdering( factorList, heuristic='min-fill', rng=None, keepVars=[] ):
+    """ return an elimination ordering of the variables of factorList that are not in keepVars, built greedily
+        with the named heuristic (see ORDERING_HEURISTICS). Ties are broken by the smallest variable, or at random if
+        rng (a numpy RandomState) is given, so repeated calls with an rng explore different orderings.
+
+        The variables sit in a heap keyed on (cost, tie, variable), tie being the variable itself or a uniform
+        random number. Only the costs of the variables near an eliminated one change: they get a fresh heap entry
+        and stale entries are skipped when popped, as in createCliqueTree. Every live entry of the minimum cost
+        has an independent random tie, so the one popped is a uniform draw among the cheapest variables """
+
+    if heuristic not in ORDERING_HEURISTICS:
+        sys.stderr.write("unknown elimination ordering heuristic: " + str(heuristic) + "\n")
+        sys.exit(1)
+    ( costfunc, reach )=ORDERING_HEURISTICS[ heuristic ]
+
+    def tie( v ):
+        return v if rng is None else rng.random_sample()
+
+    ( neighbors, cards )=InteractionGraph( factorList )
+    keep=set( keepVars )
+    cost=dict( [ ( v, costfunc( v, neighbors, cards ) ) for v in neighbors if v not in keep ] )
+    ties=dict( [ ( v, tie(v) ) for v in sorted( cost ) ] )
+    heap=[ ( cost[v], ties[v], v ) for v in cost ]
+    heapq.heapify( heap )
+
+    order=[]
+    while len(cost) > 0:
+        (best, t, z)=heapq.heappop( heap )
+        if z not in cost or cost[z] != best or ties[z] != t:
+            continue
+        order.append( z )
+        del cost[z]
+
+        #only the cost of variables near z changed
+        changed=EliminateFromGraph( z, neighbors )
+        if reach > 1:
+            changed=set( changed ).union( *[ neighbors[u] for u in changed ] )
+        for u in changed:
+            if u in cost:
+                c=costfunc( u, neighbors, cards )
+                if c != cost[u]:
+                    cost[u]=c
+                    ties[u]=tie(u)
+                    heapq.heappush( heap, ( c, ties[u], u ) )
+    return order
+
+
+def OrderingCost( factorList, order ):
+    """ score an elimination ordering of the variables of factorList: returns a tuple (totalSize, maxCliqueSize)
+        of the summed size of the intermediate tables eliminating the variables in order creates and the
+        size of the largest of them (the largest clique of the induced clique tree). Lower is better """
+    ( neighbors, cards )=InteractionGraph( factorList )
+    totalSize=0.
+    maxCliqueSize=0.
+    for z in order:
+        if z not in neighbors:
+            continue
+        size=float( cards[z] ) * np.prod( [ float(cards[u]) for u in neighbors[z] ] )
+        totalSize+=size
+        maxCliqueSize=max( maxCliqueSize, size )
+        EliminateFromGraph( z, neighbors )
+    return ( totalSize, maxCliqueSize )
+
+
+def FindEliminationOrdering( factorList, heuristics=None, restarts=10, timeBudget=None, seed=None, keepVars=[] ):
+    """ search for a good elimination ordering of the variables of factorList not in keepVars.
+        Every heuristic in heuristics (default: all of ORDERING_HEURISTICS) is run once with deterministic tie breaking,
+        then again restarts times each with randomized tie breaking, stopping early once timeBudget seconds have
+        passed (the deterministic runs always complete). Orderings are scored with OrderingCost.
+
+        Returns a tuple (order, cost) of the best ordering found and its (totalSize, maxCliqueSize) """
+
+    if heuristics is None:
+        heuristics=sorted( ORDERING_HEURISTICS.keys() )
+    rng=np.random.RandomState( seed )
+    start=time.time()
+
+    best=None
+    for attempt in range( restarts+1 ):
+        for heuristic in heuristics:
+            if attempt > 0 and timeBudget is not None and time.time() - start > timeBudget:
+                return best
+            order=GreedyOrdering( factorList, heuristic, rng if attempt > 0 else None, keepVars )
+            cost=OrderingCost( factorList, order )
+            if best is None or cost < best[1]:
+                best=( order, cost )
+    return best
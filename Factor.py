@@ -4,16 +4,31 @@ class Factor(object):
 
     """ Represents a factor in a PGM. A factor has variable scope, cardinality, value, and potentially a name.
         A factor's values (which can potentially be multi-dimensional table, are represented as NumPy 1d-arrays.
-        See Chapter10 Friedman pg. 358 and Koller for more info. """
+        See Chapter10 Friedman pg. 358 and Koller for more info.
 
+        The class is slotted so a network with tens of thousands of factors doesn't pay for a __dict__ per factor.
+        var and card are kept as int64 arrays and val as a contiguous float64 array. The setters adopt arrays
+        that already have the right dtype and layout without copying them, so pass a copy if the caller is going
+        to keep modifying its array. The strides and total size of the value table are computed lazily from card
+        and cached until the cardinality is changed through setCard.
+
+        val can also carry a leading batch dimension: a B x prod(card) array holds B tables over the same scope,
+        one per evidence case (or genomic site), each laid out like an ordinary val array. The kernels in
+        FactorOperations work on all B tables at once, and a factor without a batch dimension broadcasts against
+        a batched one, so only the factors that differ between cases need to be batched.
+
+        val may be a read-only array shared with other factors built from the same parameters (see SharedTables.py).
+        Write into a factor's values through getWritableVal, which copies a shared array first. """
+
+    __slots__ = ( '_var', '_card', '_val', 'name', '_strides', '_size' )
 
 
     def __init__(self, var=[], card=[], val=[], name= 'None'):
         """ a factor has list of variables, each with a cardinality, and for each possible assignment to its variable(s),
         a position in the val array."""
-        self.var= np.array(var)
-        self.card=np.array(card)
-        self.val=np.array(val)
+        self.setVar(var)
+        self.setCard(card)
+        self.setVal(val)
         self.name=name
 
     def __str__(self):
@@ -22,27 +37,63 @@ class Factor(object):
         valstring= " ".join( map(str, self.val))
         return "\n".join( [ 'name: ' + self.name,'var: '+ varstring, 'card: '+ cardstring, 'val: ' + valstring])
 
+    def __getstate__(self):
+        """ slotted classes have no __dict__, so spell out the state for pickle """
+        return ( self._var, self._card, self._val, self.name )
+
+    def __setstate__(self, state):
+        ( var, card, val, name )=state
+        self.setVar(var)
+        self.setCard(card)
+        self.setVal(val)
+        self.name=name
+
 
     def setVar(self, var):
-        self.var=np.array(var)
+        self._var=np.asarray(var, dtype=np.int64)
 
     def getVar(self):
-        return self.var
+        return self._var
 
     def getVarCount(self):
-        return len( self.var.tolist() )
+        return len( self._var )
 
     def setVal(self, val):
-        self.val=np.array(val)
+        self._val=np.ascontiguousarray(val, dtype=np.float64)
 
     def getVal(self):
-        return self.val
+        return self._val
+
+    def getWritableVal(self):
+        """ val, to be modified in place. A read-only val, e.g. a table shared with other factors (see
+            SharedTables.py), is replaced by a private copy first, so the other factors keep the original """
+        if not self._val.flags.writeable:
+            self._val=self._val.copy()
+        return self._val
 
     def setCard(self,card):
-        self.card=np.array(card)
+        self._card=np.asarray(card, dtype=np.int64)
+        self._strides=None
+        self._size=None
 
     def getCard(self):
-        return self.card
+        return self._card
+
+    def getStrides(self):
+        """ the stride of each variable in the val array: the distance in val between two assignments
+            that differ by one in that variable only. The first variable has stride 1, see box 10.A
+            page 358 in Koller and Friedman """
+        if self._strides is None:
+            strides=np.ones( len(self._card), dtype=np.int64)
+            strides[1:]=np.cumprod( self._card[:-1] )
+            self._strides=strides
+        return self._strides
+
+    def getSize(self):
+        """ the total number of entries in the value table, prod(card) """
+        if self._size is None:
+            self._size=int( np.prod( self._card ) )
+        return self._size
 
     def getName(self):
         return self.name
@@ -50,6 +101,10 @@ class Factor(object):
     def setName(self, name):
         self.name=name
 
+    var=property(getVar, setVar)
+    card=property(getCard, setCard)
+    val=property(getVal, setVal)
+
 
 
 
@@ -2,11 +2,17 @@
 from Factor import *
 import numpy as np
 from PGMcommon import *
+from FactorPlanCache import *
+from Semiring import *
 import sys
 import itertools
-import common
 import pdb
 
+""" plans computed from the scopes of factors (see FactorAlign, FactorReduceVal) are shared through this
+    cache by every operation in the module. Use factorPlanCache.getStats() to see how well it is doing
+    and factorPlanCache.setMaxBytes() to change how much memory it may hold """
+factorPlanCache=FactorPlanCache()
+
 def IndexToAssignment( I, D):
 
     """ given and index I (a row vector representing the indices of values a factor object's val field
@@ -92,7 +98,7 @@ def SetValueOfAssignment( F, A, v, Vorder=None):
     indices=np.array(indx-1).flatten().tolist()
     zeros=np.zeros(len(A))
     zeros[indices]=v
-    F.setVal( zeros.tolist() )
+    F.setVal( zeros )
 
 def GetValueOfAssignment( F, A, Vorder = None ):
     """ % GetValueOfAssignment Gets the value of a variable assignment in a factor.
@@ -113,22 +119,105 @@ def GetValueOfAssignment( F, A, Vorder = None ):
     indices=np.array(indx-1).flatten().tolist()
     return np.array ( np.matrix ( F.getVal()[indices] ))
 
-def FactorProduct ( A, B):
-    """ FactorProduct Computes the product of two factors.
-%       C = FactorProduct(A,B) computes the product between two factors, A and B,
-%       where each factor is defined over a set of variables with given dimension.
-%       The factor data structure has the following fields:
-%       .var    Vector of variables in the factor, e.g. [1 2 3]
-%       .card   Vector of cardinalities corresponding to .var, e.g. [2 2 2]
-%       .val    Value table of size prod(.card)
-%
-%       See also FactorMarginalization  IndexToAssignment,
-%       AssignmentToIndex, and https://github.com/indapa/PGM/blob/master/Prog1/FactorProduct.m """
+def ValArrayPlan( Fvar, Fcard, var ):
+    """ the plan FactorValArray follows to line up a factor over Fvar (with cardinalities Fcard)
+        with the variables in var: a tuple (Fcard, perm, shape) of the N-d shape of the factor's table,
+        the permutation that puts its axes in the order they appear in var and the broadcast shape
+        with an axis of length 1 for every variable of var not in Fvar """
+
+    mapF=np.array( isMember( Fvar, np.asarray(var) ), dtype=int) #position of each of F's variables in var
+    Fcard=tuple( [ int(c) for c in Fcard ] )
+
+    shape=np.ones( len(var), dtype=int)
+    shape[mapF]=Fcard
+    return ( Fcard, tuple( np.argsort(mapF).tolist() ), tuple( shape.tolist() ) )
+
+
+def ValToArray( val, Fcard ):
+    """ view a val array as an N-d array with one axis per variable, in Fortran order (the first variable
+        changes fastest). A batched val array (see Factor) keeps its batch dimension as a leading axis """
+    if np.ndim(val) == 2:
+        ndval=np.reshape( val, ( val.shape[0], ) + tuple( reversed(Fcard) ) )
+        return np.transpose( ndval, [ 0 ] + range( len(Fcard), 0, -1 ) )
+    return np.reshape( val, Fcard, order='F')
+
+
+def ArrayToVal( ndval, batched ):
+    """ the inverse of ValToArray: ravel an N-d array in Fortran order into a val array, or into a
+        B x n batched val array if batched is True and the first axis is the batch axis """
+    if batched:
+        ndval=np.transpose( ndval, [ 0 ] + range( ndval.ndim-1, 0, -1 ) )
+        return np.reshape( ndval, ( ndval.shape[0], -1 ) )
+    return np.ravel( ndval, order='F')
+
+
+def TransposeTable( ndval, perm ):
+    """ permute the variable axes of an N-d table (the last len(perm) axes), leaving a leading batch axis alone """
+    offset=ndval.ndim - len(perm)
+    return np.transpose( ndval, range(offset) + [ p+offset for p in perm ] )
+
+
+def ApplyValArrayPlan( val, plan ):
+    """ reshape a factor's val array following a plan from ValArrayPlan. A batched val array keeps its
+        leading batch axis, which broadcasts against an unbatched table """
+    (Fcard, perm, shape)=plan
+    ndval=TransposeTable( ValToArray( val, Fcard ), perm )
+    return np.reshape( ndval, ndval.shape[ :ndval.ndim-len(Fcard) ] + shape )
 
-    #print "A: ", A
-    #print "===="
-    #print "B: ", B
-    C=Factor()
+
+def FactorValArray( F, var ):
+    """ view the val array of Factor F as an N-d array whose axes line up with the variables in var.
+        The val array is laid out column-major (the first variable in F.var changes fastest, see IndexToAssignment)
+        so reshaping it in Fortran order gives one axis per variable of F. Those axes are permuted into the order
+        the variables appear in var, and every variable of var not in the scope of F gets an axis of length 1.
+        The resulting array broadcasts against a table over var without enumerating any assignments. """
+
+    return ApplyValArrayPlan( F.getVal(), ValArrayPlan( F.getVar(), F.getCard(), var ) )
+
+
+def FactorAlign ( A, B):
+    """ given two factors A and B return a tuple (Cvar, Ccard, Aval, Bval) where Cvar is the union of the
+        variables of A and B, Ccard their cardinalities and Aval and Bval are the val arrays of A and B as
+        N-d arrays that broadcast against each other over the scope Cvar (see FactorValArray).
+        An elementwise operation on Aval and Bval raveled in Fortran order is the val array of the resulting factor.
+
+        The plan (Ccard and how to reshape each table) only depends on the layout of the scopes of A and B
+        relative to each other, so it is kept in factorPlanCache under their RelativeSignature and computed
+        on the ranks of the variables. """
+
+    (signature, Cvar, ranks)=RelativeSignature( [ A, B ] )
+    key=( 'align', signature )
+    plan=factorPlanCache.get(key)
+
+    if plan is None:
+        #check of  variables that in both A and B have the same cardinality
+        intersect=np.intersect1d( A.getVar(), B.getVar() ).tolist()
+        if len(intersect) > 0:
+            iA=getIndex( A.getVar(), intersect )
+            iB = getIndex (  B.getVar(), intersect )
+            if np.any( A.getCard()[iA] != B.getCard()[iB] ):
+                sys.stderr.write("dimensionality mismatch in factors!\n")
+                sys.exit(1)
+
+        #the variables of C are the union of variables in factors A and B, ranked 0..len(Cvar)-1
+        Crank=np.arange( len(Cvar) )
+        Ccard=np.zeros( len(Cvar), dtype=np.int64)
+        Ccard[ ranks[0] ]=A.getCard()
+        Ccard[ ranks[1] ]=B.getCard()
+
+        #the cached array is shared by every factor built from this plan, so it must never change
+        Ccard.setflags(write=False)
+
+        plan=factorPlanCache.put( key, ( Ccard, ValArrayPlan( ranks[0], A.getCard(), Crank ), ValArrayPlan( ranks[1], B.getCard(), Crank ) ) )
+
+    (Ccard, planA, planB)=plan
+    return ( Cvar.astype(np.int64), Ccard, ApplyValArrayPlan( A.getVal(), planA ), ApplyValArrayPlan( B.getVal(), planB ) )
+
+
+def FactorCombine ( A, B, semiring ):
+    """ the product of two factors in the given semiring (see Semiring.py): the values of A and B
+        are aligned as N-d arrays over the union of their variables (see FactorAlign) and combined
+        elementwise, multiplied in probability space and added in log space """
 
    #check for empty factors
     if len( A.getVar() ) == 0 :
@@ -138,64 +227,110 @@ def FactorProduct ( A, B):
         sys.stderr.write("B factor is empty!\n")
         return A
 
+    (Cvar, Ccard, Aval, Bval)=FactorAlign( A, B )
 
-    #check of  variables that in both A and B have the same cardinality
-    #print 'A.getVar():  ', A.getVar()
-    #print 'B.getVar(): ',B.getVar()
-    #setA= set( A.getVar() )
-    #setB= set( B.getVar() )
-    #intersect=np.array( list( setA.intersection(setB)))
-    intersect=np.intersect1d( A.getVar(), B.getVar() ).tolist()
-    #print "Intersection of variables in FactorProduct ", intersect
-    #print "A var: ",  A.getVar()
-    #print "B var: ",  B.getVar()
-
-    #if the intersection of variables in the two factors
-    #is non-zero, then make sure they have the same cardinality
-    if len(intersect) > 0:
-        #iA=np.nonzero(intersect - A.getVar()==0)[0].tolist() # see this http://stackoverflow.com/a/432146, return the index of something in an array?
-        iA=getIndex( A.getVar(), intersect )
-        #print "iA: ", iA
-        #iB=np.nonzero(intersect - B.getVar()==0)[0].tolist()
-        iB = getIndex (  B.getVar(), intersect )
-        #print "iB: ", iB
-
-        # check to see if any of the comparisons in the  array resulting from  of a.getCard()[iA] == b.getCard()[iB] 
-        # are all False. If so print an error and exit
-        if len( np.where( A.getCard()[iA].all() == B.getCard()[iB].all() ==False)[0].tolist() ) > 0:
-            sys.stderr.write("dimensionality mismatch in factors!\n")
-            sys.exit(1)
-
-    #now set the variables of C to the union of variables in factors A and B
-    #print 'setA ' ,setA
-    #print 'setB ', setB
-    #print list( setA.union(setB) )
-    C.setVar( np.union1d ( A.getVar(), B.getVar() ).tolist()  )
-    #C.setVar ( list( setA.union(setB) ) )
-    mapA=isMember(A.getVar(), C.getVar() )
-    mapB=isMember(B.getVar(), C.getVar() )
-
-    
-
-    #Set the cardinality of variables in C
-    C.setCard( np.zeros( len(C.getVar())).tolist() )
-    C.getCard()[mapA]=A.getCard()
-    C.getCard()[mapB]=B.getCard()
+    C=Factor( Cvar, Ccard )
+    #combine the aligned tables, broadcasting over the variables each factor is missing (and over the batch)
+    Cval=semiring.combine( Aval, Bval )
+    C.setVal ( ArrayToVal( Cval, Cval.ndim > len(Cvar) ) )
 
-    #intitialize the values of the factor C to be zero
-    C.setVal( np.zeros(np.prod(C.getCard())).tolist() )
+    return C
 
-    #some helper indices to tell what indices of A and B values to multiply
-    assignments=IndexToAssignment( np.arange(np.prod(C.getCard())), C.getCard() ) #get the assignment of values of C
-    indxA=AssignmentToIndex(  assignments[:,mapA], A.getCard())-1 # re-arrange the assignment of C, to what it would be in factor  A
-    indxB=AssignmentToIndex(  assignments[:,mapB], B.getCard())-1 # re-arange the assignment of C to what it would be in  factorB
 
-    
+def FactorProduct ( A, B):
+    """ FactorProduct Computes the product of two factors.
+%       C = FactorProduct(A,B) computes the product between two factors, A and B,
+%       where each factor is defined over a set of variables with given dimension.
+%       The factor data structure has the following fields:
+%       .var    Vector of variables in the factor, e.g. [1 2 3]
+%       .card   Vector of cardinalities corresponding to .var, e.g. [2 2 2]
+%       .val    Value table of size prod(.card)
+%
+%       The values of A and B are aligned as N-d arrays over the union of their variables and
+%       multiplied by broadcasting, so no assignment matrix for C is ever built (see FactorAlign).
+%
+%       See also FactorMarginalization  IndexToAssignment,
+%       AssignmentToIndex, and https://github.com/indapa/PGM/blob/master/Prog1/FactorProduct.m """
 
-    c_val=A.getVal()[indxA.flatten().tolist()] * B.getVal()[indxB.flatten().tolist()] #now that we have the index into A.val and B.val vector, multiply them to factor product
-    C.setVal ( c_val.tolist() )
+    return FactorCombine( A, B, sumProduct )
+
+def ReducePlan( A, mapB ):
+    """ the plan FactorReduceVal and FactorArgmaxVal follow to reduce Factor A onto the variables at positions mapB
+        of A.var: a tuple (Acard, eliminate, perm) of the N-d shape of A's table, the axes to eliminate and the
+        permutation putting the surviving axes in the order of mapB. It doesn't depend on the variables of A,
+        only on its cardinalities, which is what it is kept in factorPlanCache under """
+    key=( 'reduce', A.getCard().tobytes(), tuple(mapB) )
+    plan=factorPlanCache.get(key)
+    if plan is None:
+        Acard=tuple( [ int(c) for c in A.getCard() ] )
+        eliminate=tuple( [ i for i in range(len(Acard)) if i not in mapB ] )
+        #axes left after the reduction are in the order they were in A, put them in the order of mapB
+        kept=sorted(mapB)
+        plan=factorPlanCache.put( key, ( Acard, eliminate, tuple( [ kept.index(m) for m in mapB ] ) ) )
+    return plan
+
+
+def FactorReduceVal( A, mapB, func ):
+    """ reduce the val array of Factor A onto the variables at positions mapB of A.var
+        A.val is viewed as an N-d array (one axis per variable, column-major as in FactorValArray)
+        and func (np.sum, np.max, ...) is applied over the axes of the variables *not* in mapB in a single call.
+        The surviving axes are transposed into the order given by mapB, so the returned val array
+        has the layout of a factor whose var is A.var[mapB]. This replaces the accum based reduction,
+        which looped in Python over every cell of the table. A batched val array is reduced table by table """
+
+    (Acard, eliminate, perm)=ReducePlan( A, mapB )
+    ndval=ValToArray( A.getVal(), Acard )
+    offset=ndval.ndim - len(Acard)
+    ndval=func( ndval, axis=tuple( [ k+offset for k in eliminate ] ) )
+    ndval=TransposeTable( ndval, perm )
+    return ArrayToVal( ndval, offset > 0 )
+
+
+def FactorArgmaxVal( A, mapB ):
+    """ the argmax counterpart of FactorReduceVal( A, mapB, np.max ): for every assignment of the variables at
+        positions mapB of A.var (laid out like the val array FactorReduceVal returns) the index of the maximizing
+        assignment of the eliminated variables, as a position in the column-major table over the eliminated
+        variables in the order they appear in A.var. If every variable is eliminated the index is a scalar """
+
+    (Acard, eliminate, perm)=ReducePlan( A, mapB )
+    if len(eliminate) == len(Acard):
+        return int( np.argmax( A.getVal() ) )
+    ndval=np.reshape( A.getVal(), Acard, order='F')
+    kept=[ k for k in range(len(Acard)) if k not in eliminate ]
+    #move the eliminated axes last and flatten them (column-major) into one axis
+    ndval=np.transpose( ndval, kept + list(eliminate) )
+    ndval=np.reshape( ndval, tuple( [ Acard[k] for k in kept ] ) + (-1,), order='F')
+    argmax=np.argmax( ndval, axis=-1 )
+    argmax=np.transpose( argmax, perm )
+    return np.ravel( argmax, order='F')
+
+
+def MarginalScope( A, V, key, scopefunc, relative=True ):
+    """ the scope (Bvar, Bcard, mapB) left after the variables in V are eliminated from Factor A.
+        scopefunc( A.var, V ) returns the remaining variables in the order the resulting factor lists them
+        and mapB their positions in A.var. (Bcard, mapB) is cached in factorPlanCache under key and the
+        layout of A: the order of its variables, their cardinalities and which of them are in V, so factors
+        laid out the same way over different variables share it. That requires scopefunc to return the
+        variables in sorted order; if it doesn't, relative must be False and the cache key is A's scope
+        signature and the set of variables in V """
+
+    Avar=A.getVar()
+    if relative:
+        cachekey=( key, np.argsort( Avar, kind='mergesort' ).tobytes(), A.getCard().tobytes(), np.in1d( Avar, list(V) ).tobytes() )
+    else:
+        cachekey=( key, ScopeSignature(A), frozenset(V) )
+    scope=factorPlanCache.get(cachekey)
+    if scope is None:
+        Bvar=np.asarray( scopefunc( Avar, V ), dtype=np.int64 )
+        mapB=isMember(Bvar, Avar) #indices of the variables of the new factor in the original factor A
+        Bcard=A.getCard()[mapB]
+        Bcard.setflags(write=False)
+        scope=( Bcard, tuple(mapB) )
+        if len(Bvar) > 0:
+            factorPlanCache.put( cachekey, scope )
+    (Bcard, mapB)=scope
+    return ( Avar[ list(mapB) ], Bcard, mapB )
 
-    return C
 
 def FactorMarginalization(A,V):
     """   FactorMarginalization Sums given variables out of a factor.
@@ -220,38 +355,50 @@ def FactorMarginalization(A,V):
     #construct the variables of the marginalized factor by 
     #computing the set difference between A.var and V
     #These variables in the difference set will be the scope of the new factor
-    setA=set( A.getVar() )
-    setV=set(V)
-    Bvar=np.array( list( setA.difference(setV)))
-    mapB=isMember(Bvar, A.getVar()) #indices of the variables of the new factor in the original factor A
-    #print mapB,  Bvar
+    (Bvar, Bcard, mapB)=MarginalScope( A, V, 'marginalize', lambda Avar, V: list( set(Avar).difference(set(V)) ), relative=False )
 
     #check to see if the new factor has empty scope
     if len(Bvar) == 0:
         sys.stderr.write("FactorMarginalization:Error, resultant factor has empty scope...\n")
         return None
     #set the marginalized factor's variable scope and cardinality
-    B.setVar( Bvar.tolist() )
-    B.setCard( A.getCard()[mapB] )
-    B.setVal( np.zeros(np.prod(B.getCard())).tolist() )
-
-    #compute some helper indices
-    assignments=IndexToAssignment ( np.arange(np.prod(A.getCard()) ), A.getCard() )
-    #indxB tells which values in A to sum together when marginalizing out the variable(s) in B
-    indxB=AssignmentToIndex( assignments[:,mapB], B.getCard())-1
-
-    #accum is a numpy implementation of matlab accumarray
-    #accumarray sums data in each group
-    #here the group(s) are defined in indxB
-    #indxB is a map to tell which value in A.val to map the sum to
-    #see http://blogs.mathworks.com/loren/2008/02/20/under-appreciated-accumarray/
-    marginal_vals=accum(indxB, A.getVal() )
-    
+    B.setVar( Bvar )
+    B.setCard( Bcard )
+
+    #view A.val as an N-d array and sum over the axes of the variables in V
+    #the remaining axes are put in the order of Bvar, see FactorReduceVal
+    marginal_vals=FactorReduceVal( A, mapB, sumProduct.reduce )
+
     #set the marginal values to the new factor with teh variable(s) in V summed(marginalized) out
-    B.setVal( marginal_vals.tolist() )
+    B.setVal( marginal_vals )
     return B
 
 
+def FactorReduce( A, V, semiring ):
+    """ eliminate the variables in V from Factor A the way the semiring does it: summed out for sum-product
+        (log-sum-exp in log space) and maxed out for max-product and max-sum. The variables of the
+        resulting factor are those of A not in V, in sorted order. If no variable is left the reduced
+        value is returned as a scalar (an array with one value per table for a batched factor) """
+
+    #check for empy factor or variable list
+    if len( A.getVar() ) == 0 or len(V) == 0:
+        return A
+    (Bvar, Bcard, mapB)=MarginalScope( A, V, 'setdiff', np.setdiff1d )
+
+    if len(Bvar) == 0:
+        return semiring.reduce( A.getVal(), axis=-1 if np.ndim( A.getVal() ) == 2 else None )
+
+    B=Factor( Bvar, Bcard )
+    B.setVal( FactorReduceVal( A, mapB, semiring.reduce ) )
+    return B
+
+
+def FactorNormalize( A, semiring ):
+    """ return a copy of Factor A normalized in the given semiring (summing to one for sum-product,
+        with a max of one for max-product, and the log space equivalents of those) """
+    return Factor( A.getVar(), A.getCard(), semiring.normalize( A.getVal() ), A.getName() )
+
+
 
 def ObserveEvidence (INPUTS, EVIDENCE):
 
@@ -263,7 +410,10 @@ def ObserveEvidence (INPUTS, EVIDENCE):
           .card   Vector of cardinalities corresponding to .var, e.g. [2 2 2]
           .val    Value table of size prod(.card)
           EVIDENCE is an N-by-2 matrix, where each row consists of a variable/value pair.
-          Variables are in the first column and values are in the second column.   """
+          Variables are in the first column and values are in the second column.
+          The factors are modified in place through getWritableVal, so a factor whose val array is shared
+          with other factors (see SharedTables.py) gets a private copy first. Factors that don't mention
+          an observed variable are left alone.   """
     (nrows, ncols)=np.shape(EVIDENCE)
     #total_factors=len(INPUTS)
     #iterate through evidence
@@ -278,8 +428,9 @@ def ObserveEvidence (INPUTS, EVIDENCE):
         for factor in INPUTS:
             #the following returns a list
             indx=np.where( factor.getVar() == variable )[0].tolist()
-            if indx: #if the indx is not empty, it contains the index value  of the evidence variable in factor.val array
-                indx=indx[0]
+            if not indx: #the factor doesn't mention the variable
+                continue
+            indx=indx[0] #the index value of the evidence variable in factor.val array
                 
             if value > factor.getCard()[indx] or value < 0:
                 sys.stderr.write("invalid evidene for variable X_'" + str(variable) + " = " + str(value) + "\n")
@@ -289,11 +440,10 @@ def ObserveEvidence (INPUTS, EVIDENCE):
             assignments=IndexToAssignment( np.arange(np.prod( factor.getCard() )), factor.getCard() )
             # now get the indices in  the assignments that don't agree with the observed  value (evidence)
             mask=np.where( assignments[:,indx] != value )[0].tolist()
-            #we are going to update the val array for the current factor
-            newvals=factor.getVal()
-            #set the mask indices to zero and reset the val array of the factor
+            #set the mask indices to zero. The val array may be shared with other factors (see SharedTables.py),
+            #getWritableVal gives the factor its own copy first
+            newvals=factor.getWritableVal()
             newvals[mask]=0
-            factor.setVal( newvals.tolist() )
 
             #now check to see the validity of the updated values of the factor
             #given the observed evidence. We cannot have all zero values for the factor!
@@ -302,6 +452,108 @@ def ObserveEvidence (INPUTS, EVIDENCE):
                 sys.stderr.write("All variable values are zero, which is not possible.\n")
     return INPUTS
 
+def ReduceFactorEvidence( F, observed ):
+    """ condition Factor F on the evidence in the dict observed (variable -> observed value, values are 1-based)
+        by slicing the observed variables out of its table. The table is viewed as an N-d array
+        (see FactorValArray) and indexed with the observed values, so the work is proportional to the size of
+        the reduced table. The returned factor is over the variables of F that were not observed, in their
+        original order. F itself is not modified; it is returned as is if none of its variables are observed """
+
+    Fvar=F.getVar().tolist()
+    Fcard=F.getCard().tolist()
+    if not any( [ v in observed for v in Fvar ] ):
+        return F
+
+    index=[]
+    for (v, c) in zip( Fvar, Fcard ):
+        if v in observed:
+            value=observed[v]
+            if value > c or value < 1:
+                sys.stderr.write("invalid evidene for variable X_'" + str(v) + " = " + str(value) + "\n")
+                sys.exit(1)
+            index.append( value-1 )
+        else:
+            index.append( slice(None) )
+
+    ndval=ValToArray( F.getVal(), tuple(Fcard) )
+    batched=ndval.ndim > len(Fcard)
+    if batched:
+        index.insert( 0, slice(None) )
+    kept=[ k for k in range(len(Fvar)) if Fvar[k] not in observed ]
+    return Factor( [ Fvar[k] for k in kept ], [ Fcard[k] for k in kept ], ArrayToVal( ndval[ tuple(index) ], batched ), getFactorName(F) )
+
+
+def ObserveEvidenceReduce (INPUTS, EVIDENCE):
+    """ the scope reducing counterpart of ObserveEvidence. Instead of zeroing the entries of the factors in INPUTS
+        that disagree with the evidence, the observed variables are sliced out of the factors (see ReduceFactorEvidence),
+        applying every row of EVIDENCE to a factor in one pass. Downstream products and messages then never carry
+        the cardinality of an observed variable.
+
+        EVIDENCE is an N-by-2 matrix of variable/value pairs, as in ObserveEvidence.
+        Returns a new list of factors, the factors in INPUTS are left untouched. A factor whose variables are all
+        observed is reduced to a constant, which is folded into the first factor left with a non-empty scope
+        so the product of the returned factors is still the unnormalized measure of the evidence. If every variable
+        is observed the constant is returned as the only factor, with an empty scope """
+
+    EVIDENCE=np.reshape( np.asarray(EVIDENCE), (-1,2) )
+    observed={}
+    for (variable, value) in EVIDENCE.tolist():
+        #rows with a value of 0 leave the variable unobserved
+        if int(value) == 0:
+            continue
+        observed[ int(variable) ]=int(value)
+
+    reduced=[]
+    #the constant is kept per table: a batched factor reduced to an empty scope has a B x 1 val array
+    constant=np.ones(1)
+    for factor in INPUTS:
+        factor=ReduceFactorEvidence( factor, observed )
+        if len( factor.getVar() ) == 0:
+            constant=constant * factor.getVal()
+        else:
+            reduced.append( factor )
+
+    if len(reduced) == 0 and len(INPUTS) > 0:
+        reduced.append( Factor( [], [], constant, 'constant' ) )
+    elif not np.all( constant == 1. ):
+        reduced[0]=Factor( reduced[0].getVar(), reduced[0].getCard(), reduced[0].getVal()*constant, getFactorName(reduced[0]) )
+    if np.any( constant == 0 ):
+        sys.stderr.write("All variable values are zero, which is not possible.\n")
+    return reduced
+
+def ObserveEvidenceBatch (INPUTS, E):
+    """ the batched counterpart of ObserveEvidence. E is a B x N array of evidence vectors, the jth column holding
+        the observed value of variable j+1 in each case (0 for unobserved). Every factor mentioning a variable that is
+        observed in at least one case gets a batched val array (see Factor): one copy of its table per case, with the
+        entries that disagree with that case's evidence zeroed. The other factors are returned as they are, they
+        broadcast over the batch. Returns a new list of factors, the factors in INPUTS are left untouched """
+
+    E=np.asarray( E, dtype=np.int64 )
+    (B, N)=E.shape
+    observed=[]
+    for factor in INPUTS:
+        Fvar=factor.getVar().tolist()
+        Fcard=factor.getCard().tolist()
+        size=int( np.prod(Fcard) )
+        stride=1
+        mask=None
+        for (v, c) in zip( Fvar, Fcard ):
+            if v <= N and np.any( E[:,v-1] > 0 ):
+                values=E[:,v-1]
+                if np.any( values > c ) or np.any( values < 0 ):
+                    sys.stderr.write("invalid evidene for variable X_'" + str(v) + "\n")
+                    sys.exit(1)
+                #the value of v in each entry of the table, 0-based (the val array is column-major)
+                assignment=( np.arange(size) // stride ) % c
+                agree=( values[:,None] == 0 ) | ( assignment[None,:] == values[:,None]-1 )
+                mask=agree if mask is None else mask & agree
+            stride*=c
+        if mask is None:
+            observed.append( factor )
+        else:
+            observed.append( Factor( Fvar, Fcard, factor.getVal() * mask, getFactorName(factor) ) )
+    return observed
+
 def ComputeJointDistribution(INPUTS):
     """ ComputeJointDistribution Computes the joint distribution defined by a set of given factors
 
@@ -325,6 +577,186 @@ def ComputeJointDistribution(INPUTS):
         return reduce(lambda x, y: FactorProduct(x,y), INPUTS)
 
 
+def ContractionPlan( scopes, cards, keepVars ):
+    """ plan the order in which FactorProductMarginalize contracts a list of tables.
+        scopes is a list of tuples with the variables of each table, cards a dict with the cardinality
+        of every variable and keepVars the variables that must survive. Variables that are not kept are
+        summed out as soon as no other table mentions them.
+
+        Pairs are picked greedily: the next pair is the one whose contracted result grows the memory in use
+        the least (size of the result minus the size of the two inputs). Pairs that share a variable are
+        preferred over outer products. Returns a list of steps (i, j, outvars): contract table i with table j
+        (j is None for summing out variables of a single table), remove both from the list and append the
+        result, whose axes are the variables in outvars. The last step leaves a single table over the kept
+        variables in sorted order. """
+
+    keep=set(keepVars)
+    terms=[ tuple(scope) for scope in scopes ]
+    steps=[]
+
+    def tableSize( scope ):
+        return np.prod( [ float(cards[v]) for v in scope ] )
+
+    def survivors( scope, others ):
+        """ the variables of scope still needed once the tables in others are the only other ones left """
+        needed=keep.union( *[ set(terms[k]) for k in others ] ) if len(others) > 0 else keep
+        return tuple( [ v for v in scope if v in needed ] )
+
+    #sum out variables that appear in only one table before any products are taken
+    reduced=True
+    while reduced:
+        reduced=False
+        for i in range( len(terms) ):
+            out=survivors( terms[i], [ k for k in range(len(terms)) if k != i ] )
+            if len(out) < len(terms[i]):
+                steps.append( ( i, None, out ) )
+                terms=[ terms[k] for k in range(len(terms)) if k != i ] + [ out ]
+                reduced=True
+                break
+
+    while len(terms) > 1:
+        best=None
+        for i in range( len(terms) ):
+            for j in range( i+1, len(terms) ):
+                others=[ k for k in range(len(terms)) if k != i and k != j ]
+                union=tuple( sorted( set(terms[i]).union( terms[j] ) ) )
+                out=survivors( union, others )
+                shares=len( set(terms[i]).intersection( terms[j] ) ) > 0
+                cost=( not shares, tableSize(out) - tableSize(terms[i]) - tableSize(terms[j]) )
+                if best is None or cost < best[0]:
+                    best=( cost, i, j, out )
+        ( cost, i, j, out )=best
+        steps.append( ( i, j, out ) )
+        terms=[ terms[k] for k in range(len(terms)) if k != i and k != j ] + [ out ]
+
+    #the last table is over the kept variables, in sorted order
+    final=tuple( sorted( [ v for v in terms[0] if v in keep ] ) )
+    if final != terms[0]:
+        steps.append( ( 0, None, final ) )
+    return steps
+
+
+def ContractTables( a, avars, b, bvars, outvars ):
+    """ sum the product of the N-d tables a (axes avars) and b (axes bvars) down to the variables in outvars.
+        np.einsum does the contraction without materializing the product over the union of the two scopes.
+        einsum only has 52 labels, for bigger scopes fall back to broadcasting the product and summing it.
+        Either table may have a leading batch axis (see Factor), which is carried through (the Ellipsis) """
+    labels=sorted( set(avars).union(bvars) )
+    if len(labels) <= 52:
+        index=dict( [ (v, k) for (k, v) in enumerate(labels) ] )
+        return np.einsum( a, [ Ellipsis ] + [ index[v] for v in avars ], b, [ Ellipsis ] + [ index[v] for v in bvars ],
+                          [ Ellipsis ] + [ index[v] for v in outvars ] )
+
+    aligned=[]
+    for (t, tvars) in ( (a, avars), (b, bvars) ):
+        order=sorted( range(len(tvars)), key=lambda k: labels.index(tvars[k]) )
+        shape=[ t.shape[ t.ndim-len(tvars) + list(tvars).index(v) ] if v in tvars else 1 for v in labels ]
+        t=TransposeTable( t, order )
+        aligned.append( np.reshape( t, t.shape[ :t.ndim-len(tvars) ] + tuple(shape) ) )
+    product=aligned[0] * aligned[1]
+    product=np.sum( product, axis=tuple( [ k-len(labels) for k in range(len(labels)) if labels[k] not in outvars ] ) )
+    remaining=[ v for v in labels if v in outvars ]
+    return TransposeTable( product, [ remaining.index(v) for v in outvars ] )
+
+
+def FactorProductMarginalize( factors, keepVars ):
+    """ compute the product of the Factor objects in factors with every variable not in keepVars summed out,
+        i.e. FactorMarginalization( ComputeJointDistribution(factors), V ) where V are the variables not in keepVars,
+        without ever building the joint over all the variables of the factors. The tables are contracted
+        a pair at a time in the order chosen by ContractionPlan, summing out a variable as soon as the last table
+        mentioning it has been multiplied in, so peak memory is the size of the largest pairwise contraction rather
+        than the size of the joint. The plan only depends on the scopes, so it is kept in factorPlanCache.
+        Batched factors (see Factor) are contracted table by table in the same einsum calls.
+
+        The resulting factor's variables are the variables of keepVars present in factors, in sorted order. """
+
+    factors=[ f for f in factors if len( f.getVar() ) > 0 ]
+    if len(factors) == 0:
+        sys.stderr.write("Empty factor list given as input\n")
+        return Factor( [], [], [] )
+
+    #the plan is made on the ranks of the variables (see RelativeSignature), einsum only needs consistent labels
+    (signature, union, ranks)=RelativeSignature( factors )
+    kept=np.in1d( union, list(keepVars) )
+    key=( 'contract', signature, kept.tobytes() )
+    plan=factorPlanCache.get(key)
+    if plan is None:
+        cards={}
+        for (f, r) in zip( factors, ranks ):
+            for (v, c) in zip( r.tolist(), f.getCard().tolist() ):
+                if cards.setdefault( v, c ) != c:
+                    sys.stderr.write("dimensionality mismatch in factors!\n")
+                    sys.exit(1)
+        keep=np.flatnonzero( kept ).tolist()
+        if len(keep) == 0:
+            sys.stderr.write("FactorProductMarginalize:Error, resultant factor has empty scope...\n")
+            return None
+        steps=ContractionPlan( [ tuple( r.tolist() ) for r in ranks ], cards, keep )
+        Bcard=np.array( [ cards[v] for v in keep ], dtype=np.int64 )
+        Bcard.setflags(write=False)
+        plan=factorPlanCache.put( key, ( steps, Bcard ) )
+
+    (steps, Bcard)=plan
+    Bvar=union[ kept ].astype(np.int64)
+    terms=[ ( tuple( r.tolist() ), ValToArray( f.getVal(), tuple( f.getCard().tolist() ) ) ) for (f, r) in zip( factors, ranks ) ]
+    #a batched factor has a B x prod(card) val array
+    batched=any( [ np.ndim( f.getVal() ) == 2 for f in factors ] )
+    for (i, j, outvars) in steps:
+        (avars, a)=terms[i]
+        if j is None:
+            remaining=[ v for v in avars if v in outvars ]
+            a=np.sum( a, axis=tuple( [ k-len(avars) for k in range(len(avars)) if avars[k] not in outvars ] ) )
+            result=TransposeTable( a, [ remaining.index(v) for v in outvars ] )
+            terms=[ terms[k] for k in range(len(terms)) if k != i ] + [ ( outvars, result ) ]
+        else:
+            (bvars, b)=terms[j]
+            result=ContractTables( a, avars, b, bvars, outvars )
+            terms=[ terms[k] for k in range(len(terms)) if k != i and k != j ] + [ ( outvars, result ) ]
+
+    B=Factor( Bvar, Bcard )
+    B.setVal( ArrayToVal( terms[0][1], batched ) )
+    return B
+
+
+def FactorCombineMarginalize( factors, keepVars, semiring ):
+    """ the product of the Factor objects in factors, in the given semiring, with every variable not in keepVars
+        eliminated. The resulting factor is over the variables of keepVars present in factors, in sorted order.
+
+        Sum-product goes through FactorProductMarginalize. Log-sum-exp shifts each table by its max, contracts the
+        exponentiated tables the same way and takes the log of the result plus the sum of the shifts, so the
+        contraction stays in BLAS-backed einsum calls without losing the dynamic range of log space.
+        The max semirings combine the tables and then reduce the product. """
+
+    factors=[ f for f in factors if len( f.getVar() ) > 0 ]
+    if len(factors) == 0:
+        sys.stderr.write("Empty factor list given as input\n")
+        return Factor( [], [], [] )
+
+    if not semiring.isMax and not semiring.isLog:
+        return FactorProductMarginalize( factors, keepVars )
+
+    scope=set().union( *[ f.getVar().tolist() for f in factors ] )
+    if len( scope.intersection(keepVars) ) == 0:
+        sys.stderr.write("FactorCombineMarginalize:Error, resultant factor has empty scope...\n")
+        return None
+
+    if not semiring.isMax:
+        shifted=[]
+        total=0.
+        for f in factors:
+            #one shift per table of a batch
+            shift=np.max( f.getVal(), axis=-1, keepdims=True )
+            shift[ ~np.isfinite(shift) ]=0.
+            total=total + shift
+            shifted.append( Factor( f.getVar(), f.getCard(), np.exp( f.getVal() - shift ) ) )
+        B=FactorProductMarginalize( shifted, keepVars )
+        B.setVal( np.log( B.getVal() ) + total )
+        return B
+
+    product=reduce( lambda x, y: FactorCombine(x, y, semiring), factors )
+    return FactorReduce( product, list( scope.difference(keepVars) ), semiring )
+
+
 def ComputeMarginal(V, F, E):
     """
         ComputeMarginal Computes the marginal over a set of given variables
@@ -375,26 +807,26 @@ def ComputeMarginal(V, F, E):
 
     #now we need to re-normaize the joint, since observe evidence doesn't do it for us
     jointE_normalizedVal = jointE.getVal()/np.sum( jointE.getVal() )
-    jointE.setVal( jointE_normalizedVal.tolist() )
+    jointE.setVal( jointE_normalizedVal )
 
     return FactorMarginalization ( jointE, v)
     
 
 def IdentityFactor( F ):
-    return Factor ( F.getVar().tolist(), F.getCard().tolist(), np.ones( np.prod( F.getCard() ) ), F.getName()+ '_identity' )
+    return Factor ( F.getVar(), F.getCard(), np.ones( np.prod( F.getCard() ) ), F.getName()+ '_identity' )
 
 
 
-def SumProductEliminateVar(z, factorList):
+def SemiringEliminateVar(z, factorList, semiring):
 
-    """ this is a non-graph based  sum-product variable elimination function
+    """ this is a non-graph based variable elimination function, generic over the semiring
     z is a variable to eliminate
        pass in a list of factors
 
        1. figure out which factor contain z in their variable scope
        2. figure out which factors don't contain z in their scope
-       3. mulitply in all factors that have z
-       4. sum out z (marginalize) and return new factor with variable z eliminated"""
+       3. combine all factors that have z
+       4. eliminate z (sum or max it out) and return new factor with variable z eliminated"""
 
     useFactors = []# list  of factors that contains the variable Z
     unusedFactors=[] #list of factors that don't contain variable Z
@@ -410,19 +842,38 @@ def SumProductEliminateVar(z, factorList):
         else:
             unusedFactors.append( fi )
 
-    #for f in useFactors:
-    #    print 'useFactor: ', f
-    #print '==='
-    #for f in  unusedFactors:
-    #    print 'unusedFactor: ', f
-
-    psiFactor= ComputeJointDistribution ( useFactors )
-    tauFactor=FactorMarginalization( psiFactor,[z] )
+    """ the product of the factors with z in their scope (psi) is contracted straight down to
+        tau = sum_z psi (max_z psi), without building psi itself when the semiring allows it,
+        see FactorCombineMarginalize """
+    tauFactor=FactorCombineMarginalize( useFactors, [ v for v in scope if v != z ], semiring )
 
-    #print 'psiFactor: ', psiFactor
-    #print 'tauFactor: ', tauFactor
     return unusedFactors + [ tauFactor ]
 
+
+def SemiringVE ( Z, F, semiring ):
+
+    """ variable elimination in the given semiring, following algorithm 9.1 in Koller and Friedman.
+        The variables in Z are eliminated in order from the list of factors F and the
+        product of the remaining factors is returned """
+
+    for z in Z:
+        F=SemiringEliminateVar(z, F, semiring)
+    return reduce(lambda x, y: FactorCombine(x, y, semiring), F)
+
+
+def SumProductEliminateVar(z, factorList):
+
+    """ this is a non-graph based  sum-product variable elimination function
+    z is a variable to eliminate
+       pass in a list of factors
+
+       1. figure out which factor contain z in their variable scope
+       2. figure out which factors don't contain z in their scope
+       3. mulitply in all factors that have z
+       4. sum out z (marginalize) and return new factor with variable z eliminated"""
+
+    return SemiringEliminateVar( z, factorList, sumProduct )
+
 def SumProductVE ( Z, F ):
 
     """ A wrapper function for SumProductEliminateVar
@@ -432,47 +883,47 @@ def SumProductVE ( Z, F ):
         eliminate each one getting getting the marginal distribution of the last variable in the list
         Z. """
 
-    for z in Z:
-        F=SumProductEliminateVar(z, F)
-    return reduce(lambda x, y: FactorProduct(x,y), F)
+    return SemiringVE( Z, F, sumProduct )
 
 
-def FactorMaxMarginalization( A, V ):
+def FactorMaxMarginalization( A, V, returnArgmax=False ):
     """ computes the factor with the variables in V *maxed* out.
         The resulting factor will have all the variables in A minus
         those variables in V. This is quite similiar to FactorMarginalization, but rather then summing out variables in V
-        we take the max. In the code, this translates passing np.max as the function to accum
-        See section  13.2 in Koller and Friedman  for more information"""
+        we take the max. In the code, this translates passing maxProduct.reduce (np.max) as the function to FactorReduceVal
+        See section  13.2 in Koller and Friedman  for more information
+
+        If returnArgmax is True a tuple (B, argmax) is returned, where argmax holds backpointers to the maximizing
+        assignment of the variables in V for every entry of B (see FactorArgmaxVal)"""
 
     B=Factor()
     #check for empy factor or variable list
     if len( A.getVar() ) == 0 or len(V) == 0:
+        if returnArgmax:
+            return ( A, None )
         return A
-    Bvar=np.setdiff1d( A.getVar(), V)
-    mapB=isMember(Bvar, A.getVar())
+    (Bvar, Bcard, mapB)=MarginalScope( A, V, 'setdiff', np.setdiff1d )
 
     if len(Bvar) == 0:
         sys.stderr.write("FactorMaxMarginalization: Error, resultant factor has empty scope...\n")
+        if returnArgmax:
+            return ( np.max (A.getVal() ), FactorArgmaxVal( A, mapB ) )
         return np.max (A.getVal() )
     #set the marginalized factor's variable scope and cardinality
-    B.setVar( Bvar.tolist() )
-    B.setCard( A.getCard()[mapB] )
-    B.setVal( np.zeros(np.prod(B.getCard())).tolist() )
+    B.setVar( Bvar )
+    B.setCard( Bcard )
 
-    #compute some helper indices
-    assignments=IndexToAssignment ( np.arange(np.prod(A.getCard()) ), A.getCard() )
-    #indxB tells which values in A to sum together when marginalizing out the variable(s) in B
-    indxB=AssignmentToIndex( assignments[:,mapB], B.getCard())-1
-
-    #here we pass in the function np.max
+    #here we pass in the max reduction of the max-product semiring
     #NumPy and Python are awesome
-    max_vals=accum(indxB, A.getVal(), np.max )
-    B.setVal( max_vals.tolist() )
+    max_vals=FactorReduceVal( A, mapB, maxProduct.reduce )
+    B.setVal( max_vals )
 
+    if returnArgmax:
+        return ( B, FactorArgmaxVal( A, mapB ) )
     return B
 
 
-def MaxProductEliminateVar(z, factorList):
+def MaxProductEliminateVar(z, factorList, semiring=maxProduct):
 
     """ this is a non-graph based  MAX-product variable elimination function
         z is a variable to eliminate
@@ -481,7 +932,9 @@ def MaxProductEliminateVar(z, factorList):
        1. figure out which factor contain z in their variable scope
        2. figure out which factors don't contain z in their scope
        3. mulitply in all factors that have z
-       4. max marginalize out z  and return new factor with variable z eliminated"""
+       4. max marginalize out z  and return new factor with variable z eliminated
+
+       semiring is maxProduct, or maxSum if the factors hold log values"""
 
     useFactors = []# list  of factors that contains the variable Z
     unusedFactors=[] #list of factors that don't contain variable Z
@@ -498,81 +951,48 @@ def MaxProductEliminateVar(z, factorList):
             unusedFactors.append( fi )
 
    
-    """ psiFactor is an intermediate factor, prior to max-marginalization """
-    psiFactor= ComputeJointDistribution ( useFactors )
-    tauFactor=FactorMaxMarginalization( psiFactor,[z] )
+    """ psiFactor is an intermediate factor, prior to max-marginalization.
+        Only the argmax backpointers over z are kept for the traceback, psi itself is dropped here """
+    psiFactor= reduce( lambda x, y: FactorCombine(x, y, semiring), useFactors )
+    (tauFactor, argmax)=FactorMaxMarginalization( psiFactor, [z], True )
+    if isinstance( tauFactor, Factor ):
+        backpointer=( z, tauFactor.getVar(), tauFactor.getCard(), argmax )
+    else:
+        backpointer=( z, np.array( [], dtype=np.int64 ), np.array( [], dtype=np.int64 ), argmax )
 
     
     """ we return tuple consisting of
     1. a list factors that are unused, plus the result of max-marginal
     such that the variable z is not eliminated from the list of factors remaining.
-    2. For traceback, we return the intermediate factor generated in the process of eliminating
-    variable z. """
-    return unusedFactors + [ tauFactor ], psiFactor
-
-def TracebackMAP(FI, Z):
-    """We are back-tracing to the most probable assingments here ...
-    See psuedo-code in Koller and Friedman page 557
-
-    In order to return the most probable assignment from MaxProductVE
-    we take in a list of intermediate factors, FI, that were generated in the process
-    of MaxProductVE. Z is the same elimination ordering used as MaxProductVE.
-    We traceback our steps by iterating in reverse order the elimination ordering Z.
-
-    Following arguments  section 13.2.2 page 558 in Koller and Friedman, as one eliminates
-    variables you cannot determine their maximizing value. But you can compute their 'conditional'
-    maximizing value - their max value given the other variables not eliminate yet. Once
-    the last variable is eliminated, we can traceback to get the maximzing value of the remaining
-    variables. Hence the reason for iterating thru the elimination ordering Z in reverse order
-    
-    Returns a python dictionary with key: variable value: variable assignment in the MAP"""
+    2. For traceback, a backpointer (z, var, card, argmax): argmax gives, for every assignment to the variables
+    var (with cardinalities card) of the max-marginal, the 0-based maximizing value of z. """
+    return unusedFactors + [ tauFactor ], backpointer
 
-    z_i=Z[-1]
-    f_i=FI[-1]
-    Z=Z[:-1]
-    FI=FI[:-1]
 
-    #print 'z_i:', z_i
-    #print 'f_i:', f_i
+def TracebackBackpointers( backpointers, F=None ):
+    """ recover the MAP assignment from the backpointers returned by MaxProductEliminateVar,
+        see Koller and Friedman page 557. The variables are decoded in reverse elimination order; by the time
+        a variable is reached every variable its backpointer depends on has been decoded, so each step is a
+        single lookup. F is the factor left over after the elimination (if any variables were not eliminated),
+        its maximizing assignment is decoded first.
 
-    values=f_i.getVal().tolist()
-    fidx= IndexToAssignment( np.arange( np.prod( f_i.getCard()  ) ), f_i.getCard() )
-    maxidx=values.index(max(values))
-    
+        Returns a python dictionary with key: variable value: variable assignment in the MAP"""
 
     maxed_vars={} #key variable, value: max assignment value
-
-    #print 'variable: ', z_i
-    #print 'max value: ', fidx.flatten()[maxidx]
-    maxed_vars[z_i]=int(fidx.flatten()[maxidx])
-    #print maxed_vars
-    #print
-    for (z, f) in itertools.izip( reversed(Z), reversed(FI) ):
-        #print z
-        #print f
-        #print 'setdiff: ', np.setdiff1d( f_i.getVar(), [z]).tolist()
-        
-        variables=np.setdiff1d( f_i.getVar(), [z]).tolist()
-        evidence=[ [v, maxed_vars[v] ] for v in variables]
-        #print 'Evidence: ',evidence
-        f=ObserveEvidence( [f], np.matrix(evidence) )[0]
-        #print f
-        values=f.getVal().tolist()
-        fidx= IndexToAssignment( np.arange( np.prod( f.getCard()  ) ), f.getCard() )
-        #print fidx
-        #print max(values)
-        maxidx=values.index(max(values))
-
-        maxed_vars[z]=int(fidx.flatten()[maxidx])
-        #print 'variable: ', z
-        #print 'max value: ', fidx.flatten()[maxidx]
-        
-        #print
-    #print maxed_vars
+    if isinstance( F, Factor ) and len( F.getVar() ) > 0:
+        assignment=np.unravel_index( int( np.argmax( F.getVal() ) ), tuple( F.getCard().tolist() ), order='F')
+        for (v, a) in zip( F.getVar().tolist(), assignment ):
+            maxed_vars[v]=int(a) + 1
+
+    for (z, var, card, argmax) in reversed( backpointers ):
+        if len(var) == 0:
+            maxed_vars[z]=int(argmax) + 1
+        else:
+            index=np.ravel_multi_index( tuple( [ maxed_vars[v]-1 for v in var.tolist() ] ), tuple( card.tolist() ), order='F')
+            maxed_vars[z]=int( argmax[index] ) + 1
     return maxed_vars
 
 
-
 def MaxDecoding ( F ):
     """ F is a list of max marginal factors passed in. The factors have a variable scope over a single variable only
         So no backtracing is inovlved, we just get the index of the highest number in the value array.
@@ -588,17 +1008,13 @@ def MaxDecodingNonUniq ( F ):
         max value. So we get the indices of the non-uniq max value as a tuple and add it to """
     ASSIGNMENTS=[]
     for f in F:
-        values=f.getVal().tolist()
-        maxvalue=max(values)
+        values=f.getVal()
         """ if the maxvalue is duplicated, we get the indices of where it resides in the value array """
-        if common.isMaxDuplicated(values):
-            dup_indices_list=[dup for dup in sorted(common.list_duplicates(values)) ]
-            dup_values= [ x for (x, y) in dup_indices_list ]
-            dup_indices= [ y for (x, y) in dup_indices_list ]
-            non_uniq_max_indices=tuple(dup_indices [ dup_values.index(maxvalue) ])
-            ASSIGNMENTS.append ( non_uniq_max_indices )
+        maxindices=np.flatnonzero( values == np.max(values) )
+        if len(maxindices) > 1:
+            ASSIGNMENTS.append ( tuple( maxindices.tolist() ) )
         else:
-            ASSIGNMENTS.append( values.index(maxvalue))
+            ASSIGNMENTS.append( int(maxindices[0]) )
     return ASSIGNMENTS
 
 
@@ -637,7 +1053,7 @@ def posterior_genotypes_values(factorList, ALPHABET,samplenames,bedstring,fh):
         
 
     
-def MaxProductVE ( Z, F ):
+def MaxProductVE ( Z, F, semiring=maxProduct ):
 
     """ A wrapper function for MaxProductEliminateVar
         sum-product variable elimination based on pseudocode algorithm 9.1 in Koller and Friedman
@@ -646,17 +1062,19 @@ def MaxProductVE ( Z, F ):
         eliminate each one getting getting the marginal distribution of the last variable in the list
         Z.
 
-        Returns the probabliity of the MAP configuration as well as the variable assignments of the MAP configuration"""
-    intermediateMaxFactors=[]
+        semiring is maxProduct, or maxSum for factors holding log values (see Semiring.py)
+
+        Returns the probabliity of the MAP configuration as well as the variable assignments of the MAP configuration.
+        The assignments are traced back with the argmax backpointers of each elimination step (see TracebackBackpointers),
+        so none of the intermediate factors are kept around"""
+    backpointers=[]
     for z in Z:
-        (F, intermediateFactor)=MaxProductEliminateVar(z, F)
-        intermediateMaxFactors.append ( intermediateFactor )
-       
-        #intermediateMaxFactors.append ( intermediateFactor )
-   
-    #MaxDecodingBT( intermediateMaxFactors, Z )
-    bt_results=TracebackMAP( intermediateMaxFactors, Z )
-    return (reduce(lambda x, y: FactorProduct(x,y), F), bt_results)
+        (F, backpointer)=MaxProductEliminateVar(z, F, semiring)
+        backpointers.append ( backpointer )
+
+    result=reduce(lambda x, y: FactorCombine(x, y, semiring), F)
+    bt_results=TracebackBackpointers( backpointers, result )
+    return (result, bt_results)
 
 
 def FactorSum ( A, B):
@@ -665,82 +1083,13 @@ def FactorSum ( A, B):
         We would use this in log space where multiplication becomes addition
 %       Based on the code here https://github.com/indapa/PGM/blob/master/Prog4/FactorSum.m """
 
-
-    C=Factor()
-
-   #check for empty factors
-    if len( A.getVar() ) == 0 :
-        sys.stderr.write("A factor is empty!\n")
-        return B
-    if len( B.getVar() ) == 0:
-        sys.stderr.write("B factor is empty!\n")
-        return A
-
-
-    #check of  variables that in both A and B have the same cardinality
-    #print 'A.getVar():  ', A.getVar()
-    #print 'B.getVar(): ',B.getVar()
-    #setA= set( A.getVar() )
-    #setB= set( B.getVar() )
-    #intersect=np.array( list( setA.intersection(setB)))
-    intersect=np.intersect1d( A.getVar(), B.getVar() ).tolist()
-    #print "Intersection of variables in FactorProduct ", intersect
-    #print "A var: ",  A.getVar()
-    #print "B var: ",  B.getVar()
-
-    #if the intersection of variables in the two factors
-    #is non-zero, then make sure they have the same cardinality
-    if len(intersect) > 0:
-        #iA=np.nonzero(intersect - A.getVar()==0)[0].tolist() # see this http://stackoverflow.com/a/432146, return the index of something in an array?
-        iA=getIndex( A.getVar(), intersect )
-        #print "iA: ", iA
-        #iB=np.nonzero(intersect - B.getVar()==0)[0].tolist()
-        iB = getIndex (  B.getVar(), intersect )
-        #print "iB: ", iB
-
-        # check to see if any of the comparisons in the  array resulting from  of a.getCard()[iA] == b.getCard()[iB]
-        # are all False. If so print an error and exit
-        if len( np.where( A.getCard()[iA].all() == B.getCard()[iB].all() ==False)[0].tolist() ) > 0:
-            sys.stderr.write("dimensionality mismatch in factors!\n")
-            sys.exit(1)
-
-    #now set the variables of C to the union of variables in factors A and B
-    #print 'setA ' ,setA
-    #print 'setB ', setB
-    #print list( setA.union(setB) )
-    C.setVar( np.union1d ( A.getVar(), B.getVar() ).tolist()  )
-    #C.setVar ( list( setA.union(setB) ) )
-    mapA=isMember(A.getVar(), C.getVar() )
-    mapB=isMember(B.getVar(), C.getVar() )
-
-
-
-    #Set the cardinality of variables in C
-    C.setCard( np.zeros( len(C.getVar())).tolist() )
-    C.getCard()[mapA]=A.getCard()
-    C.getCard()[mapB]=B.getCard()
-
-    #intitialize the values of the factor C to be zero
-    C.setVal( np.zeros(np.prod(C.getCard())).tolist() )
-
-    #some helper indices to tell what indices of A and B values to multiply
-    assignments=IndexToAssignment( np.arange(np.prod(C.getCard())), C.getCard() ) #get the assignment of values of C
-    indxA=AssignmentToIndex(  assignments[:,mapA], A.getCard())-1 # re-arrange the assignment of C, to what it would be in factor  A
-    indxB=AssignmentToIndex(  assignments[:,mapB], B.getCard())-1 # re-arange the assignment of C to what it would be in  factorB
-    #print 'indxA ', indxA
-    #print 'indxB ', indxB
-
-
-    c_val=A.getVal()[indxA.flatten().tolist()] + B.getVal()[indxB.flatten().tolist()] #now that we have the index into A.val and B.val vector, multiply them to factor product
-    C.setVal ( c_val.tolist() )
-
-    return C
+    return FactorCombine( A, B, maxSum )
 
 
 def LogFactor( F ):
     """ return a factor whose values are the  natural log of the orginal factor F  """
     
-    return Factor ( F.getVar().tolist(), F.getCard().tolist(), np.log ( F.getVal() ).tolist(), F.getName() )
+    return Factor ( F.getVar(), F.getCard(), np.log ( F.getVal() ), F.getName() )
 
 
 def ExpFactorNormalize ( logF ):
@@ -752,7 +1101,7 @@ def ExpFactorNormalize ( logF ):
         has a maximum entry of 1 and prevents overflow. See page 360 of Koller and Friedman text"""
         logPhi=logF.getVal()
         #phi=lognormalize( logPhi )
-        phi=np.exp(logPhi-np.max(logPhi) )
+        phi=np.exp(logPhi-np.max(logPhi, axis=-1, keepdims=True) )
         logF.setVal( phi )
         return logF
 
@@ -768,15 +1117,10 @@ def ExpFactor( logF ):
 
 
 
-def FactorDiv ( A, B):
-    """ FactorProduct Computes the dividend of two factors.
-%       Similiar to Factor Product, but if we divide 0/0, return 0
-    see page 365 in Koller and Friedman for definition of FactorDivision """
-
-    #print "A: ", A
-    #print "===="
-    #print "B: ", B
-    C=Factor()
+def FactorDivide ( A, B, semiring ):
+    """ the quotient of two factors in the given semiring (see Semiring.py). The tables are aligned with FactorAlign,
+        the same broadcast alignment FactorProduct uses, and divided in one vectorized call: a masked division
+        in probability space and a masked subtraction in log space, so 0/0 comes out as 0 (-inf in log space) """
 
    #check for empty factors
     if len( A.getVar() ) == 0 :
@@ -786,99 +1130,43 @@ def FactorDiv ( A, B):
         sys.stderr.write("B factor is empty!\n")
         return A
 
+    (Cvar, Ccard, numerator, denominator)=FactorAlign( A, B )
 
-    #check of  variables that in both A and B have the same cardinality
-    #print 'A.getVar():  ', A.getVar()
-    #print 'B.getVar(): ',B.getVar()
-    #setA= set( A.getVar() )
-    #setB= set( B.getVar() )
-    #intersect=np.array( list( setA.intersection(setB)))
-    intersect=np.intersect1d( A.getVar(), B.getVar() ).tolist()
-    #print "Intersection of variables in FactorProduct ", intersect
-    #print "A var: ",  A.getVar()
-    #print "B var: ",  B.getVar()
-
-    #if the intersection of variables in the two factors
-    #is non-zero, then make sure they have the same cardinality
-    if len(intersect) > 0:
-        #iA=np.nonzero(intersect - A.getVar()==0)[0].tolist() # see this http://stackoverflow.com/a/432146, return the index of something in an array?
-        iA=getIndex( A.getVar(), intersect )
-        #print "iA: ", iA
-        #iB=np.nonzero(intersect - B.getVar()==0)[0].tolist()
-        iB = getIndex (  B.getVar(), intersect )
-        #print "iB: ", iB
-
-        # check to see if any of the comparisons in the  array resulting from  of a.getCard()[iA] == b.getCard()[iB] 
-        # are all False. If so print an error and exit
-        if len( np.where( A.getCard()[iA].all() == B.getCard()[iB].all() ==False)[0].tolist() ) > 0:
-            sys.stderr.write("dimensionality mismatch in factors!\n")
-            sys.exit(1)
-
-    #now set the variables of C to the union of variables in factors A and B
-    #print 'setA ' ,setA
-    #print 'setB ', setB
-    #print list( setA.union(setB) )
-    C.setVar( np.union1d ( A.getVar(), B.getVar() ).tolist()  )
-    #C.setVar ( list( setA.union(setB) ) )
-    mapA=isMember(A.getVar(), C.getVar() )
-    mapB=isMember(B.getVar(), C.getVar() )
+    C=Factor( Cvar, Ccard )
+    Cval=semiring.divide( numerator, denominator )
+    C.setVal ( ArrayToVal( Cval, Cval.ndim > len(Cvar) ) )
 
-    
+    return C
 
-    #Set the cardinality of variables in C
-    C.setCard( np.zeros( len(C.getVar())).tolist() )
-    C.getCard()[mapA]=A.getCard()
-    C.getCard()[mapB]=B.getCard()
 
-    #intitialize the values of the factor C to be zero
-    C.setVal( np.zeros(np.prod(C.getCard())).tolist() )
+def FactorDiv ( A, B):
+    """ FactorProduct Computes the dividend of two factors.
+%       Similiar to Factor Product, but if we divide 0/0, return 0
+    see page 365 in Koller and Friedman for definition of FactorDivision
+
+    The tables are aligned with FactorAlign, the same broadcast alignment FactorProduct uses,
+    and divided in one vectorized call. Entries whose denominator is zero are masked out of the
+    division and left at 0. """
+
+    return FactorDivide( A, B, sumProduct )
 
-    #some helper indices to tell what indices of A and B values to multiply
-    assignments=IndexToAssignment( np.arange(np.prod(C.getCard())), C.getCard() ) #get the assignment of values of C
-    indxA=AssignmentToIndex(  assignments[:,mapA], A.getCard())-1 # re-arrange the assignment of C, to what it would be in factor  A
-    indxB=AssignmentToIndex(  assignments[:,mapB], B.getCard())-1 # re-arange the assignment of C to what it would be in  factorB
-    
-    numerator=A.getVal()[indxA.flatten().tolist()]
-    denominator=B.getVal()[indxB.flatten().tolist()]
-    
-    #print numerator
-    #print denominator
-    #print zip(numerator, denominator)
-    val= map( lambda x: common.zerodiv_tuple(x), zip(numerator,denominator)  )
-    #print val
-    C.setVal ( val )
-    
-    return C
 
+def LogFactorDiv ( A, B):
+    """ log space version of FactorDiv: A and B hold natural logs of factor values and
+        the quotient is their difference. 0/0 = 0 becomes -inf - -inf = -inf, so wherever
+        the denominator is -inf the result is set to -inf instead of the nan subtraction would give """
 
+    return FactorDivide( A, B, maxSum )
 
 
 
 
 def variableStride( f ):
-    """ given a Factor object f, calculate its variable stride in value array of the factor """
-    strides=[]
-    iF=IndexToAssignment ( np.arange(np.prod(f.getCard()) ), f.getCard() )
-    variables=f.getVar()
-    cardinalties=f.getCard()
-    
-    
-    for i in range(0, len(variables) ):
-        #assignment_slice=iF[:,i]
-        #var_card=cardinalties[i]
-        #print variables[i], cardinalties[i]
-        curr_stride=iF[:,i]
-        if cardinalties[i] > 1:
-            stride=np.where(curr_stride==2)
-        else:
-            stride=0
-            strides.append(stride)
-            continue
-        #print variables[i], cardinalties[i], stride[0][0]
-        strides.append( stride[0][0] )
-        #print 
-    
-    return strides
+    """ given a Factor object f, calculate its variable stride in value array of the factor
+        variables with cardinality 1 never move the position in the value array, so their stride is 0 """
+    strides=f.getStrides().copy()
+    strides[ f.getCard() <= 1 ]=0
+    return strides.tolist()
 
 
 
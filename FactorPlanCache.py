@@ -0,0 +1,110 @@
+import sys
+import numpy as np
+from collections import OrderedDict
+
+def ScopeSignature( F ):
+    """ a hashable signature of the scope of Factor F: its variables and their cardinalities.
+        Two factors with the same signature have value tables with the same layout,
+        so any index map or broadcast plan computed for one is valid for the other """
+    return ( F.getVar().tobytes(), F.getCard().tobytes() )
+
+
+def RelativeSignature( factors ):
+    """ a hashable signature of the scopes of the factors relative to each other: every variable is replaced by
+        its rank among the variables of all the factors, and the cardinalities are kept. Factors over different
+        variables laid out the same way, e.g. the cliques and messages of a chain at different positions along
+        it, get the same signature, so a plan computed on the ranks is valid for all of them.
+        Returns a tuple (signature, union, ranks) of the signature, the sorted union of the variables and the
+        ranks of each factor's variables (union[ranks[k]] is the var of the kth factor) """
+    union=np.unique( np.concatenate( [ f.getVar() for f in factors ] ) )
+    ranks=[ np.searchsorted( union, f.getVar() ) for f in factors ]
+    signature=tuple( [ ( r.tobytes(), f.getCard().tobytes() ) for (r, f) in zip( ranks, factors ) ] )
+    return ( signature, union, ranks )
+
+
+class FactorPlanCache(object):
+    """ a least recently used cache of the plans factor operations compute from the scopes of their inputs
+        (the union scope, axis permutations and broadcast shapes of FactorProduct, the reduced axes of
+        FactorMarginalization, ...). Keys are built from the relative layout of the operands (RelativeSignature:
+        which axes they share and the cardinalities, not the variable ids), so a clique tree that is calibrated
+        over and over, or a network rebuilt for every position along an interval, only pays for computing a plan
+        the first time it sees a layout, and structurally identical cliques anywhere in a network share plans.
+        A calibration of a 5,000 variable chain needs a few dozen distinct plans rather than tens of thousands.
+
+        The cache holds at most maxBytes worth of plans (estimated from the arrays and tuples in them);
+        the least recently used plans are evicted first. A maxBytes of 0 disables caching.
+        getStats() reports hits, misses, evictions and the current size of the cache. """
+
+    def __init__(self, maxBytes=16*1024*1024):
+        self.maxBytes=maxBytes
+        self.plans=OrderedDict()
+        self.planSizes={}
+        self.totalBytes=0
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+
+    def get(self, key):
+        """ return the plan stored under key, or None if there isn't one """
+        plan=self.plans.pop(key, None)
+        if plan is None:
+            self.misses+=1
+            return None
+        #re-insert so the plan becomes the most recently used
+        self.plans[key]=plan
+        self.hits+=1
+        return plan
+
+    def put(self, key, plan):
+        """ store plan under key, evicting least recently used plans to stay under maxBytes """
+        size=self.planBytes(key) + self.planBytes(plan)
+        if size > self.maxBytes:
+            return plan
+        if key in self.plans:
+            self.totalBytes-=self.planSizes[key]
+            del self.plans[key]
+        while self.totalBytes + size > self.maxBytes and len(self.plans) > 0:
+            (oldkey, oldplan)=self.plans.popitem(last=False)
+            self.totalBytes-=self.planSizes.pop(oldkey)
+            self.evictions+=1
+        self.plans[key]=plan
+        self.planSizes[key]=size
+        self.totalBytes+=size
+        return plan
+
+    def planBytes(self, obj):
+        """ rough estimate of the memory held by a plan: the buffers of its arrays
+            plus the size of the containers and scalars around them """
+        if isinstance(obj, np.ndarray):
+            return obj.nbytes + sys.getsizeof(obj)
+        if isinstance(obj, (tuple, list)):
+            return sys.getsizeof(obj) + sum( [ self.planBytes(x) for x in obj ] )
+        return sys.getsizeof(obj)
+
+    def setMaxBytes(self, maxBytes):
+        """ change the memory cap, evicting plans if the cache is now over it """
+        self.maxBytes=maxBytes
+        while self.totalBytes > self.maxBytes and len(self.plans) > 0:
+            (oldkey, oldplan)=self.plans.popitem(last=False)
+            self.totalBytes-=self.planSizes.pop(oldkey)
+            self.evictions+=1
+
+    def clear(self):
+        """ drop all plans and reset the statistics """
+        self.plans=OrderedDict()
+        self.planSizes={}
+        self.totalBytes=0
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+
+    def getStats(self):
+        """ return a dict with the hit/miss statistics and the size of the cache """
+        lookups=self.hits + self.misses
+        return { 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                 'hitRate': float(self.hits)/lookups if lookups > 0 else 0.,
+                 'plans': len(self.plans), 'bytes': self.totalBytes, 'maxBytes': self.maxBytes }
+
+    def __str__(self):
+        stats=self.getStats()
+        return "\t".join( [ key + ': ' + str(stats[key]) for key in sorted(stats) ] )
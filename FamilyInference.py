@@ -0,0 +1,77 @@
+""" exact inference over the families of a ped file. The families of a cohort file are independent pedigrees,
+    so each one gets its own network, built from a PedFamily as the file is streamed (Pedfile.yieldFamilies),
+    and the networks are solved in a pool of processes:
+
+        for (famid, ids, MARGINALS) in SolvePedfileFamilies( 'cohort.ped', alphaList, allelefreq, chrom, position ):
+            ...
+
+    The phenotypes in the ped file are the evidence. MARGINALS are the marginals of all the variables of the
+    family's network, as returned by ComputeExactMarginalsBP: for N people, the phenotypes are the variables
+    N+1..2N with every encoding, the genotypes (or paternal gene copies) 1..N """
+
+import sys
+import collections
+import multiprocessing
+import numpy as np
+from PedigreeFactors import *
+from GeneticNetworkFactory import *
+from CliqueTreeOperations import *
+
+
+NETWORK_ENCODINGS=( 'dense', 'structured', 'geneCopy', 'auto' )
+
+
+def SolveFamily( family, alphaList, allelefreq, chrom, position, encoding='dense', isMax=False ):
+    """ build the network of the PedFamily family and compute its marginals given the phenotypes in the ped file.
+        encoding is 'dense' or 'structured' for the genotype networks of GeneticNetworkFactory, 'geneCopy' for
+        GeneCopyNetworkFactory, or 'auto' to use the cheapest of them (see ChooseGeneticNetwork).
+        Returns a tuple (famid, ids, MARGINALS) """
+    order=None
+    if encoding == 'auto':
+        (factory, order, costs)=ChooseGeneticNetwork( family, alphaList, allelefreq, chrom, position )
+    else:
+        if encoding == 'geneCopy':
+            factory=GeneCopyNetworkFactory( family, alphaList, allelefreq, chrom, position )
+        else:
+            factory=GeneticNetworkFactory( family, alphaList, allelefreq, chrom, position, encoding )
+        factory.constructNetwork()
+
+    phenotypes=family.getPhenotypeEvidence()
+    E=[0] * ( 2*family.getTotalSize() )
+    for i in range( family.getTotalSize() ):
+        E[ factory.getPhenotypeVar(i)-1 ]=int( phenotypes[i] )
+
+    (MARGINALS, jointDistribution)=ComputeExactMarginalsBP( factory.getFactorList(), E, isMax, order=order )
+    return ( family.getfamid(), family.getIds(), MARGINALS )
+
+
+def SolvePedfileFamilies( pedfile, alphaList, allelefreq, chrom, position, encoding='dense', isMax=False, processes=None ):
+    """ a generator over the results of SolveFamily for the families of the ped file pedfile, in file order.
+
+        The file is read one family at a time and the families are solved by a multiprocessing pool of processes
+        workers (default: one per CPU), at most twice as many families as workers being in flight at a time so
+        memory doesn't grow with the size of the file. processes=1 solves the families in this process, without
+        a pool. The ped file is parsed in this process, so errors in it are reported here """
+    if encoding not in NETWORK_ENCODINGS:
+        sys.stderr.write("unknown network encoding: " + str(encoding) + "\n")
+        sys.exit(1)
+    families=Pedfile( pedfile ).yieldFamilies()
+    if processes == 1:
+        for family in families:
+            yield SolveFamily( family, alphaList, allelefreq, chrom, position, encoding, isMax )
+        return
+
+    if processes is None:
+        processes=multiprocessing.cpu_count()
+    pool=multiprocessing.Pool( processes )
+    pending=collections.deque()
+    try:
+        for family in families:
+            pending.append( pool.apply_async( SolveFamily, ( family, alphaList, allelefreq, chrom, position, encoding, isMax ) ) )
+            if len(pending) >= 2*processes:
+                yield pending.popleft().get()
+        while len(pending) > 0:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
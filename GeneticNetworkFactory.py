@@ -1,6 +1,8 @@
+import sys
 from Factor import *
 from FactorOperations import *
 from PedigreeFactors import *
+from EliminationOrdering import *
 import itertools
 import numpy as np
 """" Still not sure how this is going to work
@@ -11,12 +13,23 @@ import numpy as np
      list of Pedigree factors (either GenotypeAlleleFreqFactor for founders
      or GenotypeGivenParentsFactor for non-founders. Each phenotype is conditionally
      independent given its genotoype, so each member of the pedigree has a
-     PhenotypeGivenGenotypeFactor"""
+     PhenotypeGivenGenotypeFactor. Factors of the same kind reference one shared, read-only
+     value table (see SharedTables.py), so a network holds a Factor per individual
+     but only one copy of each distinct table"""
 
 class GeneticNetworkFactory(object):
     
 
-    def __init__(self, pedfile, alphaList, allelefreq, chrom, position):
+    def __init__(self, pedfile, alphaList, allelefreq, chrom, position, transmission='dense'):
+        """ transmission picks how a non-founder's genotype depends on its parents' genotypes: 'dense' is a
+            GenotypeGivenParentsFactor, with ngenos^3 entries. 'structured' introduces the alleles the child
+            inherits from each parent as variables, with an AlleleTransmissionFactor per parent and a
+            GenotypeGivenAllelesFactor for the child, which keeps the cliques small for loci with many alleles
+            (see AlleleTransmissionFactor). Both encode the same distribution over the genotypes and phenotypes """
+        if transmission not in ( 'dense', 'structured' ):
+            sys.stderr.write("unknown transmission encoding: " + str(transmission) + "\n")
+            sys.exit(1)
+        self.transmission=transmission
         #parse pedfile
         self.alphaList=alphaList
         self.allelefreq=allelefreq
@@ -24,10 +37,9 @@ class GeneticNetworkFactory(object):
         self.chrom=chrom
         self.pos=position
 
-        self.pedigree=Pedfile(pedfile)
-        self.pedigree.parsePedfile()
-        self.pedlist=self.pedigree.getPedList()
-        self.pedids=self.pedigree.returnIndivids()
+        #pedfile is a file name or a PedFamily, see LoadPedigree
+        self.pedigree=LoadPedigree(pedfile)
+        self.pedids=self.pedigree.getIds()
         #print self.pedids
 
         #list of factors that will comprise the Genetic network
@@ -37,31 +49,140 @@ class GeneticNetworkFactory(object):
         
     def constructNetwork(self):
         totalPeople=self.pedigree.getTotalSize()
+        self.factorList=self.totalFactors*[None]
         for i in range( totalPeople ):
             
             
-            if self.pedlist[i].isFounder():
-                #print self.pedlist[i].getid()
-                self.factorList[i]=GenotypeAlleleFreqFactor(self.allelefreq,i+1,self.pedlist[i].getid() + " genotype ")
+            if self.pedigree.isFounder(i):
+                #print self.pedigree.getid(i)
+                self.factorList[i]=GenotypeAlleleFreqFactor(self.allelefreq,i+1,self.pedigree.getid(i) + " genotype ")
                 #self.factorList[i]=GenotypeAlleleFreqFactor(self.allelefreq,self.pedlist[i].getid(),self.pedlist[i].getid())
                 #factorList(i)=genotypeGivenAlleleFreqsFactor(alleleFreqs,i);
             else:
                 #3print self.pedlist[i].getParents(), self.pedlist[i].getid()
                 #GenotypeGivenParentsFactor(2,"bart","homer","marge","""Bart | Homer, Marge """)
                 #self.factorList[i]=GenotypeGivenParentsFactor(self.totalAlleles, self.pedlist[i].getid(), self.pedlist[i].getParents()[0], self.pedlist[i].getParents()[1], "child|Father,Child")
-                parent1Index=self.pedids.index( self.pedlist[i].getParents()[0] )
-                parent2Index=self.pedids.index( self.pedlist[i].getParents()[1] )
-                child=self.pedlist[i].getid()
-                parent1name=self.pedlist[parent1Index].getid()
-                parent2name=self.pedlist[parent2Index].getid()
+                (parent1Index, parent2Index)=self.pedigree.getParentIndices(i)
+                child=self.pedigree.getid(i)
+                parent1name=self.pedigree.getid(parent1Index)
+                parent2name=self.pedigree.getid(parent2Index)
                 name=child+" genotype |"+parent1name+","+parent2name
-                self.factorList[i]=GenotypeGivenParentsFactor(self.totalAlleles, i+1, parent1Index+1 ,  parent2Index+1 , name)
+                if self.transmission == 'dense':
+                    self.factorList[i]=GenotypeGivenParentsFactor(self.totalAlleles, i+1, parent1Index+1 ,  parent2Index+1 , name)
+                else:
+                    (allele1, allele2)=self.getTransmittedAlleleVars(i)
+                    self.factorList[i]=GenotypeGivenAllelesFactor(self.totalAlleles, i+1, allele1, allele2, child+" genotype | alleles")
+                    self.factorList.append( AlleleTransmissionFactor(self.totalAlleles, allele1, parent1Index+1, child+" allele | "+parent1name+" genotype") )
+                    self.factorList.append( AlleleTransmissionFactor(self.totalAlleles, allele2, parent2Index+1, child+" allele | "+parent2name+" genotype") )
         
-            name=self.pedlist[i].getid()+" phenotype | " + self.pedlist[i].getid() + " genotype"
+            name=self.pedigree.getid(i)+" phenotype | " + self.pedigree.getid(i) + " genotype"
 
             self.factorList[i+totalPeople]=PhenotypeGivenGenotypeFactor(self.alphaList,i+totalPeople+1,i+1, name )
 
+    def getTransmittedAlleleVars(self, i):
+        """ the variables of the alleles the ith individual (0-based, in the order of the ped file) inherits from
+            its first and second parent with the 'structured' transmission encoding. Genotypes are variables 1..N
+            and phenotypes N+1..2N for N people, the transmitted alleles come after them """
+        totalPeople=self.pedigree.getTotalSize()
+        return ( 2*totalPeople + 2*i + 1, 2*totalPeople + 2*i + 2 )
+
+    def getPhenotypeVar(self, i):
+        """ the phenotype variable of the ith individual, 0-based in the order of the ped file """
+        return i + self.pedigree.getTotalSize() + 1
+
+    def getFactorList(self):
+        return self.factorList
+
+
+class GeneCopyNetworkFactory(object):
+    """ the de-coupled counterpart of GeneticNetworkFactory: instead of a genotype, each individual has a
+        paternal and a maternal gene copy, each the allele of one of its haplotypes. A founder's copies
+        depend on the allele frequencies (ChildCopyGivenFreqFactor), a non-founder's paternal copy on its
+        father's two copies and its maternal copy on its mother's (ChildCopyGivenParentalsFactor), and the
+        phenotype on both copies (phenotypeGivenHaplotypesFactor).
+
+        Variables 1..N are the paternal copies and 2N+1..3N the maternal copies of the N people in the
+        ped file. The phenotypes are N+1..2N as in GeneticNetworkFactory, so the same evidence vector can be
+        used with either network. A gene copy has numAlleles values where a genotype has ngenos, so the
+        cliques of this network grow more slowly with the number of alleles, but each person has two variables;
+        see ChooseGeneticNetwork for picking the cheaper network for a pedigree """
+
+    def __init__(self, pedfile, alphaList, allelefreq, chrom, position):
+        self.alphaList=alphaList
+        self.allelefreq=allelefreq
+        self.totalAlleles=len(allelefreq)
+        self.chrom=chrom
+        self.pos=position
+
+        self.pedigree=LoadPedigree(pedfile)
+        self.pedids=self.pedigree.getIds()
+
+        #two gene copies and a phenotype per individual
+        self.totalFactors=self.pedigree.getTotalSize() * 3
+        self.factorList=self.totalFactors*[None]
+
+    def constructNetwork(self):
+        totalPeople=self.pedigree.getTotalSize()
+        self.factorList=self.totalFactors*[None]
+        for i in range( totalPeople ):
+            indv=self.pedigree.getid(i)
+            (paternal, maternal)=self.getGeneCopyVars(i)
+            if self.pedigree.isFounder(i):
+                self.factorList[i]=ChildCopyGivenFreqFactor(self.allelefreq, paternal, indv + " paternal copy")
+                self.factorList[i+totalPeople]=ChildCopyGivenFreqFactor(self.allelefreq, maternal, indv + " maternal copy")
+            else:
+                (fatherIndex, motherIndex)=self.pedigree.getParentIndices(i)
+                father=self.pedigree.getid(fatherIndex)
+                mother=self.pedigree.getid(motherIndex)
+                self.factorList[i]=ChildCopyGivenParentalsFactor(self.totalAlleles, paternal, *self.getGeneCopyVars(fatherIndex), name=indv + " paternal copy | " + father + " copies")
+                self.factorList[i+totalPeople]=ChildCopyGivenParentalsFactor(self.totalAlleles, maternal, *self.getGeneCopyVars(motherIndex), name=indv + " maternal copy | " + mother + " copies")
+
+            name=indv+" phenotype | " + indv + " gene copies"
+            self.factorList[i+2*totalPeople]=phenotypeGivenHaplotypesFactor(self.alphaList, self.totalAlleles, paternal, maternal, self.getPhenotypeVar(i), name)
+
+    def getGeneCopyVars(self, i):
+        """ the paternal and maternal gene copy variables of the ith individual, 0-based in the order of the ped file """
+        totalPeople=self.pedigree.getTotalSize()
+        return ( i+1, 2*totalPeople + i+1 )
+
+    def getPhenotypeVar(self, i):
+        """ the phenotype variable of the ith individual, as in GeneticNetworkFactory """
+        return i + self.pedigree.getTotalSize() + 1
+
     def getFactorList(self):
         return self.factorList
 
 
+def NetworkCliqueCost( factorList, restarts=0 ):
+    """ estimate the cost of exact inference on the network factorList: returns a tuple (order, (totalSize, maxCliqueSize))
+        of the best elimination ordering FindEliminationOrdering finds with restarts randomized restarts, the summed
+        size of the cliques it creates and the size of the largest one (see OrderingCost) """
+    return FindEliminationOrdering( factorList, restarts=restarts, seed=0 )
+
+
+def ChooseGeneticNetwork( pedfile, alphaList, allelefreq, chrom, position, encodings=( 'dense', 'structured', 'geneCopy' ), restarts=0 ):
+    """ build the network of a pedigree with each of the encodings: 'dense' and 'structured' are the genotype
+        networks of GeneticNetworkFactory with that transmission encoding, 'geneCopy' the network of
+        GeneCopyNetworkFactory. Their clique sizes are estimated with NetworkCliqueCost, and the encoding whose
+        ordering has the smallest summed clique size wins (ties go to the smaller largest clique).
+
+        Returns a tuple (factory, order, costs): the constructed factory of the cheapest network, its elimination
+        ordering (to pass to createCliqueTree / CompiledCliqueTree as order) and a dict encoding -> (totalSize,
+        maxCliqueSize) of the estimates of all the encodings. The phenotypes are the same variables in all of the
+        networks, so evidence on the phenotypes doesn't depend on the encoding picked """
+    pedigree=LoadPedigree( pedfile )
+    best=None
+    costs={}
+    for encoding in encodings:
+        if encoding == 'geneCopy':
+            factory=GeneCopyNetworkFactory( pedigree, alphaList, allelefreq, chrom, position )
+        else:
+            factory=GeneticNetworkFactory( pedigree, alphaList, allelefreq, chrom, position, encoding )
+        factory.constructNetwork()
+        (order, cost)=NetworkCliqueCost( factory.getFactorList(), restarts )
+        costs[encoding]=cost
+        if best is None or cost < costs[ best[0] ]:
+            best=( encoding, factory, order )
+    return ( best[1], best[2], costs )
+
+
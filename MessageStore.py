@@ -0,0 +1,59 @@
+from Factor import *
+from FactorOperations import *
+
+
+class MessageStore(object):
+    """ the messages passed between the cliques of a clique tree, keyed by the directed edge (i,j): the message
+        from clique i to clique j. Only the messages actually passed are stored, so a calibrated tree over N cliques
+        holds 2(N-1) messages instead of an N x N matrix of Factor objects.
+
+        MESSAGES[i,j] works like indexing the old matrix: a message that hasn't been passed (yet) comes back as an
+        empty Factor, so getVarCount() == 0 tells whether it has been sent. """
+
+    def __init__(self):
+        self.messages={}
+
+    def __getitem__(self, edge):
+        return self.getMessage( edge[0], edge[1] )
+
+    def __setitem__(self, edge, message):
+        self.setMessage( edge[0], edge[1], message )
+
+    def __contains__(self, edge):
+        return tuple(edge) in self.messages
+
+    def __len__(self):
+        return len(self.messages)
+
+    def getMessage(self, i, j):
+        """ the message from clique i to clique j, an empty Factor if it hasn't been passed """
+        message=self.messages.get( (i,j) )
+        if message is None:
+            return Factor( [], [], [], 'factor')
+        return message
+
+    def setMessage(self, i, j, message):
+        self.messages[ (i,j) ]=message
+
+    def hasMessage(self, i, j):
+        return (i,j) in self.messages
+
+    def removeMessage(self, i, j):
+        self.messages.pop( (i,j), None )
+
+    def getEdges(self):
+        """ the directed edges (i,j) that carry a message, in sorted order """
+        return sorted( self.messages.keys() )
+
+    def clear(self):
+        self.messages={}
+
+    def getSepsetBelief(self, i, j, semiring=sumProduct):
+        """ the belief over the sepset of cliques i and j once the tree is calibrated: the product of the
+            messages passed in both directions over the edge, mu_{i,j} in section 10.2.3 of Koller and Friedman.
+            semiring is the one the tree was calibrated in (see Semiring.py) """
+        return FactorCombine( self.getMessage(i,j), self.getMessage(j,i), semiring )
+
+    def getSepsetBeliefs(self, semiring=sumProduct):
+        """ a dict with the sepset belief of every edge (i,j) of the tree, i < j """
+        return dict( [ ( (i,j), self.getSepsetBelief( i, j, semiring ) ) for (i,j) in self.getEdges() if i < j ] )
@@ -14,6 +14,14 @@ def getUniqueVar( factorList):
     return list(set().union(*[  list(f.getVar())  for f in factorList ] ))
 
 
+def getFactorName( F ):
+    """ the name of a Factor object F. The pedigree factors in PedigreeFactors.py
+        wrap a Factor object instead of subclassing it, so ask the wrapped factor """
+    if hasattr( F, 'getFactor' ):
+        return F.getFactor().getName()
+    return F.getName()
+
+
 def isMemberBoolean (A, B):
     """  returns an list of the same length as A containing True where the elements of A are in B and False otherwise """
     
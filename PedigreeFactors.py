@@ -3,6 +3,7 @@ import numpy as np
 from Factor import *
 from PGMcommon import *
 from FactorOperations import *
+from SharedTables import *
 import itertools
 
 class PhenotypeFactor (object):
@@ -66,33 +67,62 @@ class PhenotypeFactor (object):
 
 
 
+def AlleleGenotypeMappers( numAlleles ):
+    """ the shared, read-only mappers of generateAlleleGenotypeMappers for numAlleles alleles """
+    return sharedTables.get( ( 'AlleleGenotypeMappers', numAlleles ), lambda: generateAlleleGenotypeMappers(numAlleles) )
+
+
+def PhenotypeGivenGenotypeTable( alphaList ):
+    """ the alphas as an array and the val array of Pr(phenotype | genotype) over the variables phenotype, genotype:
+        alphaList[i] is the probability of being affected (phenotype 1) given the ith genotype.
+        Shared and read-only, see SharedTables.py """
+    def build():
+        alpha=np.array( alphaList, dtype=np.float64 )
+        return ( alpha, np.ravel( np.column_stack( ( alpha, 1-alpha ) ) ) )
+    return sharedTables.get( ( 'PhenotypeGivenGenotype', tuple( alphaList ) ), build )
+
+
+def GenotypeAlleleFreqTable( allelefreqs ):
+    """ the val array of Pr(genotype | allele frequencies): the product of the frequencies of the genotype's two
+        alleles, twice that for a heterozygote. Shared and read-only, see SharedTables.py """
+    def build():
+        genotypesToAlleles=AlleleGenotypeMappers( len(allelefreqs) )[1]
+        freqs=np.array( allelefreqs, dtype=np.float64 )
+        (first, second)=( genotypesToAlleles[:,0], genotypesToAlleles[:,1] )
+        return freqs[first] * freqs[second] * np.where( first == second, 1, 2 )
+    return sharedTables.get( ( 'GenotypeAlleleFreq', tuple( allelefreqs ) ), build )
+
+
+def GenotypeGivenParentsTable( numAlleles ):
+    """ the allele/genotype mappers (see generateAlleleGenotypeMappers) and the val array of
+        Pr(g_child | g_parent1, g_parent2) for numAlleles alleles, over the variables child, parent1, parent2.
+        Each of the four zygotes of the Punnett square of the parents' alleles adds 1/4 to the genotype it makes,
+        for all pairs of parental genotypes at once.
+
+        The table only depends on numAlleles, so it is computed once per allele count and shared by every
+        GenotypeGivenParentsFactor with the same number of alleles, see SharedTables.py """
+    def build():
+        (allelesToGenotypes, genotypesToAlleles)=AlleleGenotypeMappers(numAlleles)
+        ngenos=np.shape(genotypesToAlleles)[0]
+        table=np.zeros( (ngenos, ngenos, ngenos) )
+        (parent1, parent2)=np.meshgrid( np.arange(ngenos), np.arange(ngenos), indexing='ij' )
+        for (i, j) in itertools.product( range(2), range(2) ):
+            zygote=allelesToGenotypes[ genotypesToAlleles[parent1, i], genotypesToAlleles[parent2, j] ]
+            np.add.at( table, ( zygote, parent1, parent2 ), .25 )
+        return ( allelesToGenotypes, genotypesToAlleles, np.ravel( table, order='F' ) )
+    return sharedTables.get( ( 'GenotypeGivenParents', numAlleles ), build )
+
+
 class PhenotypeGivenGenotypeFactor(object):
     """ construct factor of phenotype|genotype
         #prob of being effected, given the ith genotype
-        #alphaList[i] is the prob of being effected given the ith genotype """
+        #alphaList[i] is the prob of being effected given the ith genotype
+        the factor's val array is the shared, read-only table of PhenotypeGivenGenotypeTable """
     def __init__(self,alphaList, phenotypeVar, genotypeVar , name):
-        self.phenotypeFactor=Factor( [ phenotypeVar, genotypeVar], [], [], name)
-        self.alpha=np.array ( alphaList)
+        (self.alpha, values)=PhenotypeGivenGenotypeTable( alphaList )
 
         ngenotypes=len(alphaList)
-        self.phenotypeFactor.setCard( [2, ngenotypes])
-
-        values=[x for x in range( np.prod(self.phenotypeFactor.getCard()))]
-
-        for i in range( len(alphaList )):
-
-            values[i]=alphaList[i]
-            values[i+1]=1-alphaList[i]
-        ctr=0
-        alphas=2*len(alphaList)*[None]
-        for i in range(len(alphaList)):
-            alphas[ctr]=alphaList[i];
-            ctr=ctr+1
-            alphas[ctr]=1-alphaList[i];
-            ctr=ctr+1
-
-        values=alphas
-        self.phenotypeFactor.setVal( values)
+        self.phenotypeFactor=Factor( [ phenotypeVar, genotypeVar], [2, ngenotypes], values, name)
 
     def getVar(self):
         return self.phenotypeFactor.getVar()
@@ -102,6 +132,8 @@ class PhenotypeGivenGenotypeFactor(object):
         return self.phenotypeFactor.getVal()
     def setVal(self,val):
         self.phenotypeFactor.setVal(val)
+    def getWritableVal(self):
+        return self.phenotypeFactor.getWritableVal()
     def getFactor(self):
         return self.phenotypeFactor
 
@@ -112,39 +144,20 @@ class PhenotypeGivenGenotypeFactor(object):
 
 class GenotypeAlleleFreqFactor (object):
     """ construct a factor that has the probability of each genotype
-        given allele frequencies Pr(genotype|allele_freq)"""
+        given allele frequencies Pr(genotype|allele_freq)
+        the factor's val array is the shared, read-only table of GenotypeAlleleFreqTable """
 
     def __init__(self, allelefreqs, genotypeVar, name):
         self.allelefreq=allelefreqs
         #number of alleles == number of allele frequencies passed in
         numAlleles=len(allelefreqs)
-        self.allelesToGenotypes=None
-        self.genotypesToAlleles=None
-        self.genotypeFactor=None
 
         #map alleles to genotypes and genotyeps to alleles
-        (self.allelesToGenotypes, self.genotypesToAlleles)=generateAlleleGenotypeMappers(numAlleles)
+        (self.allelesToGenotypes, self.genotypesToAlleles)=AlleleGenotypeMappers(numAlleles)
         (ngenos,ploidy)=np.shape(self.genotypesToAlleles)
 
-
-        self.genotypeFactor = Factor( [genotypeVar], [], [], name)
         #the cardinality of the factor is the number of genotypes
-        self.genotypeFactor.setCard( [ngenos] )
-
-        #set the values to zero initially
-        values=np.zeros( (np.prod(self.genotypeFactor.getCard()))).tolist()
-        
-        for i in range (ngenos):
-            alleles=self.genotypesToAlleles[i,:].tolist()
-            
-
-            if alleles[0] == alleles[1]:
-                values[i]= np.prod( [ allelefreqs[j] for j in alleles ])
-                
-            else:
-               values[i]= np.prod( [ allelefreqs[j] for j in alleles ]) * 2
-        
-        self.genotypeFactor.setVal( values )
+        self.genotypeFactor = Factor( [genotypeVar], [ngenos], GenotypeAlleleFreqTable( allelefreqs ), name)
 
 
     def getVar(self):
@@ -155,6 +168,8 @@ class GenotypeAlleleFreqFactor (object):
         return self.genotypeFactor.getVal()
     def setVal(self,val):
         self.genotypeFactor.setVal(val)
+    def getWritableVal(self):
+        return self.genotypeFactor.getWritableVal()
     def getFactor(self):
         return self.genotypeFactor
 
@@ -162,54 +177,18 @@ class GenotypeAlleleFreqFactor (object):
     def __str__(self):
         return self.genotypeFactor.__str__()
 
+
 class GenotypeGivenParentsFactor (object):
     """ construct factor that has prob of genotype of child given both parents
-        Pr(g_child| g_mother, g_father """
+        Pr(g_child| g_mother, g_father
+        the factor's val array is the shared, read-only table of GenotypeGivenParentsTable """
 
     def __init__(self,numAlleles, genotypeVarChild, genotypeVarParentOne, genotypeVarParentTwo, name):
-        self.genotypeFactor =  Factor( [genotypeVarChild, genotypeVarParentOne, genotypeVarParentTwo ], [ ], [ ], name)
-
         #map alleles to genotypes and genotyeps to alleles
-        (self.allelesToGenotypes, self.genotypesToAlleles)=generateAlleleGenotypeMappers(numAlleles)
+        (self.allelesToGenotypes, self.genotypesToAlleles, values)=GenotypeGivenParentsTable(numAlleles)
+        ngenos=np.shape(self.genotypesToAlleles)[0]
 
-        (ngenos,ploidy)=np.shape(self.genotypesToAlleles)
-        
-
-        
-        self.genotypeFactor.setCard([ ngenos,ngenos,ngenos ] )
-        #set the values to zero initially
-        values=np.zeros( (np.prod(self.genotypeFactor.getCard()))).tolist()
-
-        #iterate thru variable assignments to random variables
-        #assign probablities based on Punnet square crosses
-        assignments=IndexToAssignment( np.arange(np.prod(self.genotypeFactor.getCard())), self.genotypeFactor.getCard() )-1
-        for z in range( np.prod(self.genotypeFactor.getCard() ) ):
-            curr_assign= assignments[z]
-            childAssignment=int(curr_assign[0])
-
-            parent1gametes= self.genotypesToAlleles[curr_assign[1],:]
-            parent2gametes= self.genotypesToAlleles[curr_assign[2],:]
-            #print 'parental gametes: ', parent1gametes, parent2gametes
-            #print 'child assignment: ', childAssignment
-            #list of tuples containing list of zygote(genotype) tuples
-            zygote_list=list(itertools.product(parent1gametes,parent2gametes))
-            punnet_freq=[  self.allelesToGenotypes[zygote[0],zygote[1]] for zygote in zygote_list ]
-            histc={}
-            hist=[]
-            for g in range( ngenos):
-                histc[g]=0.
-            for x in punnet_freq:
-                histc[x]+=1.
-            #print histc.values()
-            for g in range (ngenos):
-                hist.append ( histc[g] )
-            #print punnet_freq
-            hist=(np.array ( hist)) /4
-            #print 'hist:', hist
-            #print zygote_list
-            values[z]=hist[childAssignment]
-
-        self.genotypeFactor.setVal( values )
+        self.genotypeFactor =  Factor( [genotypeVarChild, genotypeVarParentOne, genotypeVarParentTwo ], [ ngenos,ngenos,ngenos ], values, name)
 
     def getVar(self):
         return self.genotypeFactor.getVar()
@@ -219,6 +198,8 @@ class GenotypeGivenParentsFactor (object):
         return self.genotypeFactor.getVal()
     def setVal(self, val):
         self.genotypeFactor.setVal(val)
+    def getWritableVal(self):
+        return self.genotypeFactor.getWritableVal()
 
     def getFactor(self):
         return self.genotypeFactor
@@ -230,6 +211,112 @@ class GenotypeGivenParentsFactor (object):
         return self.genotypeFactor.__str__()
 
 
+def AlleleTransmissionTable( numAlleles ):
+    """ the val array of Pr(transmitted allele | parent genotype) over the variables allele, genotype:
+        a parent passes on each of its two alleles with probability 1/2 (a homozygote its only allele with
+        probability 1). Shared and read-only, see SharedTables.py """
+    def build():
+        genotypesToAlleles=AlleleGenotypeMappers(numAlleles)[1]
+        alleles=np.arange(numAlleles)[:,np.newaxis]
+        table=.5 * ( alleles == genotypesToAlleles[:,0] ) + .5 * ( alleles == genotypesToAlleles[:,1] )
+        return np.ravel( table, order='F' )
+    return sharedTables.get( ( 'AlleleTransmission', numAlleles ), build )
+
+
+def GenotypeGivenAllelesTable( numAlleles ):
+    """ the val array of the deterministic Pr(child genotype | allele one, allele two) over the variables
+        genotype, allele one, allele two: 1 for the genotype the two alleles make, 0 otherwise.
+        Shared and read-only, see SharedTables.py """
+    def build():
+        allelesToGenotypes=AlleleGenotypeMappers(numAlleles)[0]
+        ngenos=numAlleles*(numAlleles+1)/2
+        table=np.arange(ngenos)[:,np.newaxis,np.newaxis] == allelesToGenotypes[np.newaxis,:,:]
+        return np.ravel( table.astype(np.float64), order='F' )
+    return sharedTables.get( ( 'GenotypeGivenAlleles', numAlleles ), build )
+
+
+class AlleleTransmissionFactor(object):
+    """ construct factor Pr(allele | g_parent) of the allele a parent transmits to a child given the parent's genotype.
+
+        With a GenotypeGivenAllelesFactor this is a structured alternative to GenotypeGivenParentsFactor:
+        Pr(g_child | g_parent1, g_parent2) is the sum over the transmitted alleles a1, a2 of
+        Pr(a1 | g_parent1) Pr(a2 | g_parent2) Pr(g_child | a1, a2), so the two transmission factors and the
+        genotype factor, with the alleles as extra variables, encode the same distribution as the dense table.
+        The dense table has ngenos^3 entries, about numAlleles^6/8, while the largest of the structured factors
+        has ngenos*numAlleles^2, about numAlleles^4/2: 84000 entries instead of 9.3 million for 20 alleles.
+        The factors are ordinary tables, so the usual product and marginalization kernels work on them, and
+        since no factor ties a child to both parents' genotypes the cliques shrink too: for a three generation
+        pedigree with 20 alleles the largest clique goes from 9.3 million entries to 84000 """
+
+    def __init__(self, numAlleles, alleleVar, genotypeVarParent, name):
+        ngenos=numAlleles*(numAlleles+1)/2
+        self.alleleFactor=Factor( [alleleVar, genotypeVarParent], [numAlleles, ngenos], AlleleTransmissionTable(numAlleles), name)
+
+    def getVar(self):
+        return self.alleleFactor.getVar()
+    def getCard(self):
+        return self.alleleFactor.getCard()
+    def getVal(self):
+        return self.alleleFactor.getVal()
+    def setVal(self, val):
+        self.alleleFactor.setVal(val)
+    def getWritableVal(self):
+        return self.alleleFactor.getWritableVal()
+    def getFactor(self):
+        return self.alleleFactor
+
+    def __str__(self):
+        return self.alleleFactor.__str__()
+
+
+class GenotypeGivenAllelesFactor(object):
+    """ construct factor Pr(g_child | allele1, allele2) of the child's genotype given the alleles transmitted
+        by its parents, see AlleleTransmissionFactor """
+
+    def __init__(self, numAlleles, genotypeVarChild, alleleVarOne, alleleVarTwo, name):
+        ngenos=numAlleles*(numAlleles+1)/2
+        self.genotypeFactor=Factor( [genotypeVarChild, alleleVarOne, alleleVarTwo], [ngenos, numAlleles, numAlleles], GenotypeGivenAllelesTable(numAlleles), name)
+
+    def getVar(self):
+        return self.genotypeFactor.getVar()
+    def getCard(self):
+        return self.genotypeFactor.getCard()
+    def getVal(self):
+        return self.genotypeFactor.getVal()
+    def setVal(self, val):
+        self.genotypeFactor.setVal(val)
+    def getWritableVal(self):
+        return self.genotypeFactor.getWritableVal()
+    def getFactor(self):
+        return self.genotypeFactor
+
+    def __str__(self):
+        return self.genotypeFactor.__str__()
+
+
+def ChildCopyGivenParentalsTable( numAlleles ):
+    """ the val array of Pr(child copy | parent copy 1, parent copy 2) over the variables child copy,
+        parent copy 1, parent copy 2: the child inherits either of the parent's two gene copies with probability 1/2.
+        Shared and read-only, see SharedTables.py """
+    def build():
+        alleles=np.arange(numAlleles)
+        child=alleles[:,np.newaxis,np.newaxis]
+        table=.5 * ( child == alleles[np.newaxis,:,np.newaxis] ) + .5 * ( child == alleles[np.newaxis,np.newaxis,:] )
+        return np.ravel( table, order='F' )
+    return sharedTables.get( ( 'ChildCopyGivenParentals', numAlleles ), build )
+
+
+def PhenotypeGivenHaplotypesTable( alphaList, numAlleles ):
+    """ the val array of Pr(phenotype | gene copy 1, gene copy 2) over the variables phenotype, copy 1, copy 2:
+        alphaList[g] is the probability of being affected given genotype g, the genotype the two copies make.
+        Shared and read-only, see SharedTables.py """
+    def build():
+        allelesToGenotypes=AlleleGenotypeMappers(numAlleles)[0]
+        alpha=np.array( alphaList, dtype=np.float64 )[allelesToGenotypes]
+        return np.ravel( np.array( [ alpha, 1-alpha ] ), order='F' )
+    return sharedTables.get( ( 'PhenotypeGivenHaplotypes', tuple( alphaList ), numAlleles ), build )
+
+
 class ChildCopyGivenParentalsFactor(object):
     """ this represents a de-coupled factor
         given a parents two haplotypes, returns
@@ -238,42 +325,16 @@ class ChildCopyGivenParentalsFactor(object):
         haplotype. This allows for some more flexibility
         in modeling inheritance, rather than clumping
         a single parent's haplotype into a genotype
-        i.e. GenotypeGivenParentsFactor """
+        i.e. GenotypeGivenParentsFactor
+        the factor's val array is the shared, read-only table of ChildCopyGivenParentalsTable """
 
-    def __init__(self, numAlleles, geneCopyVarChild, geneCopyHapOne, geneCopyHapTwo):
+    def __init__(self, numAlleles, geneCopyVarChild, geneCopyHapOne, geneCopyHapTwo, name='child|hap1,hap2'):
         self.numalleles=numAlleles
-        self.hapone=geneCopyVarChild
+        self.hapone=geneCopyHapOne
         self.haptwo=geneCopyHapTwo
 
         #geneCopyFactor = struct('var', [], 'card', [], 'val', []);
-        self.geneCopyFactor=Factor( [geneCopyVarChild, geneCopyHapOne, geneCopyHapTwo ], [], [], 'child|hap1,hap2')
-        self.geneCopyFactor.setCard( [self.numalleles,self.numalleles,self.numalleles ])
-        values=np.zeros( np.prod([ self.numalleles,self.numalleles,self.numalleles])).tolist()
-        #this keeps track of what posiiton you are in the values list
-        index=0
-        #the number of iterations thru the nested for loops should be equal to numallels^3
-
-        for i in range(numAlleles):
-        #iterate through alleles from
-        #grand(paternal) haplotype
-            for j in range(numAlleles):
-            #iterate through alleles from
-            #grand(maternal) haplotype
-                for k in range(numAlleles):
-                #iterate thru child alleles
-                    print i, j, k
-                    if j==k:#child has grandmotherhap
-                        if i==k:#grandfatherhap is the same
-                            values[index]=1
-                        else:
-                            values[index]=.5
-                    elif i==k:#child has grandfather hap
-                        values[index]=.5
-                    else:
-                        pass
-                    index+=1
-        #print values
-        self.geneCopyFactor.setVal( values )
+        self.geneCopyFactor=Factor( [geneCopyVarChild, geneCopyHapOne, geneCopyHapTwo ], [self.numalleles,self.numalleles,self.numalleles ], ChildCopyGivenParentalsTable(numAlleles), name)
 
     def getVar(self):
         return self.geneCopyFactor.getVar()
@@ -281,6 +342,10 @@ class ChildCopyGivenParentalsFactor(object):
         return self.geneCopyFactor.getCard()
     def getVal(self):
         return self.geneCopyFactor.getVal()
+    def setVal(self, val):
+        self.geneCopyFactor.setVal(val)
+    def getWritableVal(self):
+        return self.geneCopyFactor.getWritableVal()
     def getFactor(self):
         return self.geneCopyFactor
     def __str__(self):
@@ -291,15 +356,11 @@ class ChildCopyGivenFreqFactor(object):
     given allelel freq of the locus. This factor is part of the decoupled
     Bayesian Genetic network , along with ChildCopyGivenParentalsFactor"""
     
-    def __init__(self, alleleFreqs, geneCopyVar):
+    def __init__(self, alleleFreqs, geneCopyVar, name='founderHap'):
         numAlleles = len(alleleFreqs)
-        self.geneCopyFactor=Factor( [geneCopyVar], [], [], 'founderHap')
-        self.geneCopyFactor.setCard ( [numAlleles])
-        self.geneCopyFactor.setVal( alleleFreqs )
-        #geneCopyFactor = struct('var', [], 'card', [], 'val', [])
-        #geneCopyFactor.var(1) = geneCopyVar;
-        #geneCopyFactor.card(1) = numAlleles;
         #geneCopyFactor.val = alleleFreqs';
+        values=sharedTables.get( ( 'ChildCopyGivenFreq', tuple( alleleFreqs ) ), lambda: np.array( alleleFreqs, dtype=np.float64 ) )
+        self.geneCopyFactor=Factor( [geneCopyVar], [numAlleles], values, name)
 
 
     def getVar(self):
@@ -308,45 +369,26 @@ class ChildCopyGivenFreqFactor(object):
         return self.geneCopyFactor.getCard()
     def getVal(self):
         return self.geneCopyFactor.getVal()
+    def setVal(self, val):
+        self.geneCopyFactor.setVal(val)
+    def getWritableVal(self):
+        return self.geneCopyFactor.getWritableVal()
     def getFactor(self):
-        return self.genCopyFactor
+        return self.geneCopyFactor
     def __str__(self):
         return self.geneCopyFactor.__str__()
 
 class phenotypeGivenHaplotypesFactor(object):
     """ factor represents Pr(phenotype| paternal haplotype, maternal haplotype)
     very similiar to PhenotypeGivenGenotypeFactor, but we are de-coupling into
-    paternal and maternal alleles rather than genotype"""
+    paternal and maternal alleles rather than genotype
+    the factor's val array is the shared, read-only table of PhenotypeGivenHaplotypesTable"""
 
-    def __init__(self, alphaList, numAlleles, geneCopyVarOne, geneCopyVarTwo, phenotypeVar):
+    def __init__(self, alphaList, numAlleles, geneCopyVarOne, geneCopyVarTwo, phenotypeVar, name='phenotype| geneCopy1, geneCopy2'):
         
         self.numalleles=numAlleles
         self.alphaList=alphaList
-        self.phenotypeFactor=Factor([phenotypeVar,geneCopyVarOne, geneCopyVarTwo], [], [], 'phenotype| geneCopy1, geneCopy2')
-
-        ngenos=len(alphaList)
-        self.phenotypeFactor.setCard( [ 2, numAlleles, numAlleles])
-        #phenotypeFactor.val = zeros(1, prod(phenotypeFactor.card));
-        values=np.zeros( (1, np.prod(self.phenotypeFactor.getCard()))).flatten().tolist()
-
-        affectedAlphas=alphaList
-        unaffectedAlphas=[ 1- alpha for alpha in alphaList]
-
-
-        (allelesToGenotypes, genotypesToAlleles) = generateAlleleGenotypeMappers(numAlleles)
-        assignments=IndexToAssignment( np.arange(np.prod(self.phenotypeFactor.getCard())), self.phenotypeFactor.getCard() )-1
-        for z in range( np.prod(self.phenotypeFactor.getCard() ) ):
-            curr_assign= assignments[z]
-            curr_assign=assignments[z]
-            genotype_num=allelesToGenotypes[curr_assign[1], curr_assign[2]]
-            if curr_assign[0] == 0:
-                values[z] = affectedAlphas[genotype_num]
-            else:
-                values[z] = unaffectedAlphas[genotype_num]
-        self.phenotypeFactor.setVal( values )
-
-
-            #genotype_num=allelesToGenotypes(assignment(2), assignment(3));
+        self.phenotypeFactor=Factor([phenotypeVar,geneCopyVarOne, geneCopyVarTwo], [ 2, numAlleles, numAlleles], PhenotypeGivenHaplotypesTable( alphaList, numAlleles ), name)
 
 
     def getVar(self):
@@ -355,10 +397,12 @@ class phenotypeGivenHaplotypesFactor(object):
         return self.phenotypeFactor.getCard()
     def getVal(self):
         return self.phenotypeFactor.getVal()
+    def setVal(self, val):
+        self.phenotypeFactor.setVal(val)
+    def getWritableVal(self):
+        return self.phenotypeFactor.getWritableVal()
     def getFactor(self):
         return self.phenotypeFactor
-    def __str__(self):
-        return self.phenotypeFactor.__str__()
 
     def __str__(self):
         return self.phenotypeFactor.__str__()
@@ -496,5 +540,113 @@ class Pedfile(object):
         for pedobj in self.pedlist:
             yield pedobj
 
+    def yieldFamilies(self):
+        """ read the ped file one family at a time, yielding a PedFamily for each run of consecutive lines with the
+            same family id, so only one family is in memory at a time (pedlist is not filled). The lines of a
+            family have to be contiguous, as PLINK writes them. Fields may be separated by tabs or spaces """
+        seen=set()
+        famid=None
+        lines=[]
+        for line in self.fh:
+            fields=line.split()
+            if len(fields) == 0:
+                continue
+            if fields[0] != famid:
+                if famid is not None:
+                    yield PedFamily( famid, lines )
+                famid=fields[0]
+                if famid in seen:
+                    sys.stderr.write("the lines of family " + famid + " are not contiguous in " + self.filename + "\n")
+                    sys.exit(1)
+                seen.add( famid )
+                lines=[]
+            lines.append( fields[1:6] )
+        if famid is not None:
+            yield PedFamily( famid, lines )
+
     def __str__(self):
         return "\n".join( [ x.__str__() for x in self.pedlist ] )
+
+
+class PedFamily(object):
+    """ one pedigree of a ped file, stored by column rather than as a list of Ped objects: the ids of the
+        individuals in a list, their sex and phenotype codes in string arrays, and their parents as the indices
+        (0-based, in file order) of the father and mother, -1 for a founder. A dict maps ids to indices, so
+        looking up a parent doesn't scan the family.
+
+        records is a list of [individual, paternal, maternal, sex, phenotype] string lists, the columns of a
+        ped file after the family id. Both parents of a non-founder must be in the family """
+
+    def __init__(self, famid, records):
+        self.famid=famid
+        self.ids=[ r[0] for r in records ]
+        self.index=dict( [ ( indv, i ) for (i, indv) in enumerate( self.ids ) ] )
+        if len( self.index ) < len( self.ids ):
+            sys.stderr.write("family " + famid + " lists an individual more than once\n")
+            sys.exit(1)
+        self.sex=np.array( [ r[3] for r in records ] )
+        self.pheno=np.array( [ r[4] for r in records ] )
+        self.paternal=np.array( [ self.parentIndex( r[1], r[0] ) for r in records ], dtype=np.int64 )
+        self.maternal=np.array( [ self.parentIndex( r[2], r[0] ) for r in records ], dtype=np.int64 )
+        if np.any( ( self.paternal < 0 ) != ( self.maternal < 0 ) ):
+            sys.stderr.write("family " + famid + " has individuals with only one parent in the ped file\n")
+            sys.exit(1)
+
+    def parentIndex(self, parent, indv):
+        if parent == '0':
+            return -1
+        if parent not in self.index:
+            sys.stderr.write("parent " + parent + " of " + indv + " is not in family " + self.famid + "\n")
+            sys.exit(1)
+        return self.index[parent]
+
+    def getfamid(self):
+        return self.famid
+
+    def getTotalSize(self):
+        return len( self.ids )
+
+    def getIds(self):
+        return self.ids
+
+    def getid(self, i):
+        return self.ids[i]
+
+    def getIndex(self, indv):
+        """ the index of the individual with id indv """
+        return self.index[indv]
+
+    def isFounder(self, i):
+        return self.paternal[i] < 0
+
+    def getParentIndices(self, i):
+        """ the indices of the father and mother of the ith individual, (-1, -1) for a founder """
+        return ( int( self.paternal[i] ), int( self.maternal[i] ) )
+
+    def getPhenotypeEvidence(self):
+        """ the phenotypes as evidence values for the networks of GeneticNetworkFactory, where 1 is affected and
+            2 unaffected: PLINK codes affected as 2, unaffected as 1 and missing as 0 or -9, which become 0 """
+        return np.where( self.pheno == '2', 1, np.where( self.pheno == '1', 2, 0 ) )
+
+    def getPed(self, i):
+        """ the ith individual as a Ped object """
+        ( p, m )=self.getParentIndices(i)
+        return Ped( self.famid, self.ids[i], self.ids[p] if p >= 0 else '0', self.ids[m] if m >= 0 else '0', self.sex[i], self.pheno[i] )
+
+    def getPedList(self):
+        return [ self.getPed(i) for i in range( len(self.ids) ) ]
+
+    def __str__(self):
+        return "\n".join( [ self.getPed(i).__str__() for i in range( len(self.ids) ) ] )
+
+
+def LoadPedigree( pedfile ):
+    """ a PedFamily for the network factories: pedfile is either a PedFamily, returned as is, or the name of a
+        ped file, whose individuals are read as one pedigree under the family id of its first line """
+    if isinstance( pedfile, PedFamily ):
+        return pedfile
+    pedigree=Pedfile( pedfile )
+    pedigree.parsePedfile()
+    peds=pedigree.getPedList()
+    famid=peds[0].getfamid() if len(peds) > 0 else '.'
+    return PedFamily( famid, [ [ p.getid(), p.getpid(), p.getmid(), p.getsex(), p.getpheno() ] for p in peds ] )
@@ -0,0 +1,53 @@
+""" helpers shared by the check scripts in this directory: random Bayesian networks to run inference on, and
+    a tally of the comparisons a check makes that reports the mismatches and exits with status 1 if there
+    was any """
+import sys
+import numpy as np
+from Factor import *
+
+
+def randomNetwork( seed, n, trees=1 ):
+    """ a random Bayesian network over the variables 1..n and their cardinalities, each 2 or 3. The variables
+        are split into trees consecutive blocks of n/trees variables, and each variable gets up to two parents
+        among the variables before it in its own block, so trees > 1 gives a forest. Returns (factorList, card) """
+    rng=np.random.RandomState( seed )
+    card=[ int( rng.randint(2,4) ) for i in range(n) ]
+    size=n / trees
+    factorList=[]
+    for v in range(1,n+1):
+        first=( (v-1) / size ) * size + 1
+        k=min( v-first, int( rng.randint(1,3) ) )
+        parents=[ int(p) for p in rng.choice( range(first,v), k, replace=False ) ] if k > 0 else []
+        var=[v]+parents
+        c=[ card[x-1] for x in var ]
+        factorList.append( Factor( var, c, rng.rand( int( np.prod(c) ) ), 'f'+str(v) ) )
+    return ( factorList, card )
+
+
+class Tally(object):
+    """ counts the comparisons of a check and the ones that failed:
+
+            tally=Tally( 'marginals' )
+            tally.check( np.allclose( a, b ), 'mismatch: seed', seed )
+            tally.report()
+
+        report prints 'compared N marginals, M mismatches' and exits with status 1 if M > 0, else prints 'ok' """
+
+    def __init__(self, what):
+        self.what=what
+        self.ran=0
+        self.bad=0
+
+    def check(self, ok, *message):
+        """ count a comparison; if it failed, print message and count a mismatch. Returns ok """
+        self.ran+=1
+        if not ok:
+            print ' '.join( map( str, message ) )
+            self.bad+=1
+        return ok
+
+    def report(self):
+        print 'compared', self.ran, self.what + ',', self.bad, 'mismatches'
+        if self.bad > 0:
+            sys.exit(1)
+        print 'ok'
@@ -0,0 +1,36 @@
+import sys
+import numpy as np
+from Factor import *
+from FactorOperations import *
+from CliqueTreeOperations import *
+
+""" the plans in factorPlanCache are keyed on the relative layout of the scopes (see RelativeSignature),
+    so the cliques of a long chain share a handful of plans and a repeated calibration finds all of them
+    in the cache. Build a 5,000 variable network where each variable has up to two parents among the three
+    variables before it, calibrate its clique tree twice and report the hit rate of each calibration """
+
+rng=np.random.RandomState(0)
+n=5000
+factorList=[]
+for v in range(1,n+1):
+    parents=[ int(p) for p in rng.choice( range( max(1,v-3), v ), min(2,v-1), replace=False ) ] if v > 1 else []
+    var=[v]+parents
+    factorList.append( Factor( var, [3]*len(var), rng.rand( 3**len(var) ), 'factor' ) )
+
+P=CreatePrunedInitCtree( factorList )
+
+factorPlanCache.clear()
+CliqueTreeCalibrate( P )
+first=factorPlanCache.getStats()
+print 'first calibration: ', factorPlanCache
+
+factorPlanCache.hits=factorPlanCache.misses=0
+CliqueTreeCalibrate( P )
+repeated=factorPlanCache.getStats()
+print 'repeated calibration: ', factorPlanCache
+
+print 'plans for', P.getNodeCount(), 'cliques:', first['plans']
+if repeated['misses'] > 0 or first['evictions'] > 0:
+    print 'the cache missed on a repeated calibration'
+    sys.exit(1)
+print 'ok'
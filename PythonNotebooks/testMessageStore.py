@@ -0,0 +1,28 @@
+import numpy as np
+from Factor import *
+from FactorOperations import *
+from CliqueTreeOperations import *
+from CheckCommon import *
+
+""" a calibrated clique tree over N cliques keeps exactly the 2(N-1) messages it passed in its MessageStore,
+    messages that weren't passed come back as empty factors, and the sepset belief of every edge
+    (MessageStore.getSepsetBelief) is the marginal of the brute force joint over the sepset variables """
+
+tally=Tally( 'messages and sepset beliefs' )
+n=7
+for seed in range(30):
+    J=ComputeJointDistribution( randomNetwork(seed, n)[0] )
+    for semiring in ( sumProduct, logSumProduct ):
+        P=CreatePrunedInitCtree( randomNetwork(seed, n)[0] )
+        (P, MESSAGES)=CliqueTreeCalibrate( P, semiring=semiring )
+        N=P.getNodeCount()
+        tally.check( len(MESSAGES) == 2*(N-1), 'seed', seed, semiring.name, ':', len(MESSAGES), 'messages for', N, 'cliques' )
+        tally.check( MESSAGES[ N, N ].getVarCount() == 0, 'seed', seed, semiring.name, ': a message that was never passed is not empty' )
+        for ( (i, j), belief ) in MESSAGES.getSepsetBeliefs( semiring ).iteritems():
+            sepset=belief.getVar().tolist()
+            reference=FactorMarginalization( J, [ v for v in range(1,n+1) if v not in sepset ] )
+            val=semiring.toProbability( belief.getVal() )
+            tally.check( reference.getVar().tolist() == sepset and np.allclose( val/np.sum(val), reference.getVal()/np.sum( reference.getVal() ) ),
+                         'seed', seed, semiring.name, ': wrong sepset belief on edge', (i, j) )
+
+tally.report()
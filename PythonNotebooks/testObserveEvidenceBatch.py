@@ -0,0 +1,42 @@
+import copy
+import numpy as np
+from Factor import *
+from FactorOperations import *
+from CliqueTreeOperations import *
+from CompiledCliqueTree import *
+from CheckCommon import *
+
+""" a B x N batch of evidence vectors (ObserveEvidenceBatch) is calibrated in one pass, and row b of every
+    marginal must be the marginal computed with the bth evidence vector alone. The networks are random
+    forests of two trees, so some trees see no evidence in a case; every marginal must still be B x card.
+    ComputeExactMarginalsBP, its ragged output and CompiledCliqueTree.query are checked, in sum-product
+    and max-sum """
+
+tally=Tally( 'batched marginals' )
+B=5
+for seed in range(20):
+    (factorList, card)=randomNetwork( seed, 8, trees=2 )
+    n=len(card)
+    rng=np.random.RandomState( seed+100 )
+    E=np.zeros( (B, n), dtype=np.int64 )
+    for b in range(B):
+        #only the first tree gets evidence, at most two of its variables
+        for k in rng.choice( range(n/2), int( rng.randint(0,3) ), replace=False ):
+            E[b,k]=rng.randint( 1, card[k]+1 )
+
+    for semiring in ( sumProduct, maxSum ):
+        M=ComputeExactMarginalsBP( copy.deepcopy(factorList), E, semiring=semiring )[0]
+        ( (var, offsets, values), joint )=ComputeExactMarginalsBP( copy.deepcopy(factorList), E, semiring=semiring, ragged=True )
+        C=CompiledCliqueTree( factorList, semiring=semiring )
+        Q=C.query( E )[0]
+        for b in range(B):
+            #ObserveEvidence masks the factors it is given, so every case gets its own copy
+            reference=ComputeExactMarginalsBP( copy.deepcopy(factorList), E[b].tolist(), semiring=semiring )[0]
+            for k in range(n):
+                expected=reference[k].getVal()
+                tally.check( M[k].getVal().shape == ( B, card[k] ) and Q[k].getVal().shape == ( B, card[k] )
+                             and np.allclose( M[k].getVal()[b], expected ) and np.allclose( Q[k].getVal()[b], expected )
+                             and np.allclose( values[ b, offsets[k]:offsets[k+1] ], expected ),
+                             'mismatch: seed', seed, semiring.name, 'case', b, 'variable', k+1 )
+
+tally.report()
@@ -0,0 +1,35 @@
+import numpy as np
+from Factor import *
+from FactorOperations import *
+from CliqueTreeOperations import *
+from CheckCommon import *
+
+""" the log space semirings must give the same marginals as their probability space counterparts:
+    logSumProduct as sumProduct and maxSum as maxProduct, and all four must agree with marginals
+    (max-marginals) of the brute force joint distribution. Random networks of six variables,
+    with and without evidence """
+
+def normalized( val ):
+    return val / np.max( val )
+
+tally=Tally( 'marginals' )
+n=6
+for seed in range(30):
+    for E in ( [], [ 0, 2, 0, 0, 1, 0 ] ):
+        #the joint conditioned on the evidence
+        J=ComputeJointDistribution( ObserveEvidence( randomNetwork(seed, n)[0], np.array( [ [ j+1, E[j] ] for j in range(len(E)) if E[j] > 0 ] ).reshape(-1,2) ) )
+        for (semiring, counterpart) in ( ( logSumProduct, sumProduct ), ( maxSum, maxProduct ) ):
+            M=ComputeExactMarginalsBP( randomNetwork(seed, n)[0], E, semiring=semiring )[0]
+            N=ComputeExactMarginalsBP( randomNetwork(seed, n)[0], E, semiring=counterpart )[0]
+            for v in range(1,n+1):
+                rest=[ x for x in range(1,n+1) if x != v ]
+                if semiring.isMax:
+                    reference=FactorMaxMarginalization( J, rest ).getVal()
+                else:
+                    reference=FactorMarginalization( J, rest ).getVal()
+                logspace=semiring.toProbability( M[v-1].getVal() )
+                probspace=counterpart.toProbability( N[v-1].getVal() )
+                tally.check( np.allclose( normalized(logspace), normalized(probspace) ) and np.allclose( normalized(probspace), normalized(reference) ),
+                             'mismatch: seed', seed, 'evidence', E, semiring.name, 'variable', v )
+
+tally.report()
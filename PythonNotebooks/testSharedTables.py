@@ -0,0 +1,59 @@
+import os
+import tempfile
+import numpy as np
+from FactorOperations import *
+from GeneticNetworkFactory import *
+from CheckCommon import *
+
+""" two genetic networks built from the same parameters reference the same read-only tables in sharedTables.
+    Observing evidence on the factors of one network (ObserveEvidence writes through getWritableVal) must give
+    the observed factors private copies and leave the shared tables, and the other network, untouched """
+
+pedigree=[ [ 'Ira', '0', '0', '1' ], [ 'Robin', '0', '0', '2' ], [ 'Aaron', '0', '0', '1' ],
+           [ 'Rene', 'Ira', 'Robin', '2' ], [ 'James', 'Ira', 'Robin', '1' ],
+           [ 'Eva', 'Aaron', 'Rene', '2' ], [ 'Sandra', 'Aaron', 'Rene', '2' ] ]
+(fd, pedfile)=tempfile.mkstemp( suffix='.ped' )
+fh=os.fdopen( fd, 'w' )
+for (indv, pid, mid, sex) in pedigree:
+    fh.write( "\t".join( [ 'fam', indv, pid, mid, sex, '0' ] ) + "\n" )
+fh.close()
+
+networks=[]
+for k in range(2):
+    g=GeneticNetworkFactory( pedfile, [.8,.6,.1], [.1,.9], '1', 1000 )
+    g.constructNetwork()
+    networks.append( g.getFactorList() )
+os.remove( pedfile )
+(observedNet, otherNet)=networks
+N=len(pedigree)
+
+def arrays( table ):
+    return [ a for a in ( table if isinstance( table, tuple ) else ( table, ) ) if isinstance( a, np.ndarray ) ]
+
+snapshot=dict( [ ( key, [ a.copy() for a in arrays(table) ] ) for (key, table) in sharedTables.tables.iteritems() ] )
+before=[ f.getVal() for f in otherNet ]
+
+tally=Tally( 'tables' )
+for (f, g) in zip( observedNet, otherNet ):
+    tally.check( f.getVal() is g.getVal() and not f.getVal().flags.writeable, f.getFactor().getName(), ': the table is not shared' )
+
+#the genotype of a founder and of a non-founder, and a phenotype
+evidence=np.array( [ [ 1, 2 ], [ 4, 3 ], [ N+6, 1 ] ] )
+observedNet=ObserveEvidence( observedNet, evidence )
+private=[ f.getVal() for f in observedNet ]
+ObserveEvidence( observedNet, evidence )
+
+for (key, table) in sharedTables.tables.iteritems():
+    tally.check( all( [ not a.flags.writeable and np.array_equal( a, b ) for (a, b) in zip( arrays(table), snapshot[key] ) ] ), key, ': a shared table was modified' )
+for (g, val) in zip( otherNet, before ):
+    tally.check( g.getVal() is val, g.getFactor().getName(), ': a factor of the other network lost its table' )
+for (f, g, val) in zip( observedNet, otherNet, private ):
+    observed=any( [ v in evidence[:,0] for v in f.getVar().tolist() ] )
+    if observed:
+        #the second ObserveEvidence writes into the private copy the first one made
+        tally.check( f.getVal() is not g.getVal() and f.getVal().flags.writeable and f.getVal() is val and np.any( f.getVal() != g.getVal() ),
+                     f.getFactor().getName(), ': observing evidence did not give the factor a private copy' )
+    else:
+        tally.check( f.getVal() is g.getVal(), f.getFactor().getName(), ': an unobserved factor was copied' )
+
+tally.report()
@@ -0,0 +1,50 @@
+import os
+import tempfile
+import numpy as np
+from FamilyInference import *
+from CheckCommon import *
+
+""" SolvePedfileFamilies must give the same results with a process pool as serially, in file order, and each
+    family's marginals must be those of its own network built directly with GeneticNetworkFactory and
+    solved with ComputeExactMarginalsBP. The structured encoding must give the same genotype and phenotype
+    marginals as the dense one. The cohort is a seven person pedigree repeated as 24 families with random
+    PLINK phenotypes, alternately tab and space separated """
+
+pedigree=[ [ 'Ira', '0', '0', '1' ], [ 'Robin', '0', '0', '2' ], [ 'Aaron', '0', '0', '1' ],
+           [ 'Rene', 'Ira', 'Robin', '2' ], [ 'James', 'Ira', 'Robin', '1' ],
+           [ 'Eva', 'Aaron', 'Rene', '2' ], [ 'Sandra', 'Aaron', 'Rene', '2' ] ]
+alphaList=[.8,.6,.1]
+allelefreq=[.1,.9]
+
+rng=np.random.RandomState(0)
+(fd, pedfile)=tempfile.mkstemp( suffix='.ped' )
+fh=os.fdopen( fd, 'w' )
+for f in range(24):
+    for (indv, pid, mid, sex) in pedigree:
+        fields=[ 'fam'+str(f), indv, pid, mid, sex, rng.choice( [ '1', '2', '0', '-9' ] ) ]
+        fh.write( ( ' ' if f % 2 else '\t' ).join( fields ) + "\n" )
+fh.close()
+
+tally=Tally( 'family results' )
+serial=list( SolvePedfileFamilies( pedfile, alphaList, allelefreq, '1', 1000, processes=1 ) )
+pooled=list( SolvePedfileFamilies( pedfile, alphaList, allelefreq, '1', 1000, processes=3 ) )
+structured=list( SolvePedfileFamilies( pedfile, alphaList, allelefreq, '1', 1000, encoding='structured', processes=3 ) )
+families=list( Pedfile( pedfile ).yieldFamilies() )
+os.remove( pedfile )
+
+tally.check( len(serial) == 24 and len(pooled) == 24, 'expected 24 families, got', len(serial), 'serially and', len(pooled), 'pooled' )
+for (s, p, t, family) in zip( serial, pooled, structured, families ):
+    if not tally.check( s[0] == p[0] == family.getfamid() and s[1] == p[1], 'family', family.getfamid(), 'out of order' ):
+        continue
+    g=GeneticNetworkFactory( family, alphaList, allelefreq, '1', 1000 )
+    g.constructNetwork()
+    N=family.getTotalSize()
+    E=[0]*N + family.getPhenotypeEvidence().tolist()
+    reference=ComputeExactMarginalsBP( g.getFactorList(), E )[0]
+    tally.check( all( [ np.allclose( a.getVal(), b.getVal() ) and np.allclose( a.getVal(), r.getVal() ) for (a, b, r) in zip( s[2], p[2], reference ) ] ),
+                 'family', family.getfamid(), ': pooled, serial and direct marginals differ' )
+    #the structured networks add transmitted allele variables after the phenotypes
+    tally.check( all( [ a.getVar().tolist() == b.getVar().tolist() and np.allclose( a.getVal(), b.getVal() ) for (a, b) in zip( s[2], t[2] ) ] ),
+                 'family', family.getfamid(), ': the structured encoding disagrees with the dense one' )
+
+tally.report()
@@ -0,0 +1,145 @@
+""" Sum-product, max-product and their log space counterparts only differ in how two potentials are
+    combined (multiplied or added), how variables are eliminated (summed or maxed out) and how values are
+    normalized. A Semiring object bundles those array operations so the factor kernels in FactorOperations and
+    the inference routines in CliqueTreeOperations can be written once and parameterized by the semiring.
+    See section 13.2 of Koller and Friedman for the max-product / max-sum versions of the algorithms.
+
+    The module level instances sumProduct, maxProduct, logSumProduct and maxSum are the ones to pass around. """
+
+import numpy as np
+
+
+class Semiring(object):
+    """ base class of the semirings. Values are NumPy arrays, already aligned by FactorAlign when two tables
+        are combined or divided.
+
+        isLog: the values are natural logs of potentials, so product is addition and 0 is -inf
+        isMax: variables are eliminated by taking the max (MAP queries) instead of summing them out
+        normalizeMessages: clique tree messages and marginals are normalized """
+
+    name='semiring'
+    isLog=False
+    isMax=False
+    normalizeMessages=False
+
+    def combine(self, a, b):
+        """ the product of two potentials """
+        raise NotImplementedError
+
+    def reduce(self, a, axis=None):
+        """ eliminate the given axes of a table (summing or maxing them out) """
+        raise NotImplementedError
+
+    def divide(self, a, b):
+        """ the quotient of two potentials, with 0/0 = 0 (see page 365 of Koller and Friedman) """
+        raise NotImplementedError
+
+    def normalize(self, a):
+        """ rescale a table so it sums (or maxes) to one. The last axis is the table, so each table
+            of a batch (see Factor) is normalized on its own """
+        raise NotImplementedError
+
+    def fromProbability(self, a):
+        """ convert probability space values into this semiring's values """
+        return a
+
+    def toProbability(self, a):
+        """ convert this semiring's values back into probability space """
+        return a
+
+    def __str__(self):
+        return self.name
+
+
+class SumProductSemiring(Semiring):
+    """ ordinary sum-product in probability space """
+
+    name='sum-product'
+    normalizeMessages=True
+
+    def combine(self, a, b):
+        return np.multiply(a, b)
+
+    def reduce(self, a, axis=None):
+        return np.sum(a, axis=axis)
+
+    def divide(self, a, b):
+        (a, b)=np.broadcast_arrays(a, b)
+        quotient=np.zeros( a.shape )
+        np.divide( a, b, out=quotient, where=(b != 0) )
+        return quotient
+
+    def normalize(self, a):
+        return a / np.sum(a, axis=-1, keepdims=True)
+
+
+class MaxProductSemiring(SumProductSemiring):
+    """ max-product in probability space """
+
+    name='max-product'
+    isMax=True
+    normalizeMessages=False
+
+    def reduce(self, a, axis=None):
+        return np.max(a, axis=axis)
+
+    def normalize(self, a):
+        return a / np.max(a, axis=-1, keepdims=True)
+
+
+class LogSumProductSemiring(Semiring):
+    """ sum-product in log space: products become sums and sums become log-sum-exp's.
+        Long chains of products (deep pedigrees) that underflow in probability space stay representable """
+
+    name='log-sum-product'
+    isLog=True
+    normalizeMessages=True
+
+    def combine(self, a, b):
+        return np.add(a, b)
+
+    def reduce(self, a, axis=None):
+        """ log( sum( exp(a) ) ) over the axes, shifting by the max so the exponentials don't underflow """
+        shift=np.max(a, axis=axis, keepdims=True)
+        shift[ ~np.isfinite(shift) ]=0
+        total=np.log( np.sum( np.exp(a - shift), axis=axis, keepdims=True ) ) + shift
+        if axis is None:
+            return total.reshape( () )
+        axes=axis if isinstance(axis, tuple) else (axis,)
+        return np.squeeze( total, axis=tuple( [ k % a.ndim for k in axes ] ) )
+
+    def divide(self, a, b):
+        (a, b)=np.broadcast_arrays(a, b)
+        difference=np.empty( a.shape )
+        difference.fill( -np.inf )
+        np.subtract( a, b, out=difference, where=(b != -np.inf) )
+        return difference
+
+    def normalize(self, a):
+        return a - np.expand_dims( self.reduce(a, axis=-1), -1 )
+
+    def fromProbability(self, a):
+        return np.log(a)
+
+    def toProbability(self, a):
+        return np.exp(a)
+
+
+class MaxSumSemiring(LogSumProductSemiring):
+    """ max-product in log space (max-sum) """
+
+    name='max-sum'
+    isMax=True
+    normalizeMessages=False
+
+    def reduce(self, a, axis=None):
+        return np.max(a, axis=axis)
+
+    def normalize(self, a):
+        return a - np.max(a, axis=-1, keepdims=True)
+
+
+sumProduct=SumProductSemiring()
+maxProduct=MaxProductSemiring()
+logSumProduct=LogSumProductSemiring()
+maxSum=MaxSumSemiring()
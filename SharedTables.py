@@ -0,0 +1,51 @@
+import sys
+import numpy as np
+
+
+class SharedTableCache(object):
+    """ value tables shared between the factors built from the same parameters. A network over a pedigree has a
+        factor per individual, but all the founders share the table of Pr(genotype | allele frequencies), all the
+        non-founders the table of Pr(g_child | g_parent1, g_parent2), and so on. The table of a template is built
+        once under a hashable key made of its parameters, e.g. ('GenotypeGivenParents', numAlleles), and every
+        factor built from the same parameters references the same array: the memory of a network is proportional
+        to the number of people plus the number of distinct tables rather than to people x table size.
+
+        The arrays in the cache are read-only, so a factor can't modify a table other factors share by
+        accident. Code that changes the values of a single factor either gives it a new val array (setVal) or
+        writes through Factor.getWritableVal, which copies a shared array first (copy-on-write), as ObserveEvidence does.
+        getStats() reports hits, misses and the number of tables in the cache """
+
+    def __init__(self):
+        self.tables={}
+        self.hits=0
+        self.misses=0
+
+    def get(self, key, build):
+        """ the table stored under key. If there isn't one, build() is called to compute it; its result, an
+            array or a tuple of arrays, is made read-only and stored """
+        table=self.tables.get(key)
+        if table is not None:
+            self.hits+=1
+            return table
+        self.misses+=1
+        table=build()
+        for a in ( table if isinstance( table, tuple ) else ( table, ) ):
+            if isinstance( a, np.ndarray ):
+                a.setflags(write=False)
+        self.tables[key]=table
+        return table
+
+    def __contains__(self, key):
+        return key in self.tables
+
+    def __len__(self):
+        return len(self.tables)
+
+    def clear(self):
+        self.tables={}
+
+    def getStats(self):
+        return { 'hits': self.hits, 'misses': self.misses, 'tables': len(self.tables) }
+
+
+sharedTables=SharedTableCache()
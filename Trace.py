@@ -0,0 +1,99 @@
+""" diagnostics from the inference routines. Instead of writing to a log file on every call, the routines hand
+    structured events to the module level tracer, which passes them on to the sinks that have been added to it.
+    Without sinks the tracer is disabled, and the routines check tracer.enabled before building an event, so
+    tracing costs nothing unless it has been asked for:
+
+        sink=MemoryTraceSink()
+        tracer.addSink( sink )
+        ComputeExactMarginalsBP( F, E )
+        print sink.getEvents()
+
+    An event is a name and a dict of data. The events emitted so far are
+
+        'cliqueTree'  the calibrated clique tree: 'cliques', the list of the variables of each clique,
+                      and 'edges', the (i,j) pairs, i < j, of the edges of the tree
+        'calibrate'   after CliqueTreeCalibrate: 'semiring', the name of the semiring, 'cliques', the number of
+                      cliques and 'messages', the number of messages passed (reused messages not counted) """
+
+import sys
+
+
+class MemoryTraceSink(object):
+    """ keeps the events in a list, for tests and interactive use """
+
+    def __init__(self):
+        self.events=[]
+
+    def emit(self, event, data):
+        self.events.append( ( event, data ) )
+
+    def getEvents(self, event=None):
+        """ the (event, data) pairs received, only those of the named event if event is given """
+        if event is None:
+            return self.events
+        return [ e for e in self.events if e[0] == event ]
+
+    def clear(self):
+        self.events=[]
+
+
+class FileTraceSink(object):
+    """ appends the events to a text file, one line per event with its name and data, except for the clique tree
+        which is written one line per clique and edge the way ExactMarginals.CliqueTree.log used to be.
+        The file is opened once, and each event is written with a single write call """
+
+    def __init__(self, filename, mode='a'):
+        self.filename=filename
+        self.fh=open( filename, mode )
+
+    def emit(self, event, data):
+        if event == 'cliqueTree':
+            lines=[ "node " + str(i) + ":\t" + ",".join( map( str, data['cliques'][i] ) ) for i in range( len(data['cliques']) ) ]
+            lines+=[ "edge " + str(i) + "\t" + str(j) for (i, j) in data['edges'] ]
+            self.fh.write( "\n".join( lines ) + "\n\n" )
+        else:
+            self.fh.write( event + "\t" + "\t".join( [ key + "=" + str( data[key] ) for key in sorted(data) ] ) + "\n" )
+        self.fh.flush()
+
+    def close(self):
+        self.fh.close()
+
+
+class CallbackTraceSink(object):
+    """ calls callback( event, data ) for every event """
+
+    def __init__(self, callback):
+        self.callback=callback
+
+    def emit(self, event, data):
+        self.callback( event, data )
+
+
+class Tracer(object):
+    """ dispatches events to its sinks, any objects with an emit( event, data ) method.
+        enabled is True while there is at least one sink """
+
+    def __init__(self):
+        self.sinks=[]
+        self.enabled=False
+
+    def addSink(self, sink):
+        self.sinks.append( sink )
+        self.enabled=True
+        return sink
+
+    def removeSink(self, sink):
+        self.sinks.remove( sink )
+        self.enabled=len( self.sinks ) > 0
+
+    def clear(self):
+        """ remove all the sinks, disabling the tracer """
+        self.sinks=[]
+        self.enabled=False
+
+    def emit(self, event, **data):
+        for sink in self.sinks:
+            sink.emit( event, data )
+
+
+tracer=Tracer()